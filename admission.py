@@ -0,0 +1,467 @@
+"""Admission control for /chat: rate limits, a fair wait queue and token accounting.
+
+Every chat query first takes one token from its user's bucket and one from
+the global bucket. A user can also be given an hourly budget of upstream
+tokens, which completions draw on afterwards from their `usage`. A batch
+(/chat/batch) takes a token per distinct query in one go. With the
+SQLite backend the buckets and the per-user usage totals live in one file
+shared by all gunicorn workers; with `memory` each worker keeps its own,
+so the limits apply per worker.
+
+Admitted queries then wait for one of CHAT_MAX_ACTIVE places in the worker;
+a batch holds one place per query it is running. Waiters are grouped by
+user and a freed place goes to the next user in turn, so one user with many
+open tabs waits behind everyone else rather than in front. A full queue, an exhausted bucket or a wait past
+CHAT_QUEUE_TIMEOUT is answered at once with 429 and a Retry-After. A query
+turned away by the queue gets its rate limit tokens back.
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import closing
+from datetime import datetime, timezone
+
+from metrics import ADMISSION_DECISIONS, ADMISSION_QUEUED, stage
+
+logger = logging.getLogger(__name__)
+
+
+class Rejected(Exception):
+    """The query was not admitted; retry_after is in seconds"""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class Bucket:
+    """Token bucket refilled at `rate` tokens a second up to `burst`. A bucket that is
+    not charged on take only has to be positive to admit (a usage budget, charged
+    with the actual amount afterwards)."""
+
+    def __init__(self, key, rate, burst, charge_on_take=True):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.charge_on_take = charge_on_take
+
+    def refill(self, tokens, updated_at, now):
+        if tokens is None:
+            return self.burst
+        return min(self.burst, tokens + (now - updated_at) * self.rate)
+
+    def wait(self, tokens, cost):
+        """Seconds until the bucket holds `cost` tokens"""
+        return (cost - tokens) / self.rate if self.rate > 0 else math.inf
+
+
+def max_wait(buckets, levels, cost):
+    """Seconds until every bucket admits a take of `cost` (0 = now). A cost above a
+    bucket's burst only needs a full bucket and leaves it below zero; a bucket not
+    charged on take only needs a positive level."""
+    waits = []
+    for bucket, level in zip(buckets, levels):
+        needed = min(cost, bucket.burst) if bucket.charge_on_take else 1
+        if level < needed:
+            waits.append(bucket.wait(level, needed))
+    return max(waits, default=0)
+
+
+def today():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+
+class MemoryBuckets:
+    """Buckets and usage totals of this worker only"""
+
+    backend = 'memory'
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.levels = {}
+        self.usage = {}
+
+    def take(self, buckets, now, cost=1):
+        """Take `cost` tokens from the buckets, all or none. Returns 0 when admitted, else
+        the seconds until all of them would allow it."""
+        with self.lock:
+            levels = [bucket.refill(*self.levels.get(bucket.key, (None, None)), now) for bucket in buckets]
+            wait = max_wait(buckets, levels, cost)
+            if wait:
+                return wait
+            for bucket, level in zip(buckets, levels):
+                self.levels[bucket.key] = (level - cost if bucket.charge_on_take else level, now)
+            return 0
+
+    def refund(self, buckets, now, cost=1):
+        """Give back what take() charged, for a query that was not admitted after all"""
+        with self.lock:
+            for bucket in buckets:
+                if bucket.charge_on_take:
+                    level = bucket.refill(*self.levels.get(bucket.key, (None, None)), now)
+                    self.levels[bucket.key] = (min(bucket.burst, level + cost), now)
+
+    def charge(self, bucket, amount, now):
+        with self.lock:
+            level = bucket.refill(*self.levels.get(bucket.key, (None, None)), now)
+            # May go below zero; the user waits for the refill before the next query
+            self.levels[bucket.key] = (level - amount, now)
+
+    def add_usage(self, user_id, prompt_tokens, completion_tokens):
+        with self.lock:
+            totals = self.usage.setdefault((user_id, today()), [0, 0, 0])
+            totals[0] += 1
+            totals[1] += prompt_tokens
+            totals[2] += completion_tokens
+
+    def usage_for(self, user_id):
+        with self.lock:
+            completions, prompt_tokens, completion_tokens = self.usage.get((user_id, today()), (0, 0, 0))
+        return {'day': today(), 'completions': completions, 'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens}
+
+    def level(self, bucket, now):
+        with self.lock:
+            return bucket.refill(*self.levels.get(bucket.key, (None, None)), now)
+
+
+class SQLiteBuckets:
+    """Buckets and usage totals in a SQLite file shared by every worker"""
+
+    backend = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS rate_buckets ('
+                         'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS token_usage ('
+                         'user_id INTEGER NOT NULL, day TEXT NOT NULL, completions INTEGER NOT NULL, '
+                         'prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, '
+                         'PRIMARY KEY (user_id, day))')
+
+    def _connect(self):
+        # Autocommit; transactions are opened explicitly with BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def _levels(self, conn, buckets, now):
+        placeholders = ','.join('?' * len(buckets))
+        rows = dict((key, (tokens, updated_at)) for key, tokens, updated_at in conn.execute(
+            f'SELECT key, tokens, updated_at FROM rate_buckets WHERE key IN ({placeholders})',
+            [bucket.key for bucket in buckets]))
+        return [bucket.refill(*rows.get(bucket.key, (None, None)), now) for bucket in buckets]
+
+    def take(self, buckets, now, cost=1):
+        with closing(self._connect()) as conn:
+            # Write lock up front: read, check and update without another worker in between
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                levels = self._levels(conn, buckets, now)
+                wait = max_wait(buckets, levels, cost)
+                if not wait:
+                    conn.executemany('INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) '
+                                     'VALUES (?, ?, ?)',
+                                     [(bucket.key, level - cost if bucket.charge_on_take else level, now)
+                                      for bucket, level in zip(buckets, levels)])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return wait
+
+    def refund(self, buckets, now, cost=1):
+        buckets = [bucket for bucket in buckets if bucket.charge_on_take]
+        if not buckets:
+            return
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                levels = self._levels(conn, buckets, now)
+                conn.executemany('INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                                 [(bucket.key, min(bucket.burst, level + cost), now)
+                                  for bucket, level in zip(buckets, levels)])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def charge(self, bucket, amount, now):
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                level, = self._levels(conn, [bucket], now)
+                conn.execute('INSERT OR REPLACE INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                             (bucket.key, level - amount, now))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+
+    def add_usage(self, user_id, prompt_tokens, completion_tokens):
+        with closing(self._connect()) as conn:
+            conn.execute('INSERT INTO token_usage (user_id, day, completions, prompt_tokens, completion_tokens) '
+                         'VALUES (?, ?, 1, ?, ?) ON CONFLICT (user_id, day) DO UPDATE SET '
+                         'completions = completions + 1, prompt_tokens = prompt_tokens + excluded.prompt_tokens, '
+                         'completion_tokens = completion_tokens + excluded.completion_tokens',
+                         (user_id, today(), prompt_tokens, completion_tokens))
+
+    def usage_for(self, user_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT completions, prompt_tokens, completion_tokens FROM token_usage '
+                               'WHERE user_id = ? AND day = ?', (user_id, today())).fetchone()
+        completions, prompt_tokens, completion_tokens = row or (0, 0, 0)
+        return {'day': today(), 'completions': completions, 'prompt_tokens': prompt_tokens,
+                'completion_tokens': completion_tokens}
+
+    def level(self, bucket, now):
+        with closing(self._connect()) as conn:
+            return self._levels(conn, [bucket], now)[0]
+
+
+class FairQueue:
+    """At most `max_active` admitted queries at once in this worker; the rest wait.
+
+    A freed place goes to the user who has waited their turn longest, round
+    robin, not to the oldest waiter overall. At most `max_waiting` queries
+    wait in total and `max_waiting_per_user` per user; beyond that, and
+    after `timeout` seconds of waiting, Rejected is raised.
+    """
+
+    def __init__(self, max_active, max_waiting, max_waiting_per_user, timeout):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.max_waiting_per_user = max_waiting_per_user
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        # user -> waiters (Events) in arrival order; users in the order they get their turn
+        self.queues = OrderedDict()
+        # Smoothed seconds a query holds its place, for Retry-After
+        self.hold_time = 1.0
+
+    def retry_after(self):
+        return self.hold_time * (self.waiting + 1) / self.max_active
+
+    def acquire(self, user_id):
+        with self.lock:
+            if self.active < self.max_active and not self.waiting:
+                self.active += 1
+                return
+            queue = self.queues.get(user_id)
+            if self.waiting >= self.max_waiting:
+                raise Rejected('queue_full', self.retry_after())
+            if queue is not None and len(queue) >= self.max_waiting_per_user:
+                raise Rejected('user_queue_full', self.retry_after())
+            waiter = threading.Event()
+            self.queues.setdefault(user_id, deque()).append(waiter)
+            self.waiting += 1
+            ADMISSION_QUEUED.inc()
+        try:
+            with stage('admission'):
+                granted = waiter.wait(self.timeout)
+        finally:
+            ADMISSION_QUEUED.dec()
+        if granted:
+            return
+        with self.lock:
+            if waiter.is_set():
+                # Granted just as the wait timed out
+                return
+            queue = self.queues[user_id]
+            queue.remove(waiter)
+            if not queue:
+                del self.queues[user_id]
+            self.waiting -= 1
+            raise Rejected('queue_timeout', self.retry_after())
+
+    def release(self, held):
+        with self.lock:
+            self.hold_time = 0.8 * self.hold_time + 0.2 * held
+            if not self.queues:
+                self.active -= 1
+                return
+            # Hand the place straight to the next user in turn, who goes to the back
+            user_id, queue = next(iter(self.queues.items()))
+            waiter = queue.popleft()
+            if queue:
+                self.queues.move_to_end(user_id)
+            else:
+                del self.queues[user_id]
+            self.waiting -= 1
+            waiter.set()
+
+    def stats(self):
+        with self.lock:
+            return {'active': self.active, 'waiting': self.waiting, 'waiting_users': len(self.queues),
+                    'max_active': self.max_active}
+
+
+class Ticket:
+    """An admitted query's place in the worker; give it back with release() or `with`"""
+
+    def __init__(self, admission, user_id):
+        self.admission = admission
+        self.user_id = user_id
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.admission.queue.release(time.monotonic() - self.started)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class Admission:
+    def __init__(self, store, queue, user_rate, user_burst, global_rate, global_burst, user_tokens_per_hour):
+        self.store = store
+        self.queue = queue
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.user_tokens_per_hour = user_tokens_per_hour
+
+    @property
+    def backend(self):
+        return self.store.backend
+
+    def _buckets(self, user_id):
+        """{name: Bucket} of the limits that apply to a query of user_id"""
+        buckets = {}
+        if self.user_rate:
+            buckets['requests'] = Bucket(f"user:{user_id}", self.user_rate / 60, self.user_burst)
+        if self.global_rate:
+            buckets['global_requests'] = Bucket('global', self.global_rate / 60, self.global_burst)
+        if self.user_tokens_per_hour:
+            buckets['tokens'] = self._token_budget(user_id)
+        return buckets
+
+    def _token_budget(self, user_id):
+        return Bucket(f"tokens:{user_id}", self.user_tokens_per_hour / 3600, self.user_tokens_per_hour,
+                      charge_on_take=False)
+
+    def admit(self, user_id):
+        """Ticket for a chat query of user_id, or Rejected. A query turned away by the
+        queue is not charged to the rate limits."""
+        self.check(user_id)
+        try:
+            return self.place(user_id)
+        except Rejected:
+            self.refund(user_id)
+            raise
+
+    def check(self, user_id, cost=1):
+        """Charge `cost` queries to the rate limits of user_id, or raise Rejected"""
+        buckets = list(self._buckets(user_id).values())
+        if buckets:
+            try:
+                wait = self.store.take(buckets, time.time(), cost)
+            except sqlite3.Error as e:
+                # Fail open: an unreadable limits file should not take the chat down
+                logger.error(f"Rate limit check failed: {str(e)}")
+                wait = 0
+            if wait:
+                ADMISSION_DECISIONS.labels('rate_limited').inc()
+                raise Rejected('rate_limited', wait)
+
+    def refund(self, user_id, cost=1):
+        """Give back `cost` queries charged by check() that were not run"""
+        buckets = list(self._buckets(user_id).values())
+        if buckets:
+            try:
+                self.store.refund(buckets, time.time(), cost)
+            except sqlite3.Error as e:
+                logger.error(f"Rate limit refund failed: {str(e)}")
+
+    def place(self, user_id):
+        """Ticket for one of this worker's places, waiting in turn if need be; no rate limits"""
+        try:
+            self.queue.acquire(user_id)
+        except Rejected as e:
+            ADMISSION_DECISIONS.labels(e.reason).inc()
+            raise
+        ADMISSION_DECISIONS.labels('admitted').inc()
+        return Ticket(self, user_id)
+
+    def record_usage(self, user_id, usage):
+        """Add a completion's `usage` to the user's totals and token budget"""
+        prompt_tokens = usage.get('prompt_tokens') or 0
+        completion_tokens = usage.get('completion_tokens') or 0
+        try:
+            self.store.add_usage(user_id, prompt_tokens, completion_tokens)
+            if self.user_tokens_per_hour:
+                self.store.charge(self._token_budget(user_id), prompt_tokens + completion_tokens, time.time())
+        except sqlite3.Error as e:
+            logger.error(f"Token usage write failed: {str(e)}")
+
+    def usage(self, user_id):
+        """Today's totals for user_id and what is left of their limits"""
+        now = time.time()
+        report = self.store.usage_for(user_id)
+        for name, bucket in self._buckets(user_id).items():
+            report[f"{name}_available"] = max(0, math.floor(self.store.level(bucket, now)))
+        return report
+
+    def stats(self):
+        return dict(self.queue.stats(), backend=self.backend)
+
+
+class NoAdmission:
+    backend = 'none'
+
+    def admit(self, user_id):
+        return NoTicket()
+
+    def check(self, user_id, cost=1):
+        pass
+
+    def refund(self, user_id, cost=1):
+        pass
+
+    def place(self, user_id):
+        return NoTicket()
+
+    def record_usage(self, user_id, usage):
+        pass
+
+    def usage(self, user_id):
+        return None
+
+    def stats(self):
+        return None
+
+
+class NoTicket:
+    def release(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def create_admission(config):
+    backend = config['ADMISSION_BACKEND']
+    if backend == 'none':
+        return NoAdmission()
+    store = SQLiteBuckets(config['ADMISSION_PATH']) if backend == 'sqlite' else MemoryBuckets()
+    queue = FairQueue(config['CHAT_MAX_ACTIVE'], config['CHAT_MAX_QUEUED'], config['CHAT_MAX_QUEUED_PER_USER'],
+                      config['CHAT_QUEUE_TIMEOUT'])
+    return Admission(store, queue, config['USER_RATE_LIMIT'], config['USER_RATE_BURST'],
+                     config['GLOBAL_RATE_LIMIT'], config['GLOBAL_RATE_BURST'], config['USER_TOKENS_PER_HOUR'])
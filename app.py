@@ -1,30 +1,55 @@
 import logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_from_directory
+from flask import Flask, Blueprint, copy_current_request_context, current_app, g, render_template, request, redirect, url_for, session, jsonify, send_file, send_from_directory, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from werkzeug.local import LocalProxy
+from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
-import requests
 import os
-import PyPDF2
+import json
+import mimetypes
+import base64
+import binascii
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
+from functools import partial
 import re
-import openai
-from azure.identity import DefaultAzureCredential
-from flask_migrate import Migrate
+import click
+from admission import Rejected
+from azure_client import UpstreamBusy, UpstreamError, CircuitOpen
+from response_cache import cache_key
+from conversation import (MESSAGE_OVERHEAD, count_tokens, fingerprint, fit_turns, is_follow_up,
+                          message_tokens, summary_chunks, summary_messages, turn_messages, turn_tokens)
+from db_engine import configure_engine, engine_options
+from documents import UploadRejected, receive_upload
+from services import Services
+from session_store import SQLiteSessionInterface
+from config import instance_secret_key
+import assets
+import chat_search
+import logging_setup
+import metrics
+from metrics import stage
+from sqlalchemy import inspect, insert, or_, and_
 
+db = SQLAlchemy()
+bp = Blueprint('main', __name__, cli_group=None)
 
-app = Flask(__name__, static_folder='static')
-app.config.from_object('config.Config')
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+# Built lazily per app (see services.py); the names read like the module globals they replaced
+services = LocalProxy(lambda: current_app.extensions['services'])
+azure_client = LocalProxy(lambda: services.azure_client)
+response_cache = LocalProxy(lambda: services.response_cache)
+similar_queries = LocalProxy(lambda: services.similar_queries)
+single_flight = LocalProxy(lambda: services.single_flight)
+pdf_store = LocalProxy(lambda: services.pdf_store)
+pdf_catalog = LocalProxy(lambda: services.pdf_catalog)
+pdf_index = LocalProxy(lambda: services.pdf_index)
+keyword_matcher = LocalProxy(lambda: services.keyword_matcher)
+admission = LocalProxy(lambda: services.admission)
 
-from sqlalchemy import inspect
-
-def initialize_database():
+def initialize_database(app):
     """Initialize database with proper permissions"""
     with app.app_context():
         try:
@@ -47,8 +72,9 @@ def initialize_database():
             if not os.path.exists(db_path):
                 db.create_all()
                 logger.info(f"Created database at {db_path}")
-                os.chmod(db_path, 0o666)
-                logger.info("Set database file permissions")
+                if os.path.exists(db_path):
+                    os.chmod(db_path, 0o666)
+                    logger.info("Set database file permissions")
             else:
                 logger.info("Database already exists")
             
@@ -64,24 +90,48 @@ def initialize_database():
             logger.exception("Detailed traceback:")
             return False
 
+@bp.cli.command('bootstrap')
+def bootstrap_command():
+    """One-time setup per deploy: folders, tables, migrations and the PDF index"""
+    from flask_migrate import upgrade
+
+    if not initialize_database(current_app):
+        raise click.ClickException("Database initialization failed")
+    upgrade()
+    backfill_chat_search_command.callback(batch_size=5000, rebuild=False)
+    if current_app.config['RAG_ENABLED']:
+        changed = pdf_index.refresh()
+        print(f"PDF index generation {pdf_index.generation} ({'rebuilt' if changed else 'up to date'})")
+    build_assets_command.callback()
+    print("Bootstrap complete")
+
+@bp.cli.command('build-assets')
+def build_assets_command():
+    """Write hashed, precompressed copies of the static files for /assets/"""
+    manifest = assets.build_assets(current_app.static_folder, current_app.config['ASSETS_BUILD_DIR'])
+    print(f"Built {len(manifest)} assets into {current_app.config['ASSETS_BUILD_DIR']}")
+
+@bp.cli.command('backfill-chat-search')
+@click.option('--batch-size', default=5000, show_default=True, help='Chats indexed per transaction')
+@click.option('--rebuild', is_flag=True, help='Reindex every chat, not only the missing ones')
+def backfill_chat_search_command(batch_size, rebuild):
+    """Add chats saved before the search index existed to it"""
+    indexed = chat_search.backfill(db.engine, batch_size, rebuild)
+    print(f"Indexed {indexed} chats for search")
 
-# Initialize database
-if not initialize_database():
-    logger.error("Failed to initialize database")
-    if os.environ.get('FLASK_ENV') == 'production':
-        raise RuntimeError("Database initialization failed in production")
-
-# OpenAI Configuration with error handling
-try:
-    openai.api_type = "azure"
-    openai.api_key = app.config['AZURE_OPENAI_API_KEY']
-    openai.api_base = app.config['AZURE_OPENAI_ENDPOINT']
-    openai.api_version = app.config['API_VERSION']
-    DEPLOYMENT_NAME = app.config['DEPLOYMENT_NAME']
-    logger.info("OpenAI configuration loaded successfully")
-except Exception as e:
-    logger.error(f"Error loading OpenAI configuration: {str(e)}")
-    raise
+@bp.cli.command('index-pdfs')
+def index_pdfs_command():
+    """Rebuild the PDF retrieval index from PDF_FOLDER"""
+    changed = pdf_index.refresh()
+    print(f"PDF index generation {pdf_index.generation} ({'rebuilt' if changed else 'up to date'})")
+
+@bp.cli.command('dedupe-pdfs')
+def dedupe_pdfs_command():
+    """Move loose PDFs into the content-addressed store, keeping one copy per content"""
+    summary = pdf_store.dedupe()
+    pdf_catalog.refresh(force=True)
+    print(f"Stored {summary['files']} files as {summary['blobs']} blobs "
+          f"({summary['aliases']} names, {summary['bytes_saved']} bytes saved)")
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -99,72 +149,50 @@ class Chat(db.Model):
     response = db.Column(db.Text, nullable=False)
     pdf_preview = db.Column(db.Boolean, default=False)
     embedded_website = db.Column(db.Text, nullable=True)
-    timestamp = db.Column(db.DateTime, default=db.func.current_timestamp())
+    # Set in Python, so it is stored in the same format the history cursor binds
+    timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
+
+    # Serves the per-user, newest-first keyset pagination of the history
+    __table_args__ = (db.Index('ix_chats_user_id_timestamp', 'user_id', 'timestamp', 'id'),)
+
+class ChatSummary(db.Model):
+    """Rolling summary of a user's turns that no longer fit the prompt"""
+    __tablename__ = 'chat_summaries'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    summary = db.Column(db.Text, nullable=False)
+    # Newest Chat row folded into the summary
+    last_chat_id = db.Column(db.Integer, nullable=False)
+    tokens = db.Column(db.Integer, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
 
 def clean_response(text):
     text = re.sub(r'[\*\#]', '', text)
     return text.strip()
-# Your existing keyword_links dictionary
-keyword_links = {
-    "Arduino": ["https://blog.arduino.cc/", "https://www.instructables.com/howto/Arduino/"],
-    "Bluetooth Controlled Robot Car": ["https://circuitdigest.com/bluetooth-projects", "https://www.electronicshub.org/bluetooth-controlled-car-using-arduino/"],
-    "IoT": ["https://www.iotforall.com/", "https://www.hackster.io/iot/projects"],
-    "Capacitor": ["https://www.allaboutcircuits.com/textbook/direct-current/chpt-13/capacitors/", "https://www.electronics-tutorials.ws/capacitor/cap_1.html"],
-    "Robotics": ["https://www.robotshop.com/community/blog", "https://robohub.org/"],
-    "Robotics Algorithms": ["https://towardsdatascience.com/tagged/robotics", "https://blogs.mathworks.com/robotics/"],
-    "Circuit": ["https://www.electronicshub.org/", "https://circuitdigest.com/"],
-    "Lead Acid Battery": ["https://batteryuniversity.com/article/bu-201-lead-acid-battery", "https://www.sciencedirect.com/topics/engineering/lead-acid-battery"],
-    "Electrolytic Capacitors": ["https://www.electronics-tutorials.ws/capacitor/cap_7.html", "https://www.eevblog.com/"],
-    "Ceramic Capacitors": ["https://www.electronics-tutorials.ws/capacitor/cap_3.html", "https://components101.com/articles/ceramic-capacitor-types-and-applications"],
-    "Electrolytic vs. Ceramic Capacitors": ["https://www.electronics-notes.com/articles/electronic_components/capacitors/capacitor-types-ceramic-electrolytic-tantalum.php", "https://www.arrow.com/en/research-and-events/articles/electrolytic-vs-ceramic-capacitors"],
-    "Node MCU": ["https://randomnerdtutorials.com/tag/nodemcu/", "https://maker.pro/esp8266/tutorials"],
-    "Lithium Ion Battery": ["https://batteryuniversity.com/learn/article/lithium_based_batteries", "https://www.electronics-notes.com/articles/electronic_components/battery-technology/lithium-ion-li-ion.php"],
-    "Line Follower Robot": ["https://www.robotshop.com/community/forum/t/line-follower-robots/27408", "https://www.instructables.com/howto/line+follower+robot/"],
-    "Home Automation": ["https://www.home-assistant.io/blog/", "https://circuitdigest.com/home-automation-projects"],
-    "ESP8266": ["https://randomnerdtutorials.com/esp8266-web-server/", "https://www.electronicwings.com/nodemcu/esp8266"],
-    "capacitor":["https://www.allaboutcircuits.com/textbook/direct-current/chpt-13/capacitors/", "https://www.electronics-tutorials.ws/capacitor/cap_1.html"],
-     "arduino": ["https://blog.arduino.cc/", "https://www.instructables.com/howto/Arduino/"],
-    "bluetooth controlled robot car": ["https://circuitdigest.com/bluetooth-projects", "https://www.electronicshub.org/bluetooth-controlled-car-using-arduino/"],
-    "iot": ["https://www.iotforall.com/", "https://www.hackster.io/iot/projects"],
-    "capacitor": ["https://www.allaboutcircuits.com/textbook/direct-current/chpt-13/capacitors/", "https://www.electronics-tutorials.ws/capacitor/cap_1.html"],
-    "robotics": ["https://www.robotshop.com/community/blog", "https://robohub.org/"],
-    "robotics algorithms": ["https://towardsdatascience.com/tagged/robotics", "https://blogs.mathworks.com/robotics/"],
-    "circuit": ["https://www.electronicshub.org/", "https://circuitdigest.com/"],
-    "lead acid battery": ["https://batteryuniversity.com/article/bu-201-lead-acid-battery", "https://www.sciencedirect.com/topics/engineering/lead-acid-battery"],
-    "electrolytic capacitors": ["https://www.electronics-tutorials.ws/capacitor/cap_7.html", "https://www.eevblog.com/"],
-    "ceramic capacitors": ["https://www.electronics-tutorials.ws/capacitor/cap_3.html", "https://components101.com/articles/ceramic-capacitor-types-and-applications"],
-    "electrolytic vs. ceramic capacitors": ["https://www.electronics-notes.com/articles/electronic_components/capacitors/capacitor-types-ceramic-electrolytic-tantalum.php", "https://www.arrow.com/en/research-and-events/articles/electrolytic-vs-ceramic-capacitors"],
-    "node mcu": ["https://randomnerdtutorials.com/tag/nodemcu/", "https://maker.pro/esp8266/tutorials"],
-    "lithium ion battery": ["https://batteryuniversity.com/learn/article/lithium_based_batteries", "https://www.electronics-notes.com/articles/electronic_components/battery-technology/lithium-ion-li-ion.php"],
-    "line follower robot": ["https://www.robotshop.com/community/forum/t/line-follower-robots/27408", "https://www.instructables.com/howto/line+follower+robot/"],
-    "home automation": ["https://www.home-assistant.io/blog/", "https://circuitdigest.com/home-automation-projects"],
-    "esp8266": ["https://randomnerdtutorials.com/esp8266-web-server/", "https://www.electronicwings.com/nodemcu/esp8266"],
-    "capacitor":["https://www.allaboutcircuits.com/textbook/direct-current/chpt-13/capacitors/", "https://www.electronics-tutorials.ws/capacitor/cap_1.html"],
-     "bluetooth controlled robot car": ["https://circuitdigest.com/bluetooth-projects", "https://www.electronicshub.org/bluetooth-controlled-car-using-arduino/"],
-    "iot": ["https://www.iotforall.com/", "https://www.hackster.io/iot/projects"],
-    "capacitors": ["https://www.allaboutcircuits.com/textbook/direct-current/chpt-13/capacitors/", "https://www.electronics-tutorials.ws/capacitor/cap_1.html"],
-    "robo": ["https://www.robotshop.com/community/blog", "https://robohub.org/"],
-    "robo algo": ["https://towardsdatascience.com/tagged/robotics", "https://blogs.mathworks.com/robotics/"],
-    "circuits": ["https://www.electronicshub.org/", "https://circuitdigest.com/"],
-    "lead  battery": ["https://batteryuniversity.com/article/bu-201-lead-acid-battery", "https://www.sciencedirect.com/topics/engineering/lead-acid-battery"],
-    "electric capacitors": ["https://www.electronics-tutorials.ws/capacitor/cap_7.html", "https://www.eevblog.com/"],
-    "ceramic": ["https://www.electronics-tutorials.ws/capacitor/cap_3.html", "https://components101.com/articles/ceramic-capacitor-types-and-applications"],
-    "electrolytic vs. ceramic": ["https://www.electronics-notes.com/articles/electronic_components/capacitors/capacitor-types-ceramic-electrolytic-tantalum.php", "https://www.arrow.com/en/research-and-events/articles/electrolytic-vs-ceramic-capacitors"],
-    "nodemcu": ["https://randomnerdtutorials.com/tag/nodemcu/", "https://maker.pro/esp8266/tutorials"],
-    "lithium battery": ["https://batteryuniversity.com/learn/article/lithium_based_batteries", "https://www.electronics-notes.com/articles/electronic_components/battery-technology/lithium-ion-li-ion.php"],
-    "line follow robot": ["https://www.robotshop.com/community/forum/t/line-follower-robots/27408", "https://www.instructables.com/howto/line+follower+robot/"],
-    "automatic home": ["https://www.home-assistant.io/blog/", "https://circuitdigest.com/home-automation-projects"],
-    "chip": ["https://randomnerdtutorials.com/esp8266-web-server/", "https://www.electronicwings.com/nodemcu/esp8266"],
-    "capacitor types":["https://www.allaboutcircuits.com/textbook/direct-current/chpt-13/capacitors/", "https://www.electronics-tutorials.ws/capacitor/cap_1.html"],
-
-}
-
-
-@app.route('/')
+
+def clean_response_stream(chunks):
+    """Incremental clean_response: yields cleaned pieces whose concatenation equals clean_response(''.join(chunks))"""
+    started = False
+    pending_ws = ''
+    for chunk in chunks:
+        text = re.sub(r'[\*\#]', '', chunk)
+        if not started:
+            text = text.lstrip()
+            if not text:
+                continue
+            started = True
+        # Hold back trailing whitespace until we know it is not the end of the answer
+        body = text.rstrip()
+        if not body:
+            pending_ws += text
+            continue
+        yield pending_ws + body
+        pending_ws = text[len(body):]
+
+@bp.route('/')
 def home():
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         try:
@@ -188,18 +216,12 @@ def register():
             # Create new user
             password_hash = generate_password_hash(password)
             new_user = User(username=username, email=email, password=password_hash)
-            
-            # Log database path and permissions
-            db_path = os.path.join(app.config['INSTANCE_PATH'], 'site.db')
-            logger.info(f"Database path: {db_path}")
-            if os.path.exists(db_path):
-                logger.info(f"Database file permissions: {oct(os.stat(db_path).st_mode)[-3:]}")
-            
+
             db.session.add(new_user)
             db.session.commit()
             
             logger.info(f"User registered successfully: {email}")
-            return redirect(url_for('login'))
+            return redirect(url_for('.login'))
 
         except Exception as e:
             db.session.rollback()
@@ -209,50 +231,56 @@ def register():
 
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     try:
         if request.method == 'POST':
-            logger.info("Login POST method called.")  # DEBUG LOG 1
-
             email = request.form['email']
             password = request.form['password']
 
-            logger.info(f"Form data received: email={email}, password={password}")  # DEBUG LOG 2
-
             user = User.query.filter_by(email=email).first()
-            logger.info(f"User query result: {user}")  # DEBUG LOG 3
+            logger.debug(f"Login attempt: email={email}, user found={user is not None}")
 
             if user and check_password_hash(user.password, password):
+                # New session id on login, so an id handed out before it cannot be reused
+                session.regenerate()
                 session['user_id'] = user.id
-                logger.info(f"User logged in successfully: {email}")  # DEBUG LOG 4
-                return redirect(url_for('ghat'))
+                services.user_cache.set(user.id, True)
+                logger.info(f"User logged in successfully: {email}")
+                return redirect(url_for('.ghat'))
             
-            logger.warning(f"Failed login attempt: email={email}")  # DEBUG LOG 5
+            logger.warning(f"Failed login attempt: email={email}")
             return render_template('login.html', error="Invalid credentials. Please try again.")
     except Exception as e:
-        logger.error(f"Error in login route: {str(e)}")  # DEBUG LOG 6
+        logger.error(f"Error in login route: {str(e)}")
         return render_template('login.html', error="An error occurred during login. Please try again.")
     return render_template('login.html')
 
 
-@app.route('/health')
+@bp.route('/health')
 def health_check():
     try:
         # Try to query the database
         User.query.first()
-        db_path = os.path.join(app.config['INSTANCE_PATH'], 'site.db')
+        db_path = os.path.join(current_app.config['INSTANCE_PATH'], 'site.db')
         
         health_data = {
             'status': 'healthy',
+            'response_cache': response_cache.stats(),
+            'similar_queries': similar_queries.stats(),
+            'single_flight': single_flight.stats(),
+            'admission': admission.stats(),
+            'history_writer': services.history_writer.stats() if services.history_writer is not None else None,
+            'documents': services.documents.stats(),
+            'logging': logging_setup.stats(),
             'database': 'connected',
             'database_path': db_path,
-            'instance_path': app.config['INSTANCE_PATH'],
+            'instance_path': current_app.config['INSTANCE_PATH'],
             'permissions': {
-                'instance_dir': oct(os.stat(app.config['INSTANCE_PATH']).st_mode)[-3:],
+                'instance_dir': oct(os.stat(current_app.config['INSTANCE_PATH']).st_mode)[-3:],
                 'database': oct(os.stat(db_path).st_mode)[-3:] if os.path.exists(db_path) else 'not_found',
-                'pdf_folder': oct(os.stat(app.config['PDF_FOLDER']).st_mode)[-3:],
-                'upload_folder': oct(os.stat(app.config['UPLOAD_FOLDER']).st_mode)[-3:]
+                'pdf_folder': oct(os.stat(current_app.config['PDF_FOLDER']).st_mode)[-3:],
+                'upload_folder': oct(os.stat(current_app.config['UPLOAD_FOLDER']).st_mode)[-3:]
             }
         }
         
@@ -262,44 +290,103 @@ def health_check():
         return jsonify({
             'status': 'unhealthy',
             'error': str(e),
-            'database_path': app.config['SQLALCHEMY_DATABASE_URI'],
-            'instance_path': app.config['INSTANCE_PATH']
+            'database_path': current_app.config['SQLALCHEMY_DATABASE_URI'],
+            'instance_path': current_app.config['INSTANCE_PATH']
         }), 500
 
-@app.route('/ghat')
+def current_user_id():
+    """Id of the logged-in user, or None; the user row is checked at most once per
+    USER_CACHE_TTL seconds in each worker"""
+    user_id = session.get('user_id')
+    if user_id is None or services.user_cache.get(user_id):
+        return user_id
+    if db.session.get(User, user_id) is None:
+        # Account deleted since login
+        session.clear()
+        return None
+    services.user_cache.set(user_id, True)
+    return user_id
+
+@bp.route('/ghat')
 def ghat():
-    if 'user_id' in session:
+    if current_user_id() is not None:
         return render_template('ghat.html')
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
-@app.route('/chat', methods=['GET', 'POST'])
+def rejected_response(e):
+    """429 for a query turned away by admission control"""
+    logger.info(f"Chat query rejected: {e.reason}, retry after {e.retry_after}s")
+    message = RATE_LIMITED_MESSAGE if e.reason == 'rate_limited' else BUSY_MESSAGE
+    return jsonify({'error': message, 'ai_response': message, 'reason': e.reason,
+                    'retry_after': e.retry_after}), 429, {'Retry-After': str(e.retry_after)}
+
+def charge_usage(user_id):
+    """Book the upstream tokens this request used to the user"""
+    usage = g.pop('upstream_usage', None)
+    if usage:
+        admission.record_usage(user_id, usage)
+
+def admitted_stream(ticket, user_id, events):
+    """Hold the admission ticket until the streamed answer is finished; the route also
+    releases it when the response is closed"""
+    try:
+        with ticket:
+            yield from events
+    finally:
+        charge_usage(user_id)
+
+@bp.route('/chat', methods=['GET', 'POST'])
 def chat():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    user_id = session['user_id']
+    user_id = current_user_id()
+    if user_id is None:
+        return redirect(url_for('.login'))
     
     try:
         if request.method == 'POST':
             query = request.form.get('query', '').strip()
             if not query:
                 return jsonify({'error': 'Query cannot be empty'}), 400
-                
-            response_data = process_search_query(query, user_id)
+            try:
+                ticket = admission.admit(user_id)
+            except Rejected as e:
+                return rejected_response(e)
+
+            if 'text/event-stream' in request.headers.get('Accept', ''):
+                response = Response(
+                    stream_with_context(admitted_stream(ticket, user_id, stream_search_query(query, user_id))),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+                )
+                # The body may never run (client gone before the first chunk); closing the
+                # response still gives the place back
+                response.call_on_close(ticket.release)
+                return response
+
+            with ticket:
+                response_data = process_search_query(query, user_id)
+            charge_usage(user_id)
             return jsonify(response_data)
             
         else:
             query = request.args.get('query', '')
-            chat_history = db.session.query(Chat).filter(Chat.user_id == user_id).order_by(Chat.timestamp.desc()).all()
-            
+
             if query:
-                response_data = process_search_query(query, user_id)
+                try:
+                    ticket = admission.admit(user_id)
+                except Rejected as e:
+                    return rejected_response(e)
+                with ticket:
+                    response_data = process_search_query(query, user_id)
+                charge_usage(user_id)
+                chat_history, next_cursor = chat_history_page(user_id)
                 return render_template('chat.html', 
                                     chat_history=chat_history,
+                                    next_cursor=next_cursor,
                                     current_query=query,
                                     current_response=response_data)
             
-            return render_template('chat.html', chat_history=chat_history)
+            chat_history, next_cursor = chat_history_page(user_id)
+            return render_template('chat.html', chat_history=chat_history, next_cursor=next_cursor)
             
     except Exception as e:
         logger.error(f"Error in chat route: {str(e)}")
@@ -307,78 +394,671 @@ def chat():
             return jsonify({'error': 'An error occurred processing your request'}), 500
         return render_template('chat.html', error="An error occurred. Please try again.")
 
-def process_search_query(query, user_id):
+@bp.route('/chat/usage')
+def chat_usage():
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Not logged in'}), 401
+    return jsonify({'usage': admission.usage(user_id)})
+
+@bp.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """Answer many queries in one call: {"queries": [...]} -> {"results": [...]} in input order.
+
+    Repeated queries are answered once, BATCH_CONCURRENCY at a time, and the
+    history rows are inserted in one transaction. With
+    `Accept: application/x-ndjson` every result is sent as a JSON line, with
+    its input `index`, as soon as it is ready.
+    """
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Not logged in'}), 401
+    queries = (request.get_json(silent=True) or {}).get('queries')
+    if not isinstance(queries, list) or not queries \
+            or not all(isinstance(query, str) and query.strip() for query in queries):
+        return jsonify({'error': 'queries must be a non-empty list of non-empty strings'}), 400
+    max_queries = current_app.config['BATCH_MAX_QUERIES']
+    if len(queries) > max_queries:
+        return jsonify({'error': f"At most {max_queries} queries per batch"}), 400
+    queries = [query.strip() for query in queries]
+    unique = list(dict.fromkeys(queries))
     try:
-        response_data = {"pdf_embed_url": "", "embedded_website": "", "ai_response": ""}
+        admission.check(user_id, cost=len(unique))
+    except Rejected as e:
+        return rejected_response(e)
 
-        # Check for PDF
-        pdf_path = os.path.join(app.config['PDF_FOLDER'], f"{query}.pdf")
-        if os.path.exists(pdf_path):
-            response_data["pdf_embed_url"] = url_for('serve_pdf', filename=f"{query}.pdf")
-        
-        # Check for embedded website
-        query_lower = query.lower()
-        if query_lower in keyword_links:
-            response_data["embedded_website"] = keyword_links[query_lower][0]
+    answers = batch_answers(user_id, unique)
+    if 'application/x-ndjson' in request.headers.get('Accept', ''):
+        return Response(stream_with_context(batch_lines(queries, answers)), mimetype='application/x-ndjson',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    by_query = dict(answers)
+    return jsonify({'results': [dict(by_query[query], index=index) for index, query in enumerate(queries)],
+                    'unique': len(unique)})
+
+def batch_lines(queries, answers):
+    """NDJSON lines in the order the answers finish, one per input position"""
+    positions = {}
+    for index, query in enumerate(queries):
+        positions.setdefault(query, []).append(index)
+    for query, response_data in answers:
+        for index in positions[query]:
+            yield json.dumps(dict(response_data, index=index)) + '\n'
+
+def batch_answers(user_id, queries):
+    """(query, response_data) for distinct queries as they are answered.
+
+    PDF and topic matches are resolved for all queries first; the answers
+    then run in BATCH_CONCURRENCY threads, each holding one of the worker's
+    admission places. Everything answered is saved in one transaction at
+    the end, also when the client stops reading a stream early. A query
+    that finds no place is marked `busy`, with its `retry_after`, and not
+    saved.
+    """
+    results = {query: dict(find_attachments(query), query=query) for query in queries}
+    rows = []
+    pool = ThreadPoolExecutor(min(current_app.config['BATCH_CONCURRENCY'], len(queries)),
+                              thread_name_prefix='batch')
+    try:
+        # Every task gets its own copy of the request context (and so its own `g`)
+        futures = {pool.submit(copy_current_request_context(partial(answer_batch_query, user_id, query))): query
+                   for query in queries}
+        for future in as_completed(futures):
+            query = futures[future]
+            try:
+                answer, usage, rejected = future.result()
+            except Exception as e:
+                logger.error(f"Error answering batch query: {str(e)}")
+                answer, usage, rejected = ANSWER_ERROR_MESSAGE, None, None
+            if usage:
+                # Booked per query, so the day's totals count every completion
+                admission.record_usage(user_id, usage)
+            results[query]["ai_response"] = answer
+            if rejected is not None:
+                # Never run, so not saved; the client can resend just these
+                results[query].update(busy=True, retry_after=rejected.retry_after)
+            else:
+                rows.append({"user_id": user_id, "query": query, "response": answer,
+                             "timestamp": datetime.now(timezone.utc).replace(tzinfo=None)})
+            yield query, results[query]
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        if rows:
+            with stage('save_chat'):
+                db.session.execute(insert(Chat), rows)
+                db.session.commit()
+
+def answer_batch_query(user_id, query):
+    """(answer, upstream usage, Rejected or None) of one batch query; runs in a pool thread"""
+    try:
+        ticket = admission.place(user_id)
+    except Rejected as e:
+        logger.info(f"Batch query rejected: {e.reason}")
+        # Charged to the rate limits with the batch, but never run
+        admission.refund(user_id)
+        return BUSY_MESSAGE, None, e
+    with ticket:
+        answer = answer_text(query)
+    return answer, g.pop('upstream_usage', None), None
+
+@bp.route('/chat/history')
+def chat_history():
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    try:
+        limit = min(max(int(request.args.get('limit', current_app.config['HISTORY_PAGE_SIZE'])), 1), 100)
+        rows, next_cursor = chat_history_page(user_id, request.args.get('cursor'), limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    return jsonify({
+        'items': [{
+            'id': row.id,
+            'query': row.query,
+            'response': row.response,
+            'pdf_preview': bool(row.pdf_preview),
+            'embedded_website': row.embedded_website,
+            'timestamp': row.timestamp.isoformat() if row.timestamp else None
+        } for row in rows],
+        'next_cursor': next_cursor
+    })
+
+@bp.route('/chat/search')
+def chat_search_endpoint():
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'No search query'}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', current_app.config['HISTORY_PAGE_SIZE'])), 1), 100)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or offset'}), 400
+
+    try:
+        with stage('search'):
+            rows, next_offset = chat_search.search(db.session, user_id, query, limit, offset)
+    except Exception as e:
+        # e.g. the migration that adds the search index has not run yet
+        logger.error(f"Chat search failed: {str(e)}")
+        db.session.rollback()
+        return jsonify({'error': 'Search is not available right now'}), 503
+    return jsonify({
+        'items': [{
+            'id': row.id,
+            'query_html': chat_search.markup(row.query_html),
+            'snippet_html': chat_search.markup(row.snippet_html),
+            'timestamp': row.timestamp.isoformat() if row.timestamp else None
+        } for row in rows],
+        'next_offset': next_offset
+    })
+
+def encode_cursor(row):
+    return base64.urlsafe_b64encode(f"{row.timestamp.isoformat()}|{row.id}".encode()).decode()
+
+def decode_cursor(cursor):
+    """(timestamp, id) from a cursor; raises ValueError if it is malformed"""
+    try:
+        timestamp, chat_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(chat_id)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(str(e))
+
+def chat_history_page(user_id, cursor=None, limit=None):
+    """One newest-first page of a user's history and the cursor for the next.
+
+    Keyset pagination on (timestamp, id), served by ix_chats_user_id_timestamp,
+    so deep pages cost the same as the first one. Only the rendered columns
+    are loaded.
+    """
+    limit = limit or current_app.config['HISTORY_PAGE_SIZE']
+    q = db.session.query(Chat.id, Chat.query, Chat.response, Chat.pdf_preview,
+                         Chat.embedded_website, Chat.timestamp).filter(Chat.user_id == user_id)
+    if cursor:
+        timestamp, chat_id = decode_cursor(cursor)
+        q = q.filter(or_(Chat.timestamp < timestamp,
+                         and_(Chat.timestamp == timestamp, Chat.id < chat_id)))
+    rows = q.order_by(Chat.timestamp.desc(), Chat.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+BUSY_MESSAGE = "The assistant is busy right now. Please try again in a moment."
+RATE_LIMITED_MESSAGE = "You are sending questions too quickly. Please wait a moment and try again."
+UNAVAILABLE_MESSAGE = "The assistant is temporarily unavailable. Please try again later."
+ANSWER_ERROR_MESSAGE = "There was an error generating the response. Please try again later."
+
+def upstream_error_message(status_code):
+    """User-facing text for a completion that still failed after retries"""
+    if status_code == 429:
+        return BUSY_MESSAGE
+    return UNAVAILABLE_MESSAGE
+
+SYSTEM_PROMPT = "You are an AI assistant that helps people find information."
+COMPLETION_MAX_TOKENS = 800
+COMPLETION_TEMPERATURE = 0.7
+
+def record_usage(usage):
+    """Count a completion's `usage` in the metrics and towards this request's total"""
+    metrics.record_usage(usage)
+    add_request_usage(usage)
+
+def add_request_usage(usage):
+    if usage:
+        total = g.setdefault('upstream_usage', {})
+        for kind in ('prompt_tokens', 'completion_tokens'):
+            total[kind] = total.get(kind, 0) + (usage.get(kind) or 0)
+
+def retrieve_context(query):
+    """Top-k PDF chunks for the prompt; empty when retrieval is off or fails"""
+    if not current_app.config['RAG_ENABLED']:
+        return []
+    try:
+        with stage('retrieval'):
+            pdf_index.load()
+            return pdf_index.search(query, current_app.config['RAG_TOP_K'])
+    except Exception as e:
+        logger.error(f"PDF retrieval failed: {str(e)}")
+        return []
+
+NO_CONVERSATION = (None, [])
+
+def conversation_context(user_id, query):
+    """(summary, turns) of the user's ongoing conversation to put before the query.
+
+    Only follow-up questions get any. Context becomes part of the cache and
+    single-flight key, so a standalone question keeps sharing its answer with
+    everyone else who asks it. The user's turns from the last CONTEXT_MAX_AGE seconds fill
+    CONTEXT_TOKEN_BUDGET newest first. Turns that no longer fit are covered
+    by the stored ChatSummary, which is only regenerated once
+    CONTEXT_SUMMARY_EVERY of them are missing from it.
+    """
+    config = current_app.config
+    if config['CONTEXT_TOKEN_BUDGET'] <= 0 or not is_follow_up(query):
+        return NO_CONVERSATION
+    since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=config['CONTEXT_MAX_AGE'])
+    try:
+        with stage('context'):
+            turns = (db.session.query(Chat.id, Chat.query, Chat.response)
+                     .filter(Chat.user_id == user_id, Chat.timestamp >= since)
+                     .order_by(Chat.timestamp.desc(), Chat.id.desc())
+                     .limit(config['CONTEXT_MAX_TURNS']).all())
+            stored = db.session.get(ChatSummary, user_id)
+            if stored is not None and stored.updated_at < since:
+                # Left over from an earlier conversation
+                stored = None
+            # Room for the summary is kept as soon as there is (or will be) one
+            summary_room = config['CONTEXT_SUMMARY_TOKENS'] + MESSAGE_OVERHEAD
+            kept, older = fit_turns(turns, config['CONTEXT_TOKEN_BUDGET'] - (summary_room if stored else 0))
+            if older and stored is None:
+                kept, older = fit_turns(turns, config['CONTEXT_TOKEN_BUDGET'] - summary_room)
+            summary = stored.summary if stored else None
+            unsummarized = [turn for turn in older if stored is None or turn.id > stored.last_chat_id]
+        if len(unsummarized) >= config['CONTEXT_SUMMARY_EVERY']:
+            summary = refresh_summary(user_id, summary, unsummarized) or summary
+    except Exception as e:
+        logger.error(f"Building conversation context failed: {str(e)}")
+        db.session.rollback()
+        return NO_CONVERSATION
+    metrics.CONTEXT_TOKENS.observe((message_tokens(summary) if summary else 0) + sum(map(turn_tokens, kept)))
+    return summary, kept
+
+def refresh_summary(user_id, previous, turns):
+    """Fold newest-first turns into the user's stored summary; None if no summary call succeeded.
+
+    The turns go in oldest first, in chunks held to the same budget as the
+    conversation, so the stored last_chat_id always marks the newest turn that
+    actually reached the summary. If a call fails, what was folded so far is
+    kept and the rest stays unsummarized for the next refresh.
+    """
+    config = current_app.config
+    max_tokens = config['CONTEXT_SUMMARY_TOKENS']
+    summary, last_chat_id = previous, None
+    for chunk in summary_chunks(turns, config['CONTEXT_TOKEN_BUDGET']):
+        json_body = {"messages": summary_messages(summary, chunk, max_tokens),
+                     "max_tokens": max_tokens, "temperature": 0.2}
+        try:
+            with stage('summary'):
+                azure_response = azure_client.complete(json_body)
+            if azure_response.status_code != 200:
+                raise UpstreamError(azure_response.status_code)
+            response_content = azure_response.json()
+            record_usage(response_content.get('usage'))
+            summary = clean_response(response_content['choices'][0]['message']['content'])
+        except Exception as e:
+            logger.warning(f"Conversation summary failed, keeping the previous one: {str(e)}")
+            break
+        last_chat_id = chunk[-1].id
+    if last_chat_id is None:
+        return None
+    db.session.merge(ChatSummary(user_id=user_id, summary=summary, last_chat_id=last_chat_id,
+                                 tokens=count_tokens(summary),
+                                 updated_at=datetime.now(timezone.utc).replace(tzinfo=None)))
+    db.session.commit()
+    return summary
+
+def completion_request(query, stream=False, context=None, conversation=NO_CONVERSATION):
+    """JSON body for a chat/completions call"""
+    summary, turns = conversation
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if summary:
+        messages.append({"role": "system", "content": "Summary of the earlier conversation: " + summary})
+    if context:
+        excerpts = "\n\n".join(f"[{chunk['file']}, page {chunk['page']}]\n{chunk['text']}" for chunk in context)
+        messages.append({"role": "system", "content": "Use these excerpts from the course documents when they are relevant:\n\n" + excerpts})
+    messages.extend(turn_messages(turns))
+    messages.append({"role": "user", "content": query})
+    json_body = {
+        "messages": messages,
+        "max_tokens": COMPLETION_MAX_TOKENS,
+        "temperature": COMPLETION_TEMPERATURE,
+        "top_p": 0.95,
+        "frequency_penalty": 0,
+        "presence_penalty": 0
+    }
+    if stream:
+        json_body["stream"] = True
+        if current_app.config['API_VERSION'] >= '2024-09-01':
+            # Older API versions reject stream_options
+            json_body["stream_options"] = {"include_usage": True}
+    return json_body
+
+def completion_cache_key(query, conversation=NO_CONVERSATION):
+    return cache_key(query, current_app.config['DEPLOYMENT_NAME'], COMPLETION_TEMPERATURE, COMPLETION_MAX_TOKENS,
+                     context=fingerprint(*conversation))
+
+def find_attachments(query):
+    """PDF preview and embedded website for a query"""
+    response_data = {"pdf_embed_url": "", "embedded_website": "", "ai_response": "", "pdf_candidates": []}
+
+    # Check for PDF: ranked fuzzy title matches from the in-memory catalog
+    with stage('pdf_match'):
+        candidates = pdf_catalog.match(query)
+    for candidate in candidates:
+        response_data["pdf_candidates"].append({
+            "filename": candidate["filename"],
+            "url": url_for('.serve_pdf', filename=candidate["filename"]),
+            "score": candidate["score"]
+        })
+    if response_data["pdf_candidates"]:
+        response_data["pdf_embed_url"] = response_data["pdf_candidates"][0]["url"]
+
+    # Check for embedded website: every topic mentioned anywhere in the query
+    with stage('keywords'):
+        matches = keyword_matcher.match(query)
+    response_data["topics"] = [{"topic": match["topic"], "links": match["links"]} for match in matches]
+    if response_data["topics"]:
+        response_data["embedded_website"] = response_data["topics"][0]["links"][0]
+
+    return response_data
+
+def insert_chats(app, rows):
+    """Insert a batch of queued history rows in one transaction"""
+    with app.app_context():
+        try:
+            db.session.execute(insert(Chat), rows)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+def save_chat(user_id, query, response_data):
+    row = {"user_id": user_id, "query": query, "response": response_data["ai_response"],
+           "timestamp": datetime.now(timezone.utc).replace(tzinfo=None)}
+    with stage('save_chat'):
+        history_writer = services.history_writer
+        if history_writer is not None and history_writer.submit(row):
+            return
+        db.session.add(Chat(**row))
+        db.session.commit()
+
+def cached_answer(query, key, conversation):
+    """Cached value for the exact query, else for a near-duplicate standalone question"""
+    with stage('cache'):
+        cached = response_cache.get(key)
+        if cached is None and conversation == NO_CONVERSATION:
+            cached = similar_queries.lookup(query)
+    return cached
+
+def cache_answer(query, key, conversation, text):
+    response_cache.set(key, {"ai_response": text})
+    if conversation == NO_CONVERSATION:
+        # Follow-ups depend on their conversation, so only standalone questions are matched
+        similar_queries.add(query, key)
+
+def generate_answer(query, key, conversation=NO_CONVERSATION):
+    """Cleaned answer from Azure OpenAI, also written to the response cache"""
+    json_body = completion_request(query, context=retrieve_context(query), conversation=conversation)
+    with stage('upstream'):
+        azure_response = azure_client.complete(json_body)
+    if azure_response.status_code != 200:
+        raise UpstreamError(azure_response.status_code)
+    response_content = azure_response.json()
+    record_usage(response_content.get('usage'))
+    with stage('clean'):
+        clean_text = clean_response(response_content['choices'][0]['message']['content'])
+    cache_answer(query, key, conversation, clean_text)
+    return clean_text
+
+def answer_text(query, conversation=NO_CONVERSATION):
+    """The answer to a query: cached, shared with an identical query in flight, or from
+    Azure OpenAI; the user-facing error text if the upstream call fails"""
+    key = completion_cache_key(query, conversation)
+    cached = cached_answer(query, key, conversation)
+    if cached is not None:
+        return cached["ai_response"]
+    try:
+        # Identical queries already in flight share one upstream call
+        return single_flight.do(key, partial(generate_answer, query, key, conversation))
+    except UpstreamError as e:
+        logger.error(f"OpenAI API error: {e.status_code}")
+        return upstream_error_message(e.status_code)
+    except UpstreamBusy:
+        logger.warning("No upstream slot free, rejecting query")
+        return BUSY_MESSAGE
+    except CircuitOpen:
+        logger.warning("Azure OpenAI circuit open, skipping upstream call")
+        return UNAVAILABLE_MESSAGE
+    except Exception as e:
+        logger.error(f"Error generating OpenAI response: {str(e)}")
+        return ANSWER_ERROR_MESSAGE
+
+def process_search_query(query, user_id):
+    try:
+        response_data = find_attachments(query)
         
         # Get AI response
         if query:
-            headers = {
-                "Content-Type": "application/json",
-                "api-key": openai.api_key
-            }
-            json_body = {
-                "messages": [
-                    {"role": "system", "content": "You are an AI assistant that helps people find information."},
-                    {"role": "user", "content": query}
-                ],
-                "max_tokens": 800,
-                "temperature": 0.7,
-                "top_p": 0.95,
-                "frequency_penalty": 0,
-                "presence_penalty": 0
-            }
-            try:
-                azure_response = requests.post(
-                    f"{openai.api_base}openai/deployments/{DEPLOYMENT_NAME}/chat/completions?api-version={openai.api_version}",
-                    headers=headers,
-                    json=json_body
-                )
-                if azure_response.status_code == 200:
-                    response_content = azure_response.json()
-                    clean_text = clean_response(response_content['choices'][0]['message']['content'])
-                    response_data["ai_response"] = clean_text
-                else:
-                    logger.error(f"OpenAI API error: {azure_response.status_code}")
-                    response_data["ai_response"] = f"Error: {azure_response.status_code}"
-            except Exception as e:
-                logger.error(f"Error generating OpenAI response: {str(e)}")
-                response_data["ai_response"] = "There was an error generating the response. Please try again later."
+            response_data["ai_response"] = answer_text(query, conversation_context(user_id, query))
 
         # Store in chat history
-        new_chat = Chat(user_id=user_id, query=query, response=response_data["ai_response"])
-        db.session.add(new_chat)
-        db.session.commit()
+        save_chat(user_id, query, response_data)
 
         return response_data
     except Exception as e:
         logger.error(f"Error in process_search_query: {str(e)}")
-        return {"pdf_embed_url": "", "embedded_website": "", "ai_response": "An error occurred processing your request."}
+        return {"pdf_embed_url": "", "embedded_website": "", "ai_response": "An error occurred processing your request.", "pdf_candidates": [], "topics": []}
 
-@app.route('/pdfs/<filename>')
-def serve_pdf(filename):
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def iter_completion_deltas(azure_response):
+    """Content deltas from a streamed chat/completions response"""
+    for line in azure_response.iter_lines(decode_unicode=True):
+        if not line or not line.startswith('data:'):
+            continue
+        payload = line[len('data:'):].strip()
+        if payload == '[DONE]':
+            break
+        chunk = json.loads(payload)
+        # The final chunk carries usage when the request set stream_options.include_usage
+        record_usage(chunk.get('usage'))
+        # Azure sends a leading chunk with only prompt_filter_results
+        for choice in chunk.get('choices') or []:
+            content = (choice.get('delta') or {}).get('content')
+            if content:
+                yield content
+
+def stream_answer(query, key, conversation=NO_CONVERSATION):
+    """Cleaned answer pieces as Azure OpenAI streams them; the full answer is cached"""
+    json_body = completion_request(query, stream=True, context=retrieve_context(query),
+                                   conversation=conversation)
+    pieces = []
+    usage_before = dict(g.get('upstream_usage', {}))
+    with stage('upstream'), azure_client.stream(json_body) as azure_response:
+        if azure_response.status_code != 200:
+            raise UpstreamError(azure_response.status_code)
+        for piece in clean_response_stream(iter_completion_deltas(azure_response)):
+            pieces.append(piece)
+            yield piece
+    if g.get('upstream_usage', {}) == usage_before:
+        # API versions before 2024-09-01 stream no usage; book an estimate instead
+        add_request_usage({"prompt_tokens": sum(message_tokens(m["content"]) for m in json_body["messages"]),
+                           "completion_tokens": count_tokens(''.join(pieces))})
+    cache_answer(query, key, conversation, ''.join(pieces))
+
+def stream_search_query(query, user_id):
+    """Server-Sent Events version of process_search_query.
+
+    Emits a "meta" event with the attachments, "delta" events as the answer
+    is generated, then a "done" event once the Chat row has been saved.
+    """
+    response_data = {"pdf_embed_url": "", "embedded_website": "", "ai_response": ""}
+    saved = False
     try:
-        return send_from_directory(app.config['PDF_FOLDER'], filename)
-    except FileNotFoundError:
+        response_data = find_attachments(query)
+        yield sse_event('meta', {"pdf_embed_url": response_data["pdf_embed_url"],
+                                 "pdf_candidates": response_data["pdf_candidates"],
+                                 "embedded_website": response_data["embedded_website"],
+                                 "topics": response_data["topics"]})
+
+        pieces = []
+        conversation = conversation_context(user_id, query)
+        key = completion_cache_key(query, conversation)
+        cached = cached_answer(query, key, conversation)
+        try:
+            if cached is not None:
+                response_data["ai_response"] = cached["ai_response"]
+                yield sse_event('delta', {"text": cached["ai_response"]})
+            else:
+                # Waiters on an identical in-flight query receive the leader's pieces
+                with closing(single_flight.stream(key, partial(stream_answer, query, key, conversation))) as answer:
+                    for piece in answer:
+                        pieces.append(piece)
+                        yield sse_event('delta', {"text": piece})
+                response_data["ai_response"] = ''.join(pieces)
+        except GeneratorExit:
+            # Client went away. Only a whole answer is saved: the one the leader finished
+            # for identical requests still reading it, if any, never the part streamed so far
+            if cached is None:
+                finished = response_cache.get(key)
+                response_data["ai_response"] = finished["ai_response"] if finished else ""
+            raise
+        except UpstreamError as e:
+            logger.error(f"OpenAI API error: {e.status_code}")
+            response_data["ai_response"] = upstream_error_message(e.status_code)
+        except UpstreamBusy:
+            logger.warning("No upstream slot free, rejecting query")
+            response_data["ai_response"] = BUSY_MESSAGE
+        except CircuitOpen:
+            logger.warning("Azure OpenAI circuit open, skipping upstream call")
+            response_data["ai_response"] = UNAVAILABLE_MESSAGE
+        except Exception as e:
+            logger.error(f"Error streaming OpenAI response: {str(e)}")
+            response_data["ai_response"] = ANSWER_ERROR_MESSAGE
+
+        save_chat(user_id, query, response_data)
+        saved = True
+        yield sse_event('done', response_data)
+    except GeneratorExit:
+        if response_data["ai_response"] and not saved:
+            save_chat(user_id, query, response_data)
+        raise
+    except Exception as e:
+        logger.error(f"Error in stream_search_query: {str(e)}")
+        db.session.rollback()
+        yield sse_event('error', {"ai_response": "An error occurred processing your request."})
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+def asset_url(filename):
+    """URL of a static file: its fingerprinted /assets/ copy when built, else /static/"""
+    hashed = services.assets.hashed(filename)
+    if hashed is None:
+        return url_for('static', filename=filename)
+    return url_for('main.serve_asset', filename=hashed)
+
+@bp.route('/assets/<path:filename>')
+def serve_asset(filename):
+    # The name carries the content hash, so the file never changes: cache it for good.
+    # Text files are sent precompressed when the client accepts it.
+    suffix, encoding = services.assets.variant(filename, request.accept_encodings)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(current_app.config['ASSETS_BUILD_DIR'], filename + suffix,
+                                   mimetype=mimetype, max_age=current_app.config['ASSETS_MAX_AGE'])
+    response.cache_control.immutable = True
+    response.cache_control.public = True
+    response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+@bp.route('/pdfs/<filename>')
+def serve_pdf(filename):
+    # Strong ETag from the content hash; send_file answers If-None-Match with 304
+    # and Range requests with 206 so the viewer can fetch pages lazily
+    resolved = pdf_store.resolve(filename)
+    if resolved is None:
         logger.warning(f"PDF not found: {filename}")
         return "PDF not found.", 404
+    path, sha = resolved
+    return send_file(path, mimetype='application/pdf', download_name=filename,
+                     conditional=True, etag=sha, max_age=current_app.config['PDF_CACHE_MAX_AGE'])
 
-@app.route('/logout')
+@bp.route('/documents', methods=['POST'])
+def upload_document():
+    """Accept a PDF, as the raw request body (?filename=...) or a multipart `file` field,
+    and queue it for indexing; answers 202 with the job's status URL"""
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    # The raw body is copied straight from the socket; a multipart body has already
+    # been spooled to a temporary file by the form parser
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    filename = secure_filename(upload.filename if upload is not None else request.args.get('filename', ''))
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension not in current_app.config['ALLOWED_EXTENSIONS']:
+        return jsonify({'error': 'A file name ending in .pdf is required'}), 400
+    try:
+        path, sha, size = receive_upload(upload.stream if upload is not None else request.stream,
+                                         current_app.config['UPLOAD_FOLDER'],
+                                         current_app.config['MAX_CONTENT_LENGTH'])
+    except UploadRejected as e:
+        logger.warning(f"Upload of {filename} rejected: {str(e)}")
+        return jsonify({'error': str(e)}), e.status_code
+
+    job_id = services.documents.submit(user_id, filename, path, sha, size)
+    logger.info(f"Upload {filename} ({size} bytes) queued as job {job_id}")
+    status_url = url_for('.document_job', job_id=job_id)
+    return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': status_url}), 202, {'Location': status_url}
+
+@bp.route('/documents/jobs/<job_id>')
+def document_job(job_id):
+    user_id = current_user_id()
+    if user_id is None:
+        return jsonify({'error': 'Not logged in'}), 401
+    job = services.documents.status(job_id)
+    if job is None or job['user_id'] != user_id:
+        return jsonify({'error': 'No such job'}), 404
+    if job['status'] == 'done':
+        job['url'] = url_for('.serve_pdf', filename=job['filename'])
+    return jsonify(job)
+
+@bp.route('/logout')
 def logout():
-    session.pop('user_id', None)
+    session.clear()
     logger.info("User logged out")
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
+
+def create_app(config_object='config.Config'):
+    """Build the Flask app; no database or network work happens here, and on disk only the
+    instance secret key is read (or created on the very first start)"""
+    app = Flask(__name__, static_folder='static')
+    app.config.from_object(config_object)
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = instance_secret_key(app.config['INSTANCE_PATH'])
+    # First, so every later log line (and Flask's app.logger) goes through the queue
+    logging_setup.init_app(app)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    db.init_app(app)
+    with app.app_context():
+        configure_engine(db.engine, app.config)
+        metrics.instrument_engine(db.engine)
+        # Pooled connections must not be shared with forked workers
+        os.register_at_fork(after_in_child=partial(db.engine.dispose, close=False))
+    if click.get_current_context(silent=True) is not None:
+        # Only the flask CLI needs Alembic (flask db ..., flask bootstrap); workers skip the import
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    app.extensions['services'] = Services(app.config, history_flush=partial(insert_chats, app))
+    metrics.init_app(app)
+    assets.init_app(app)
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.session_interface = SQLiteSessionInterface(app.config['SESSION_DB_PATH'],
+                                                    app.config['SESSION_SWEEP_INTERVAL'])
+    app.register_blueprint(bp)
+    return app
 
 if __name__ == '__main__':
+    app = create_app()
+    if not initialize_database(app):
+        logger.error("Failed to initialize database")
     port = int(os.environ.get('PORT', 8000))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,153 @@
+"""Fingerprinted, precompressed static assets and compressed dynamic responses.
+
+`flask build-assets` (also run by `flask bootstrap`) copies every file under
+static/ into ASSETS_BUILD_DIR with its content hash in the name
+(css/chat.css -> css/chat.3f2a9c0d81b4.css), writes gzip and brotli
+versions of the text files next to it and records the mapping in
+manifest.json. Templates link files with asset_url('css/chat.css'); the
+hashed names are served from /assets/ with a one-year immutable
+Cache-Control, so a changed file gets a new URL instead of a stale cache
+hit. Without a build asset_url() falls back to the plain /static/ URL.
+
+HTML and JSON responses of at least COMPRESS_MIN_SIZE bytes are compressed
+per request with the best encoding the client accepts. Streamed responses
+(the SSE answer stream) and files are left alone.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+
+from flask import request
+
+from metrics import stage
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+# Files worth compressing; images and fonts already are
+TEXT_EXTENSIONS = {'.css', '.js', '.json', '.map', '.svg', '.txt', '.html'}
+# Content-Encoding -> file suffix of the precompressed copy, in order of preference
+ENCODINGS = {'br': '.br', 'gzip': '.gz'} if brotli is not None else {'gzip': '.gz'}
+COMPRESSIBLE_MIMETYPES = {'text/html', 'application/json', 'text/plain'}
+# Per-request compression trades ratio for speed; build time uses the maximum
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+
+def compress(data, encoding, best=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else BROTLI_QUALITY)
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+
+def build_assets(static_folder, build_dir):
+    """Write hashed and precompressed copies of static_folder; returns the manifest.
+
+    Files are content-addressed, so copies from earlier builds stay valid and
+    pages cached with the old URLs keep working.
+    """
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        dirs.sort()
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+            stem, ext = os.path.splitext(logical)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:HASH_LENGTH]}{ext}"
+            target = os.path.join(build_dir, hashed)
+            encodings = []
+            if ext.lower() in TEXT_EXTENSIONS:
+                for encoding, suffix in ENCODINGS.items():
+                    body = compress(data, encoding, best=True)
+                    if len(body) < len(data):
+                        _write(target + suffix, body)
+                        encodings.append(encoding)
+            _write(target, data)
+            manifest[logical] = {'path': hashed, 'size': len(data), 'encodings': encodings}
+    _write(os.path.join(build_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def _write(path, data):
+    # Atomic, so a worker never serves a half-written file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class AssetManifest:
+    """The manifest of the last build, loaded once per process"""
+
+    def __init__(self, build_dir):
+        self.build_dir = build_dir
+        self.urls = {}
+        self.encodings = {}
+        try:
+            with open(os.path.join(build_dir, MANIFEST)) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            logger.warning(f"No asset build in {build_dir}; serving plain static files")
+            return
+        except (OSError, ValueError) as e:
+            logger.error(f"Asset manifest unreadable: {str(e)}")
+            return
+        for logical, entry in entries.items():
+            self.urls[logical] = entry['path']
+            self.encodings[entry['path']] = entry['encodings']
+
+    def hashed(self, filename):
+        """Hashed path of a static file, or None when it was not built"""
+        return self.urls.get(filename)
+
+    def variant(self, hashed, accept_encodings):
+        """(suffix, encoding) of the best precompressed copy the client accepts, or ('', None)"""
+        for encoding in self.encodings.get(hashed, ()):
+            if accept_encodings[encoding] > 0:
+                return ENCODINGS[encoding], encoding
+        return '', None
+
+
+def negotiate(accept_encodings):
+    """The preferred encoding the client accepts, or None"""
+    for encoding in ENCODINGS:
+        if accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def init_app(app):
+    """Compress HTML and JSON responses on the fly"""
+    min_size = app.config['COMPRESS_MIN_SIZE']
+
+    @app.after_request
+    def compress_response(response):
+        if (response.direct_passthrough or response.is_streamed
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES
+                or 'Content-Encoding' in response.headers
+                or response.status_code < 200 or response.status_code in (204, 206, 304)):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate(request.accept_encodings)
+        if encoding is None or response.content_length is None or response.content_length < min_size:
+            return response
+        with stage('compress'):
+            response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            # The compressed body is a different representation
+            response.set_etag(f"{etag}-{encoding}", weak)
+        return response
@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import UPSTREAM_IN_FLIGHT, UPSTREAM_RESPONSES
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamBusy(Exception):
+    """No upstream slot became free within the queue timeout"""
+
+
+class CircuitOpen(Exception):
+    """Upstream failed repeatedly; calls are short-circuited until the cooldown ends"""
+
+
+class UpstreamError(Exception):
+    """Azure OpenAI still answered with an error status after retries"""
+
+    def __init__(self, status_code):
+        super().__init__(f"Azure OpenAI returned {status_code}")
+        self.status_code = status_code
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and stays open for `cooldown` seconds.
+
+    After the cooldown one call is let through as a probe while everyone else
+    still gets CircuitOpen; the probe's outcome closes the circuit or opens it
+    for another cooldown. A probe that never reports back (its caller was
+    killed) is replaced by a new one after a cooldown.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Raises CircuitOpen, or returns whether this call is the half-open probe"""
+        with self.lock:
+            if self.opened_at is None:
+                return False
+            now = time.monotonic()
+            if now - self.opened_at < self.cooldown:
+                raise CircuitOpen()
+            if self.probe_started is not None and now - self.probe_started < self.cooldown:
+                raise CircuitOpen()
+            self.probe_started = now
+            return True
+
+    def record(self, success, probe=False):
+        with self.lock:
+            if probe:
+                self.probe_started = None
+            if success:
+                if self.opened_at is not None:
+                    logger.info("Azure OpenAI circuit closed")
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if probe:
+                self.opened_at = time.monotonic()
+                logger.warning("Azure OpenAI circuit probe failed, staying open")
+            elif self.failures >= self.threshold and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                logger.warning(f"Azure OpenAI circuit opened after {self.failures} consecutive failures")
+
+
+class AzureOpenAIClient:
+    """Keep-alive, pooled client for one Azure OpenAI chat/completions deployment.
+
+    One instance is shared per worker process. It caps in-flight calls,
+    retries 429/5xx with exponential backoff (honouring Retry-After) and
+    stops calling upstream for a while after repeated failures.
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, endpoint, api_key, deployment, api_version,
+                 connect_timeout=5, read_timeout=120, max_retries=3, backoff_factor=0.5,
+                 retry_after_max=30, pool_size=50, breaker_threshold=5, breaker_cooldown=30,
+                 max_inflight=50, queue_timeout=30):
+        self.url = (f"{(endpoint or '').rstrip('/')}/openai/deployments/{deployment}"
+                    f"/chat/completions?api-version={api_version}")
+        self.timeout = (connect_timeout, read_timeout)
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(max_inflight)
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+
+        # requests/urllib3 (and ssl) are imported on first use, after gevent has
+        # patched the worker, not when the app module is imported
+        import requests
+        from requests.adapters import HTTPAdapter
+        from azure_retry import CappedRetry
+
+        self.request_error = requests.RequestException
+        retry = CappedRetry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,  # a read timeout means the request reached Azure; don't pay for it twice
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset(['POST']),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+            retry_after_max=retry_after_max,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "Content-Type": "application/json",
+            "api-key": api_key or ""
+        })
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            endpoint=config['AZURE_OPENAI_ENDPOINT'],
+            api_key=config['AZURE_OPENAI_API_KEY'],
+            deployment=config['DEPLOYMENT_NAME'],
+            api_version=config['API_VERSION'],
+            connect_timeout=config['AZURE_OPENAI_CONNECT_TIMEOUT'],
+            read_timeout=config['AZURE_OPENAI_READ_TIMEOUT'],
+            max_retries=config['AZURE_OPENAI_MAX_RETRIES'],
+            backoff_factor=config['AZURE_OPENAI_BACKOFF_FACTOR'],
+            retry_after_max=config['AZURE_OPENAI_MAX_RETRY_AFTER'],
+            pool_size=config['MAX_INFLIGHT_UPSTREAM'],
+            breaker_threshold=config['AZURE_OPENAI_BREAKER_THRESHOLD'],
+            breaker_cooldown=config['AZURE_OPENAI_BREAKER_COOLDOWN'],
+            max_inflight=config['MAX_INFLIGHT_UPSTREAM'],
+            queue_timeout=config['UPSTREAM_QUEUE_TIMEOUT'],
+        )
+
+    @contextmanager
+    def slot(self):
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            UPSTREAM_RESPONSES.labels('busy').inc()
+            raise UpstreamBusy()
+        UPSTREAM_IN_FLIGHT.inc()
+        try:
+            yield
+        finally:
+            UPSTREAM_IN_FLIGHT.dec()
+            self.slots.release()
+
+    def _post(self, json_body, stream):
+        try:
+            probe = self.breaker.before_call()
+        except CircuitOpen:
+            UPSTREAM_RESPONSES.labels('circuit_open').inc()
+            raise
+        try:
+            response = self.session.post(self.url, json=json_body, timeout=self.timeout, stream=stream)
+        except self.request_error:
+            UPSTREAM_RESPONSES.labels('error').inc()
+            self.breaker.record(False, probe)
+            raise
+        UPSTREAM_RESPONSES.labels(str(response.status_code)).inc()
+        self.breaker.record(response.status_code not in self.RETRY_STATUSES, probe)
+        return response
+
+    def complete(self, json_body):
+        """POST a chat/completions request and return the response"""
+        with self.slot():
+            return self._post(json_body, stream=False)
+
+    @contextmanager
+    def stream(self, json_body):
+        """POST a streaming request; the upstream slot is held until the block exits"""
+        with self.slot():
+            response = self._post(json_body, stream=True)
+            try:
+                yield response
+            finally:
+                response.close()
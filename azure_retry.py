@@ -0,0 +1,20 @@
+from urllib3.util.retry import Retry
+
+
+class CappedRetry(Retry):
+    """Retry that honours Retry-After but never sleeps longer than retry_after_max"""
+
+    def __init__(self, *args, retry_after_max=30, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.retry_after_max = retry_after_max
+
+    def new(self, **kw):
+        retry = super().new(**kw)
+        retry.retry_after_max = self.retry_after_max
+        return retry
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, self.retry_after_max)
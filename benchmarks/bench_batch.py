@@ -0,0 +1,113 @@
+"""A student's question list: one /chat POST per question vs one /chat/batch call.
+
+    python benchmarks/bench_batch.py --questions 30 --duplicates 6 --latency 1.0
+
+Boots the app under gunicorn (one gevent worker) against the fake Azure
+OpenAI server with a fixed latency. The same list of questions (with
+--duplicates repeats mixed in) is sent three ways by a fresh user each
+time: one POST /chat after another, as the lab tooling does today; one
+POST /chat/batch; and /chat/batch as NDJSON, where the time to the first
+line is also recorded. Reports wall time, upstream calls, INSERT statements
+and the history rows saved. Rate limits, conversation context and the
+near-duplicate cache are off so every mode does the same work.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_azure_openai import make_server  # noqa: E402
+from load_concurrency import free_port, logged_in_session  # noqa: E402
+from loadgen import boot_app  # noqa: E402
+
+TOPICS = ('capacitor', 'resistor', 'diode', 'transistor', 'inductor', 'relay', 'op-amp', 'servo motor',
+          'stepper motor', 'voltage regulator', 'esp8266', 'arduino uno', 'raspberry pi', 'breadboard',
+          'multimeter', 'oscilloscope', 'h-bridge', 'mosfet', 'led', 'potentiometer')
+
+
+def questions(count, duplicates, mode):
+    """`count` distinct questions, unique to this mode so no answer is cached, plus repeats"""
+    distinct = [f"how does a {TOPICS[n % len(TOPICS)]} work (question {n}, {mode})" for n in range(count)]
+    return distinct + distinct[:duplicates]
+
+
+def insert_statements(base_url):
+    for line in requests.get(f"{base_url}/metrics").text.splitlines():
+        if line.startswith('egpt_db_query_duration_seconds_count{') and 'operation="INSERT"' in line:
+            return int(float(line.rsplit(' ', 1)[1]))
+    return 0
+
+
+def run_mode(mode, http, base_url, args, upstream):
+    queries = questions(args.questions, args.duplicates, mode)
+    calls_before, inserts_before = upstream.stats['requests'], insert_statements(base_url)
+    first_result = None
+    started = time.perf_counter()
+    if mode == 'sequential':
+        for query in queries:
+            response = http.post(f"{base_url}/chat", data={'query': query})
+            response.raise_for_status()
+    elif mode == 'batch':
+        response = http.post(f"{base_url}/chat/batch", json={'queries': queries})
+        response.raise_for_status()
+        assert len(response.json()['results']) == len(queries)
+    else:
+        response = http.post(f"{base_url}/chat/batch", json={'queries': queries},
+                             headers={'Accept': 'application/x-ndjson'}, stream=True)
+        response.raise_for_status()
+        lines = 0
+        for line in response.iter_lines():
+            if line:
+                lines += 1
+                first_result = first_result or time.perf_counter() - started
+        assert lines == len(queries)
+    elapsed = time.perf_counter() - started
+    saved = len(http.get(f"{base_url}/chat/history", params={'limit': 100}).json()['items'])
+    return {
+        'mode': mode,
+        'queries': len(queries),
+        'wall_s': round(elapsed, 2),
+        'first_result_s': round(first_result, 2) if first_result is not None else None,
+        'upstream_calls': upstream.stats['requests'] - calls_before,
+        'insert_statements': insert_statements(base_url) - inserts_before,
+        'history_rows': saved,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--questions', type=int, default=30, help='distinct questions')
+    parser.add_argument('--duplicates', type=int, default=6, help='repeated questions added to the list')
+    parser.add_argument('--latency', type=float, default=1.0, help='fake upstream latency in seconds')
+    parser.add_argument('--concurrency', type=int, default=3, help='BATCH_CONCURRENCY')
+    parser.add_argument('--modes', default='sequential,batch,ndjson')
+    args = parser.parse_args()
+
+    upstream = make_server(port=free_port(), latency=args.latency, token_delay=0)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    upstream_url = f"http://127.0.0.1:{upstream.server_address[1]}/"
+    os.environ.update(USER_RATE_LIMIT='0', GLOBAL_RATE_LIMIT='0', CONTEXT_TOKEN_BUDGET='0',
+                      SIMILAR_QUERY_THRESHOLD='0', BATCH_CONCURRENCY=str(args.concurrency),
+                      BATCH_MAX_QUERIES=str(args.questions + args.duplicates))
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        proc, base_url = boot_app(SimpleNamespace(workers=1, worker_class='gevent'), upstream_url, workdir)
+        try:
+            for index, mode in enumerate(args.modes.split(',')):
+                results.append(run_mode(mode, logged_in_session(base_url, index), base_url, args, upstream))
+        finally:
+            proc.terminate()
+            proc.wait()
+    upstream.shutdown()
+    print(json.dumps({'latency_s': args.latency, 'concurrency': args.concurrency, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
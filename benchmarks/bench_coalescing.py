@@ -0,0 +1,95 @@
+"""Upstream calls made for a burst of identical queries, per SINGLE_FLIGHT_BACKEND.
+
+    python benchmarks/bench_coalescing.py --clients 40 --workers 3
+
+Boots the app under gunicorn against the fake Azure OpenAI server once per
+backend, then has every client send the same new query at the same moment
+(half of them streaming) for a few rounds. Reports the upstream calls per
+round, which should drop from one per client ('none') to one per worker
+('memory') to one in total ('sqlite'), and the client latencies.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_azure_openai import make_server  # noqa: E402
+from load_concurrency import free_port, logged_in_session  # noqa: E402
+from loadgen import boot_app, percentile  # noqa: E402
+
+
+def burst(sessions, base_url, query):
+    """Every session sends `query` at once; returns the client latencies in ms"""
+    barrier = threading.Barrier(len(sessions))
+
+    def ask(index):
+        barrier.wait()
+        started = time.perf_counter()
+        if index % 2:
+            response = sessions[index].post(f"{base_url}/chat", data={'query': query},
+                                            headers={'Accept': 'text/event-stream'})
+            assert 'event: done' in response.text, response.text[-200:]
+        else:
+            response = sessions[index].post(f"{base_url}/chat", data={'query': query})
+            assert response.json()['ai_response'], response.text
+        return (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(len(sessions)) as pool:
+        return list(pool.map(ask, range(len(sessions))))
+
+
+def run(backend, args, upstream, upstream_url):
+    os.environ['SINGLE_FLIGHT_BACKEND'] = backend
+    with tempfile.TemporaryDirectory() as workdir:
+        proc, base_url = boot_app(SimpleNamespace(workers=args.workers, worker_class=args.worker_class),
+                                  upstream_url, workdir)
+        try:
+            sessions = [logged_in_session(base_url, index) for index in range(args.clients)]
+            calls, latencies = [], []
+            for round_ in range(args.rounds):
+                before = upstream.stats['requests']
+                latencies += burst(sessions, base_url, f"what is an esp8266 ({backend} round {round_})")
+                calls.append(upstream.stats['requests'] - before)
+            flights = requests.get(f"{base_url}/metrics").text
+        finally:
+            proc.terminate()
+            proc.wait()
+    latencies.sort()
+    roles = {}
+    for line in flights.splitlines():
+        if line.startswith('egpt_completion_flights_total{'):
+            roles[line.split('"')[1]] = int(float(line.rsplit(' ', 1)[1]))
+    return {'upstream_calls_per_round': calls, 'flights': roles,
+            'p50_ms': round(percentile(latencies, 50), 1), 'max_ms': round(latencies[-1], 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=40)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--worker-class', default='gevent')
+    parser.add_argument('--latency', type=float, default=1.0, help='fake upstream latency in seconds')
+    parser.add_argument('--backends', default='none,memory,sqlite')
+    args = parser.parse_args()
+
+    upstream = make_server(port=free_port(), latency=args.latency, token_delay=0.02)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    upstream_url = f"http://127.0.0.1:{upstream.server_address[1]}/"
+    report = {'clients': args.clients, 'workers': args.workers, 'worker_class': args.worker_class}
+    for backend in args.backends.split(','):
+        report[backend] = run(backend, args, upstream, upstream_url)
+    upstream.shutdown()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
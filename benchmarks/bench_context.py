@@ -0,0 +1,91 @@
+"""Prompt building cost and size as a user's conversation grows.
+
+    python benchmarks/bench_context.py --lengths 0,5,20,50,200
+
+For each history length, a user with that many recent turns is written to
+a throwaway database, together with a stored summary of the turns that do
+not fit the budget: the steady state between summary refreshes.
+Reports the time conversation_context() takes and the context tokens it
+puts into the prompt, next to the tokens a full replay of the history
+would cost.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('INSTANCE_PATH', tempfile.mkdtemp(prefix='bench-context-'))
+
+import app as app_module  # noqa: E402
+from conversation import MESSAGE_OVERHEAD, count_tokens, fit_turns, message_tokens, turn_tokens  # noqa: E402
+
+QUERY = "how does a {n} ohm resistor change the charge time of the capacitor in my circuit?"
+# Context is only built for follow-ups
+FOLLOW_UP = "and what happens if I double it?"
+RESPONSE = ("The charge time grows with the resistance: the time constant is R times C, and the capacitor "
+            "reaches about 63% of the supply voltage after one time constant. ") * 4
+SUMMARY = ("The student is building an RC timer on an Arduino and asked how resistors of different values "
+           "change the capacitor charge time; the time constant R*C was explained.")
+
+
+def seed_user(index, turns, config):
+    db, Chat, ChatSummary, User = app_module.db, app_module.Chat, app_module.ChatSummary, app_module.User
+    user = User(username=f"bench{index}", email=f"bench{index}@example.com", password='x')
+    db.session.add(user)
+    db.session.flush()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    rows = [Chat(user_id=user.id, query=QUERY.format(n=n), response=RESPONSE,
+                 timestamp=now - timedelta(seconds=10 * (turns - n))) for n in range(turns)]
+    db.session.add_all(rows)
+    db.session.flush()
+    # The summary covers exactly the turns that do not fit next to it
+    room = config['CONTEXT_TOKEN_BUDGET'] - config['CONTEXT_SUMMARY_TOKENS'] - MESSAGE_OVERHEAD
+    _, older = fit_turns(rows[::-1], room)
+    if older:
+        db.session.add(ChatSummary(user_id=user.id, summary=SUMMARY, last_chat_id=older[0].id,
+                                   tokens=count_tokens(SUMMARY), updated_at=now))
+    db.session.commit()
+    return user.id, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lengths', default='0,5,20,50,200')
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    flask_app = app_module.create_app()
+    app_module.initialize_database(flask_app)
+    config = flask_app.config
+    report = {'budget': config['CONTEXT_TOKEN_BUDGET'], 'max_turns': config['CONTEXT_MAX_TURNS'],
+              'histories': []}
+    for index, length in enumerate(int(n) for n in args.lengths.split(',')):
+        with flask_app.test_request_context():
+            user_id, rows = seed_user(index, length, config)
+            timings = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                summary, turns = app_module.conversation_context(user_id, FOLLOW_UP)
+                timings.append((time.perf_counter() - started) * 1000)
+                app_module.db.session.rollback()
+            context_tokens = (message_tokens(summary) if summary else 0) + sum(map(turn_tokens, turns))
+            report['histories'].append({
+                'turns': length,
+                'turns_in_prompt': len(turns),
+                'summary': summary is not None,
+                'context_tokens': context_tokens,
+                'full_replay_tokens': sum(map(turn_tokens, rows)),
+                'build_ms_median': round(statistics.median(timings), 2),
+                'build_ms_max': round(max(timings), 2),
+            })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Keyword matcher build and lookup cost as the link catalog grows.
+
+    python benchmarks/bench_keyword_matcher.py --keywords 5000
+
+Adds synthetic topics to keyword_links.json and compares the compiled
+Aho-Corasick matcher with a naive scan that checks every keyword phrase
+against the query.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from keyword_matcher import KeywordMatcher, normalize_tokens  # noqa: E402
+
+VOCABULARY = (
+    "sensor motor servo stepper relay diode transistor mosfet resistor inductor transformer "
+    "battery charger solar panel wifi bluetooth zigbee lora gps gsm camera display lcd oled "
+    "keyboard joystick buzzer speaker microphone accelerometer gyroscope encoder pwm adc dac "
+    "uart spi i2c can usb ethernet firmware bootloader rtos linux raspberry arduino esp32 "
+    "stm32 pic avr fpga drone rover arm gripper pid kalman filter amplifier oscillator"
+).split()
+
+QUERIES = [
+    "how do I connect a servo motor to an arduino with pwm",
+    "what is the difference between electrolytic vs. ceramic capacitors",
+    "build a line following robot using esp8266 and a relay",
+    "explain kalman filter for a drone accelerometer and gyroscope",
+    "nodemcu home automation with bluetooth and a lithium ion battery",
+    "why does my lcd display flicker",
+]
+
+
+def synthetic_topics(count, rng):
+    topics = []
+    for index in range(count):
+        words = rng.sample(VOCABULARY, rng.randint(1, 3))
+        topics.append({
+            'topic': f"{' '.join(words)} {index}",
+            'keywords': [' '.join(words) + f" v{index}"],
+            'links': [f"https://example.com/topic/{index}"],
+        })
+    return topics
+
+
+def naive_match(phrases, query):
+    tokens = normalize_tokens(query)
+    text = f" {' '.join(tokens)} "
+    return [topic for phrase, topic in phrases if f" {phrase} " in text]
+
+
+def time_per_call(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for query in QUERIES:
+            fn(query)
+    return (time.perf_counter() - start) / (repeat * len(QUERIES)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--keywords', type=int, action='append',
+                        help='synthetic topics to add (repeatable, default: 0, 1000, 5000)')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, 'keyword_links.json'), encoding='utf-8') as f:
+        base_topics = json.load(f)['topics']
+
+    rng = random.Random(0)
+    report = []
+    for extra in args.keywords or [0, 1000, 5000]:
+        topics = base_topics + synthetic_topics(extra, rng)
+        start = time.perf_counter()
+        matcher = KeywordMatcher(topics)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        phrases = [(' '.join(normalize_tokens(keyword)), topic['topic'])
+                   for topic in topics for keyword in [topic['topic']] + topic['keywords']]
+        report.append({
+            'topics': len(topics),
+            'keyword_phrases': len(phrases),
+            'build_ms': round(build_ms, 2),
+            'aho_corasick_us_per_query': round(time_per_call(matcher.match, args.repeat), 2),
+            'naive_scan_us_per_query': round(time_per_call(lambda q: naive_match(phrases, q), args.repeat), 2),
+        })
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
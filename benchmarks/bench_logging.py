@@ -0,0 +1,150 @@
+"""Logging cost on the request thread: synchronous text lines vs the background queue.
+
+    python benchmarks/bench_logging.py --requests 5000 --gap-ms 0.5 --sinks 0,256
+
+Writes to a pipe drained by a reader thread, as stdout is drained by the
+container's log collector; --sinks lists collector speeds in KB/s (0 =
+as fast as it can read). For each setup it times the logging calls of one
+login request, per request, on the calling thread. Between requests the
+thread sleeps --gap-ms, standing in for the rest of the request (queries,
+the upstream call), during which a background writer can run:
+
+  sync_text          the old setup: basicConfig-style StreamHandler, the
+                     four INFO lines login used to write (password included)
+  queued_json        logging_setup: the lines login writes now (one INFO,
+                     one DEBUG that LOG_LEVEL=INFO skips)
+  queued_json_same   logging_setup with the old four lines, to compare the
+                     handlers alone
+  queued_debug_1pct  LOG_LEVEL=DEBUG with 1% of debug records kept
+
+Also reports how long the writer needed to drain the queue afterwards and
+how many records were dropped because the queue was full.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import logging_setup  # noqa: E402
+
+EMAIL = 'user@example.com'
+
+
+def old_login_lines(log):
+    log.info("Login POST method called.")
+    log.info(f"Form data received: email={EMAIL}, password=hunter2")
+    log.info("User query result: <User 1>")
+    log.info(f"User logged in successfully: {EMAIL}")
+
+
+def new_login_lines(log):
+    log.debug(f"Login attempt: email={EMAIL}, user found=True")
+    log.info(f"User logged in successfully: {EMAIL}")
+
+
+class Collector:
+    """The read end of a pipe, drained at kb_per_s (0 = unthrottled)"""
+
+    def __init__(self, kb_per_s):
+        read_fd, write_fd = os.pipe()
+        self.reader = os.fdopen(read_fd, 'rb', buffering=0)
+        self.stream = os.fdopen(write_fd, 'w', buffering=1)
+        self.kb_per_s = kb_per_s
+        self.received = 0
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        while True:
+            chunk = self.reader.read(4096)
+            if not chunk:
+                return
+            self.received += len(chunk)
+            if self.kb_per_s:
+                time.sleep(len(chunk) / (self.kb_per_s * 1024))
+
+    def close(self):
+        self.stream.close()
+        self.thread.join()
+
+
+def config(level='INFO', sample_rate=0.01):
+    return {'LOG_JSON': True, 'LOG_FORMAT': '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+            'LOG_LEVEL': level, 'LOG_DEBUG_SAMPLE_RATE': sample_rate, 'LOG_QUEUE_SIZE': 10000,
+            'AZURE_OPENAI_API_KEY': 'bench-api-key-0123456789', 'SECRET_KEY': 'bench-secret-key-0123456789'}
+
+
+def reset_logging():
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        if isinstance(handler, logging_setup.BackgroundHandler):
+            handler.stop()
+        root.removeHandler(handler)
+
+
+def install(setup, stream):
+    reset_logging()
+    if setup == 'sync_text':
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(config()['LOG_FORMAT']))
+        logging.getLogger().addHandler(handler)
+        logging.getLogger().setLevel(logging.INFO)
+        return None
+    if setup == 'queued_debug_1pct':
+        return logging_setup.configure(config(level='DEBUG'), stream)
+    return logging_setup.configure(config(), stream)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return round(values[min(int(len(values) * q), len(values) - 1)] * 1e6, 1)
+
+
+def run(setup, kb_per_s, requests, gap):
+    collector = Collector(kb_per_s)
+    handler = install(setup, collector.stream)
+    log = logging.getLogger('app')
+    lines = old_login_lines if setup in ('sync_text', 'queued_json_same') else new_login_lines
+    timings = []
+    started = time.perf_counter()
+    for _ in range(requests):
+        t0 = time.perf_counter()
+        lines(log)
+        timings.append(time.perf_counter() - t0)
+        time.sleep(gap)
+    dropped = handler.dropped if handler is not None else 0
+    reset_logging()
+    drained = time.perf_counter() - started
+    collector.close()
+    return {
+        'setup': setup,
+        'collector_kb_s': kb_per_s or 'unthrottled',
+        'per_request_us_mean': round(sum(timings) / requests * 1e6, 1),
+        'per_request_us_p50': percentile(timings, 0.5),
+        'per_request_us_p99': percentile(timings, 0.99),
+        'per_request_us_max': percentile(timings, 1),
+        'written_until_s': round(drained, 2),
+        'bytes_written': collector.received,
+        'dropped': dropped,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--gap-ms', type=float, default=0.5, help='time between requests, not measured')
+    parser.add_argument('--sinks', default='0,256', help='collector speeds in KB/s, 0 = unthrottled')
+    parser.add_argument('--setups', default='sync_text,queued_json,queued_json_same,queued_debug_1pct')
+    args = parser.parse_args()
+    results = [run(setup, int(kb), args.requests, args.gap_ms / 1000)
+               for kb in args.sinks.split(',') for setup in args.setups.split(',')]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
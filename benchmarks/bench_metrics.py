@@ -0,0 +1,65 @@
+"""Overhead of the timing layer: one stage() and one request's worth of metrics.
+
+    python benchmarks/bench_metrics.py
+
+Runs in Prometheus multiprocess mode (a temporary PROMETHEUS_MULTIPROC_DIR),
+as under gunicorn, where every sample is a write to a memory-mapped file.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='bench-metrics-'))
+import metrics  # noqa: E402
+
+# Stages timed by one uncached /chat request, plus its request-level samples
+CHAT_STAGES = ['pdf_match', 'keywords', 'cache', 'retrieval', 'upstream', 'clean', 'save_chat']
+
+
+def per_call_us(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def one_request():
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    for name in CHAT_STAGES:
+        with metrics.stage(name):
+            pass
+    metrics.UPSTREAM_RESPONSES.labels('200').inc()
+    metrics.record_usage({'prompt_tokens': 120, 'completion_tokens': 300})
+    metrics.DB_SECONDS.labels('INSERT').observe(0.002)
+    metrics.REQUEST_SECONDS.labels('main.chat', 'POST').observe(1.2)
+    metrics.REQUESTS.labels('main.chat', 'POST', '200').inc()
+    metrics.REQUESTS_IN_FLIGHT.dec()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20000)
+    args = parser.parse_args()
+
+    def empty_stage():
+        with metrics.stage('bench'):
+            pass
+
+    report = {
+        'multiprocess_dir': os.environ['PROMETHEUS_MULTIPROC_DIR'],
+        'stage_us': round(per_call_us(empty_stage, args.repeat), 2),
+        'chat_request_metrics_us': round(per_call_us(one_request, args.repeat // 10), 2),
+    }
+    started = time.perf_counter()
+    metrics.render()
+    report['render_metrics_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""Page weight and modelled time to interactive of the chat page, first and repeat visit.
+
+    python benchmarks/bench_page_weight.py
+    git archive HEAD~1 | (mkdir -p /tmp/egpt-before && tar -x -C /tmp/egpt-before)
+    python benchmarks/bench_page_weight.py --source /tmp/egpt-before
+
+Boots gunicorn on a throwaway instance directory (after `flask bootstrap`,
+which builds the assets where the checkout supports it), logs a user with a
+few saved chats in and loads /chat like a browser with an empty cache: the
+HTML, then every same-origin stylesheet, script and image it links, with
+`Accept-Encoding: gzip, deflate, br`. Bytes are counted as sent on the wire.
+The repeat visit replays the page with the first visit's cache: fresh
+responses are not requested again, the others are revalidated with
+If-None-Match / If-Modified-Since.
+
+Time to interactive is modelled, not measured in a browser, for each
+--profile (name:rtt_ms:kbit_per_s): a new connection (one round trip), the
+HTML (one round trip, server time, transfer), then the render-blocking CSS
+and JS (one round trip plus their combined transfer, or one round trip
+when they only need revalidation). `load` adds the images the same way.
+Third-party files (the icon font CDN) are the same before and after and
+are left out.
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_concurrency import ROOT, free_port, wait_for  # noqa: E402
+
+ACCEPT_ENCODING = 'gzip, deflate, br'
+PROFILES = 'slow-4g:150:1600,4g:40:9000,cable:20:50000'
+LINK_PATTERN = re.compile(r'<(link|script|img)\b[^>]*?\b(?:href|src)="([^"]+)"')
+
+
+def fetch(http, url, headers=None):
+    """(response, wire bytes, seconds); the body is read undecoded to count what was sent"""
+    started = time.perf_counter()
+    response = http.get(url, headers={'Accept-Encoding': ACCEPT_ENCODING, **(headers or {})}, stream=True)
+    raw = response.raw.read(decode_content=False)
+    elapsed = time.perf_counter() - started
+    return response, len(raw), elapsed, raw
+
+
+def decoded(response, raw):
+    encoding = response.headers.get('Content-Encoding')
+    if encoding == 'br':
+        import brotli
+        return brotli.decompress(raw)
+    if encoding == 'gzip':
+        import gzip
+        return gzip.decompress(raw)
+    return raw
+
+
+def fresh(response):
+    """Whether a browser may reuse the response without asking the server again"""
+    cache_control = response.headers.get('Cache-Control', '')
+    match = re.search(r'max-age=(\d+)', cache_control)
+    return 'no-cache' not in cache_control and match is not None and int(match.group(1)) > 0
+
+
+def subresources(base_url, html):
+    """[(kind, url)] of same-origin files the page links; kind is blocking or image"""
+    found = []
+    for tag, src in LINK_PATTERN.findall(html):
+        url = urljoin(base_url, src)
+        if urlparse(url).netloc != urlparse(base_url).netloc:
+            continue
+        found.append(('image' if tag == 'img' else 'blocking', url))
+    return list(dict.fromkeys(found))
+
+
+def visit(http, page_url, cache):
+    """Load the page and its resources; `cache` maps url -> response of an earlier visit"""
+    page, page_bytes, page_seconds, raw = fetch(http, page_url)
+    html = decoded(page, raw).decode()
+    result = {'html_bytes': page_bytes, 'html_decoded_bytes': len(html.encode()), 'server_ms': page_seconds * 1000,
+              'blocking': {'bytes': 0, 'requests': 0}, 'image': {'bytes': 0, 'requests': 0}}
+    for kind, url in subresources(page_url, html):
+        previous = cache.get(url)
+        if previous is not None and fresh(previous):
+            continue
+        headers = {}
+        if previous is not None:
+            if previous.headers.get('ETag'):
+                headers['If-None-Match'] = previous.headers['ETag']
+            if previous.headers.get('Last-Modified'):
+                headers['If-Modified-Since'] = previous.headers['Last-Modified']
+        response, size, _, _ = fetch(http, url, headers)
+        response.raise_for_status()
+        if response.status_code != 304:
+            cache[url] = response
+        result[kind]['bytes'] += size
+        result[kind]['requests'] += 1
+    return result
+
+
+def model(result, rtt, kbit):
+    """Modelled milliseconds to interactive and to load"""
+    bytes_per_ms = kbit * 1000 / 8 / 1000
+    html = 2 * rtt + result['server_ms'] + result['html_bytes'] / bytes_per_ms
+
+    def fetched(part):
+        return (rtt + part['bytes'] / bytes_per_ms) if part['requests'] else 0.0
+
+    interactive = html + fetched(result['blocking'])
+    both = {'bytes': result['blocking']['bytes'] + result['image']['bytes'],
+            'requests': result['blocking']['requests'] + result['image']['requests']}
+    return round(interactive), round(html + fetched(both))
+
+
+def run(args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    source = os.path.abspath(args.source or ROOT)
+    with tempfile.TemporaryDirectory() as instance:
+        env = dict(os.environ, INSTANCE_PATH=instance, AZURE_OPENAI_ENDPOINT='http://127.0.0.1:9',
+                   AZURE_OPENAI_API_KEY='fake', DEPLOYMENT_NAME='fake', RAG_ENABLED='false',
+                   PROMETHEUS_MULTIPROC_DIR=os.path.join(instance, 'metrics'))
+        os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'])
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'bootstrap'], cwd=source, env=env,
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+             '--bind', f"127.0.0.1:{port}", '--workers', '1',
+             '--log-level', 'warning', '--access-logfile', '/dev/null'],
+            cwd=source, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(f"{base_url}/login")
+            http = requests.Session()
+            http.post(f"{base_url}/register", data={'username': 'weight', 'email': 'weight@example.com',
+                                                    'password': 'secret'})
+            http.post(f"{base_url}/login", data={'email': 'weight@example.com', 'password': 'secret'})
+            for n in range(args.chats):
+                # Upstream is unreachable, so each query saves the canned error answer
+                http.post(f"{base_url}/chat", data={'query': f"question {n} about resistor values"})
+            page_url = f"{base_url}/chat"
+            cache = {}
+            first = visit(http, page_url, cache)
+            repeats = [visit(http, page_url, cache) for _ in range(args.repeats)]
+            repeat = dict(repeats[-1], server_ms=statistics.median(r['server_ms'] for r in repeats))
+        finally:
+            proc.terminate()
+            proc.wait()
+    report = {'source': source, 'saved_chats': args.chats}
+    for name, result in (('first_visit', first), ('repeat_visit', repeat)):
+        entry = {
+            'html_bytes': result['html_bytes'],
+            'html_decoded_bytes': result['html_decoded_bytes'],
+            'css_js_bytes': result['blocking']['bytes'],
+            'image_bytes': result['image']['bytes'],
+            'total_bytes': result['html_bytes'] + result['blocking']['bytes'] + result['image']['bytes'],
+            'requests': 1 + result['blocking']['requests'] + result['image']['requests'],
+            'server_ms': round(result['server_ms'], 1),
+        }
+        for profile in args.profiles.split(','):
+            label, rtt, kbit = profile.split(':')
+            interactive, load = model(result, float(rtt), float(kbit))
+            entry[f"tti_ms_{label}"] = interactive
+            entry[f"load_ms_{label}"] = load
+        report[name] = entry
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chats', type=int, default=8, help='saved chats shown on the page')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--profiles', default=PROFILES, help='name:rtt_ms:kbit_per_s,...')
+    parser.add_argument('--source', help='checkout of the app to run (default: this one)')
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == '__main__':
+    main()
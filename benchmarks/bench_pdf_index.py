@@ -0,0 +1,78 @@
+"""Build time and query latency of the PDF retrieval index.
+
+    python benchmarks/bench_pdf_index.py --pdf-folder data --queries 2000
+
+Reports the cold build (every PDF parsed), a warm refresh (nothing changed,
+as on a worker restart) and BM25 query latency percentiles as JSON.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pdf_index import PdfIndex  # noqa: E402
+
+QUERIES = [
+    "what is a ceramic capacitor",
+    "electrolytic capacitor vs ceramic capacitor",
+    "how does a capacitor store charge",
+    "nodemcu esp8266 wifi pins",
+    "esp8266 boards comparison",
+    "nickel metal hydride battery benefits",
+    "nimh battery capacity",
+    "capacitor dielectric material",
+    "filtering and surge suppression",
+    "lua firmware nodemcu",
+]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pdf-folder', default='data')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--top-k', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = PdfIndex(index_dir, args.pdf_folder)
+        start = time.perf_counter()
+        index.refresh()
+        cold = time.perf_counter() - start
+
+        start = time.perf_counter()
+        PdfIndex(index_dir, args.pdf_folder).refresh()
+        warm = time.perf_counter() - start
+
+        rng = random.Random(0)
+        latencies = []
+        for _ in range(args.queries):
+            query = rng.choice(QUERIES)
+            start = time.perf_counter()
+            index.search(query, args.top_k)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        report = {
+            'pdf_folder': args.pdf_folder,
+            'chunks': len(index.doc_len),
+            'terms': len(index.vocab),
+            'cold_build_seconds': round(cold, 3),
+            'warm_refresh_seconds': round(warm, 4),
+            'queries': args.queries,
+            'query_ms_p50': round(percentile(latencies, 50), 3),
+            'query_ms_p95': round(percentile(latencies, 95), 3),
+            'query_ms_p99': round(percentile(latencies, 99), 3),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""History search on a million-row chats table: FTS5 vs LIKE, plus the cost of the index.
+
+    python benchmarks/bench_search.py --rows 1000000 --users 1000
+
+Writes --rows chats to a throwaway SQLite database, without the search
+index. They are spread over --users users, one of whom (the "heavy" user)
+owns --heavy-share of them. The text is drawn from a Zipf-distributed
+vocabulary in which `voltage` is a common word, `capacitor` a middling one
+and `thermistor` a rare one. It then runs the migrations and
+`flask backfill-chat-search` as a deploy would, and reports:
+
+  index          migration and backfill time, database size before and after
+  writes         mean time of a single-row chat INSERT before the index
+                 (no triggers) and after it (the FTS triggers run)
+  searches       per user kind and search, p50/p95 milliseconds of:
+                   fts          chat_search.search(), ranked, first page
+                   fts_page_10  the same, tenth page
+                   like_user    LIKE '%term%' on query or response for every
+                                term, limited to the user's rows via
+                                ix_chats_user_id_timestamp and newest first,
+                                since LIKE cannot rank; it can stop at the
+                                first page of matches
+                   like_all     the same LIKE without the user filter (the
+                                full-table scan), run --like-all-repeat times
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault('INSTANCE_PATH', tempfile.mkdtemp(prefix='bench-search-'))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from flask_migrate import Migrate, upgrade  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+import app as app_module  # noqa: E402
+import chat_search  # noqa: E402
+
+DOMAIN = {'voltage': 5, 'capacitor': 60, 'thermistor': 3000, 'current': 8, 'resistor': 40, 'arduino': 20,
+          'servo': 300, 'diode': 150, 'breadboard': 500, 'ground': 30}
+SEARCHES = ('voltage', 'capacitor', 'thermistor', 'capacitor voltage')
+
+
+def like_statement(terms, scoped):
+    """Newest first, every term somewhere in the query or response"""
+    matches = ' AND '.join(f"(query LIKE :p{n} OR response LIKE :p{n})" for n in range(len(terms)))
+    where = f"user_id = :user_id AND {matches}" if scoped else matches
+    return text(f"SELECT id, query, response, timestamp FROM chats WHERE {where} "
+                "ORDER BY timestamp DESC, id DESC LIMIT :limit")
+
+
+def vocabulary(size=20000):
+    """(words, cumulative Zipf weights) with the domain words at fixed ranks"""
+    words = [f"w{n}" for n in range(size)]
+    for word, rank in DOMAIN.items():
+        words[rank] = word
+    return words, list(itertools.accumulate(1 / (rank + 1) for rank in range(size)))
+
+
+def texts(count, length, words, cum_weights, rng):
+    return [' '.join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(*length))) for _ in range(count)]
+
+
+def seed(engine, args, rng):
+    """Insert the users and chats with the driver's executemany; returns the heavy and a typical user id"""
+    words, cum_weights = vocabulary()
+    queries = texts(args.pool, (6, 14), words, cum_weights, rng)
+    responses = texts(args.pool, (40, 90), words, cum_weights, rng)
+    heavy_rows = int(args.rows * args.heavy_share)
+    start = datetime(2025, 1, 1)
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        cursor.executemany("INSERT INTO users (id, username, email, password) VALUES (?, ?, ?, 'x')",
+                           [(n, f"u{n}", f"u{n}@example.com") for n in range(1, args.users + 1)])
+        batch = []
+        for n in range(args.rows):
+            user_id = 1 if n < heavy_rows else 2 + n % (args.users - 1)
+            batch.append((user_id, rng.choice(queries), rng.choice(responses),
+                          (start + timedelta(seconds=30 * n)).isoformat(sep=' ')))
+            if len(batch) == 50000:
+                cursor.executemany("INSERT INTO chats (user_id, query, response, pdf_preview, timestamp) "
+                                   "VALUES (?, ?, ?, 0, ?)", batch)
+                batch = []
+        if batch:
+            cursor.executemany("INSERT INTO chats (user_id, query, response, pdf_preview, timestamp) "
+                               "VALUES (?, ?, ?, 0, ?)", batch)
+        raw.commit()
+    finally:
+        raw.close()
+    return 1, 2
+
+
+def database_size(engine):
+    with engine.connect() as connection:
+        connection.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+        pages = connection.exec_driver_sql('PRAGMA page_count').scalar()
+        page_size = connection.exec_driver_sql('PRAGMA page_size').scalar()
+    return round(pages * page_size / 2 ** 20, 1)
+
+
+def single_inserts(engine, count, user_id):
+    """Mean milliseconds of one autocommitted single-row chat INSERT"""
+    timings = []
+    for n in range(count):
+        started = time.perf_counter()
+        with engine.begin() as connection:
+            connection.execute(text(
+                "INSERT INTO chats (user_id, query, response, pdf_preview, timestamp) "
+                "VALUES (:user_id, :query, :response, 0, CURRENT_TIMESTAMP)"),
+                {'user_id': user_id, 'query': f"bench insert {n} about the capacitor voltage",
+                 'response': "The capacitor charges towards the supply voltage. " * 8})
+        timings.append(time.perf_counter() - started)
+    return round(statistics.mean(timings) * 1000, 3)
+
+
+def timed(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {'p50': round(statistics.median(timings), 2),
+            'p95': round(timings[min(int(len(timings) * 0.95), len(timings) - 1)], 2)}
+
+
+def searches(session, user_id, args):
+    results = {}
+    for query in SEARCHES:
+        terms = chat_search.search_terms(query)
+        params = dict({f"p{n}": f"%{term}%" for n, term in enumerate(terms)}, user_id=user_id, limit=args.limit)
+        entry = {
+            'matches': session.execute(text("SELECT count(*) FROM chats_fts WHERE chats_fts MATCH :match"),
+                                       {'match': chat_search.match_expression(user_id, terms)}).scalar(),
+            'fts': timed(lambda: chat_search.search(session, user_id, query, args.limit), args.repeat),
+            'fts_page_10': timed(lambda: chat_search.search(session, user_id, query, args.limit, 9 * args.limit),
+                                 args.repeat),
+            'like_user': timed(lambda: session.execute(like_statement(terms, True), params).all(), args.repeat),
+        }
+        if args.like_all_repeat:
+            entry['like_all'] = timed(lambda: session.execute(like_statement(terms, False), params).all(),
+                                      args.like_all_repeat)
+        results[query] = entry
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--heavy-share', type=float, default=0.05, help="share of the rows owned by one user")
+    parser.add_argument('--pool', type=int, default=20000, help='distinct query and response texts')
+    parser.add_argument('--limit', type=int, default=20, help='results per page')
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--like-all-repeat', type=int, default=3)
+    parser.add_argument('--writes', type=int, default=500, help='single-row INSERTs timed before and after')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    flask_app = app_module.create_app()
+    app_module.initialize_database(flask_app)
+    Migrate(flask_app, app_module.db, directory=os.path.join(ROOT, 'migrations'))
+    rng = random.Random(args.seed)
+    report = {'rows': args.rows, 'users': args.users, 'heavy_user_rows': int(args.rows * args.heavy_share)}
+    with flask_app.app_context():
+        engine = app_module.db.engine
+        started = time.perf_counter()
+        heavy, typical = seed(engine, args, rng)
+        report['seed_s'] = round(time.perf_counter() - started, 1)
+        size_before = database_size(engine)
+        insert_before = single_inserts(engine, args.writes, typical)
+
+        started = time.perf_counter()
+        upgrade()
+        migration_s = time.perf_counter() - started
+        started = time.perf_counter()
+        indexed = chat_search.backfill(engine)
+        backfill_s = time.perf_counter() - started
+        report['index'] = {'migration_s': round(migration_s, 2), 'backfill_s': round(backfill_s, 1),
+                           'rows_indexed': indexed, 'db_mb_before': size_before,
+                           'db_mb_after': database_size(engine)}
+        report['writes'] = {'insert_ms_without_index': insert_before,
+                            'insert_ms_with_index': single_inserts(engine, args.writes, typical)}
+
+    with flask_app.test_request_context():
+        session = app_module.db.session
+        report['searches'] = {
+            'typical_user': dict(searches(session, typical, args),
+                                 chats=session.execute(text("SELECT count(*) FROM chats WHERE user_id = :u"),
+                                                       {'u': typical}).scalar()),
+            'heavy_user': dict(searches(session, heavy, args),
+                               chats=session.execute(text("SELECT count(*) FROM chats WHERE user_id = :u"),
+                                                     {'u': heavy}).scalar()),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
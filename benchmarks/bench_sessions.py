@@ -0,0 +1,125 @@
+"""Logged-in users across several gunicorn workers: bounces and re-logins.
+
+    python benchmarks/bench_sessions.py --workers 4 --clients 16 --duration 20
+    git worktree add /tmp/egpt-before HEAD~1
+    python benchmarks/bench_sessions.py --source /tmp/egpt-before
+
+Boots gunicorn (without preload, so every worker imports the config itself)
+on a throwaway instance directory. Each client logs in once and then loops
+over GET /chat/history. A 401 means the worker that got the request did not
+accept the session cookie; the client logs in again (password hash check
+and user query included) and carries on. Every request opens a new
+connection, as behind a reverse proxy, so consecutive requests of one user
+land on different workers. Reports useful requests per
+second, bounces, re-logins and latency. --source runs the same load against
+another checkout of the app, e.g. the commit before a change.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_concurrency import ROOT, free_port, wait_for  # noqa: E402
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return round(sorted(values)[min(int(len(values) * q), len(values) - 1)] * 1000, 2)
+
+
+def login(http, base_url, email):
+    started = time.perf_counter()
+    http.post(f"{base_url}/login", data={'email': email, 'password': 'secret'}, allow_redirects=False)
+    return time.perf_counter() - started
+
+
+def client(base_url, index, deadline, stats, lock):
+    http = requests.Session()
+    http.headers['Connection'] = 'close'
+    email = f"session{index}@example.com"
+    http.post(f"{base_url}/register", data={'username': f"session{index}", 'email': email, 'password': 'secret'})
+    logins = [login(http, base_url, email)]
+    history, bounces = [], 0
+    while time.time() < deadline:
+        started = time.perf_counter()
+        response = http.get(f"{base_url}/chat/history", params={'limit': 5})
+        if response.status_code == 401:
+            bounces += 1
+            logins.append(login(http, base_url, email))
+            continue
+        response.raise_for_status()
+        history.append(time.perf_counter() - started)
+    with lock:
+        stats['history'] += history
+        stats['logins'] += logins
+        stats['bounces'] += bounces
+
+
+def run(args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    source = os.path.abspath(args.source or ROOT)
+    with tempfile.TemporaryDirectory() as instance:
+        env = dict(os.environ, INSTANCE_PATH=instance, AZURE_OPENAI_ENDPOINT='http://127.0.0.1:9',
+                   AZURE_OPENAI_API_KEY='fake', DEPLOYMENT_NAME='fake', GUNICORN_PRELOAD='false',
+                   PROMETHEUS_MULTIPROC_DIR=os.path.join(instance, 'metrics'))
+        env.pop('SECRET_KEY', None)
+        os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'])
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'bootstrap'], cwd=source, env=env,
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+             '--bind', f"127.0.0.1:{port}", '--workers', str(args.workers),
+             '--log-level', 'warning', '--access-logfile', '/dev/null'],
+            cwd=source, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(f"{base_url}/login")
+            stats = {'history': [], 'logins': [], 'bounces': 0}
+            lock = threading.Lock()
+            deadline = time.time() + args.duration
+            with ThreadPoolExecutor(args.clients) as pool:
+                for future in [pool.submit(client, base_url, i, deadline, stats, lock)
+                               for i in range(args.clients)]:
+                    future.result()
+        finally:
+            proc.terminate()
+            proc.wait()
+    requests_total = len(stats['history']) + stats['bounces']
+    return {
+        'source': source,
+        'workers': args.workers,
+        'clients': args.clients,
+        'duration_s': args.duration,
+        'useful_rps': round(len(stats['history']) / args.duration, 1),
+        'history_requests': len(stats['history']),
+        'bounces': stats['bounces'],
+        'bounce_rate': round(stats['bounces'] / requests_total, 3) if requests_total else None,
+        'logins': len(stats['logins']),
+        'login_ms_p50': percentile(stats['logins'], 0.5),
+        'history_ms_p50': percentile(stats['history'], 0.5),
+        'history_ms_p99': percentile(stats['history'], 0.99),
+        'login_s_total': round(sum(stats['logins']), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--source', help='checkout of the app to run (default: this one)')
+    args = parser.parse_args()
+    print(json.dumps(run(args), indent=2))
+
+
+if __name__ == '__main__':
+    main()
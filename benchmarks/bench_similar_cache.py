@@ -0,0 +1,132 @@
+"""Near-duplicate cache: lookup latency by index size and hit rate on a query log.
+
+    python benchmarks/bench_similar_cache.py --sizes 1000,10000,100000,300000
+    python benchmarks/bench_similar_cache.py --log queries.txt
+
+Latency: the index is filled with N fingerprints and random questions are
+looked up (SimHash of the query plus the nearest-neighbour scan).
+
+Hit rate: a query log is replayed through the exact response cache and the
+similarity lookup in front of it, as process_search_query does for
+standalone questions. Without --log the log is synthetic: popular topics
+asked in varied phrasings, so wrong hits (a match on another topic) can be
+counted too. A real log is one question per line, e.g.
+
+    sqlite3 instance/site.db "SELECT query FROM chats ORDER BY id" > queries.txt
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from response_cache import MemoryCache, cache_key  # noqa: E402
+from similar_queries import SimilarityIndex, SimilarQueries, simhash, tag  # noqa: E402
+
+TOPICS = [
+    'ceramic capacitor', 'electrolytic capacitor', 'esp8266', 'esp32', 'arduino uno', 'raspberry pi',
+    'npn transistor', 'pnp transistor', 'mosfet', 'ohms law', 'voltage divider', 'pull up resistor',
+    'pwm', 'i2c bus', 'spi bus', 'uart', 'servo motor', 'stepper motor', 'dc motor driver', 'h bridge',
+    'relay module', 'ultrasonic sensor', 'dht11 sensor', 'lm35 temperature sensor', 'photoresistor',
+    'potentiometer', 'breadboard', 'multimeter', 'oscilloscope', 'zener diode', 'schottky diode', 'led',
+    'seven segment display', 'lcd 16x2', 'oled display', 'voltage regulator', 'buck converter',
+    'boost converter', 'lipo battery', 'solar panel', 'rc low pass filter', 'op amp', '555 timer',
+    'shift register', 'capacitive touch sensor', 'bluetooth module', 'wifi access point', 'mqtt',
+    'interrupts', 'debouncing a button', 'analog to digital converter', 'soldering iron',
+]
+PHRASINGS = [
+    'what is {t}', 'what is a {t}', '{t} explained', 'explain {t}', 'how does a {t} work',
+    'tell me about {t}', '{t}', 'can you explain the {t}', 'what are {t}s', 'define {t}',
+]
+
+
+def synthetic_log(n, rng):
+    """(query, topic) pairs; topic popularity is Zipf-like, as in a class asking around a lesson"""
+    weights = [1 / (rank + 1) for rank in range(len(TOPICS))]
+    topics = rng.choices(TOPICS, weights=weights, k=n)
+    return [(rng.choice(PHRASINGS).format(t=topic), topic) for topic in topics]
+
+
+def replay(log, threshold):
+    cache = MemoryCache(ttl=24 * 3600, max_entries=len(log) + 1)
+    similar = SimilarQueries(cache, threshold, ttl=24 * 3600, max_entries=len(log) + 1)
+    counts = {'exact': 0, 'similar': 0, 'miss': 0, 'wrong': 0}
+    for query, topic in log:
+        key = cache_key(query, 'bench', 0.7, 800)
+        if cache.get(key) is not None:
+            counts['exact'] += 1
+            continue
+        cached = similar.lookup(query)
+        if cached is not None:
+            counts['similar'] += 1
+            if topic is not None and cached['topic'] != topic:
+                counts['wrong'] += 1
+            continue
+        counts['miss'] += 1
+        cache.set(key, {'ai_response': '...', 'topic': topic})
+        similar.add(query, key)
+    total = len(log)
+    return {'queries': total, 'upstream_calls': counts['miss'],
+            'exact_hit_rate': round(counts['exact'] / total, 3),
+            'similar_hit_rate': round(counts['similar'] / total, 3),
+            'combined_hit_rate': round((counts['exact'] + counts['similar']) / total, 3),
+            'wrong_hits': counts['wrong'] if log[0][1] is not None else None}
+
+
+def lookup_latency(size, queries, rng):
+    index = SimilarityIndex(max_entries=size + 1)
+    now = time.time()
+    fill = np.frombuffer(rng.randbytes(8 * size), dtype=np.uint64)
+    started = time.perf_counter()
+    for value in fill:
+        index.add(os.urandom(32).hex(), int(value), 0, now)
+    fill_s = time.perf_counter() - started
+    scan_ms, total_ms = [], []
+    for query in queries:
+        started = time.perf_counter()
+        value, tag_value = simhash(query), tag(query)
+        hashed = time.perf_counter()
+        index.nearest(value, tag_value, now - 3600)
+        done = time.perf_counter()
+        scan_ms.append((done - hashed) * 1000)
+        total_ms.append((done - started) * 1000)
+    return {'entries': size, 'fill_s': round(fill_s, 2),
+            'index_mb': round(sum(getattr(index, name).nbytes for name in ('hashes', 'tags', 'keys', 'added'))
+                              / 2 ** 20, 1),
+            'scan_ms_p50': round(statistics.median(scan_ms), 3),
+            'lookup_ms_p50': round(statistics.median(total_ms), 3),
+            'lookup_ms_p99': round(sorted(total_ms)[int(len(total_ms) * 0.99)], 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='1000,10000,100000,300000')
+    parser.add_argument('--log', help='query log, one question per line (default: synthetic)')
+    parser.add_argument('--queries', type=int, default=5000, help='length of the synthetic log')
+    parser.add_argument('--thresholds', default='0.85,0.9,0.95')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.log:
+        with open(args.log, encoding='utf-8') as f:
+            log = [(line.strip(), None) for line in f if line.strip()]
+    else:
+        log = synthetic_log(args.queries, rng)
+    report = {
+        'log': args.log or f"synthetic ({len(log)} queries, {len(TOPICS)} topics)",
+        'hit_rate': {threshold: replay(log, float(threshold)) for threshold in args.thresholds.split(',')},
+        'latency': [lookup_latency(int(size), [query for query, _ in log[:500]], rng)
+                    for size in args.sizes.split(',')],
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Chat history writes from many worker processes against one SQLite file.
+
+    python benchmarks/bench_sqlite_writes.py --workers 8 --threads 8 --requests 200
+
+Each worker process plays a gunicorn worker: its threads save a chat row and
+read the first history page, as /chat does. Three setups are compared:
+
+    legacy    rollback journal, driver defaults (the old engine options)
+    wal       WAL + busy_timeout + synchronous=NORMAL via configure_engine()
+    buffered  wal, with rows queued to a HistoryWriter and inserted in batches
+
+Reports save latency percentiles and "database is locked" errors per setup.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from sqlalchemy import (Column, DateTime, Index, Integer, MetaData, Table, Text,  # noqa: E402
+                        create_engine, insert, select)
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from db_engine import HistoryWriter, configure_engine, engine_options  # noqa: E402
+
+metadata = MetaData()
+chats = Table(
+    'chats', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, nullable=False),
+    Column('query', Text, nullable=False),
+    Column('response', Text, nullable=False),
+    Column('timestamp', DateTime),
+    Index('ix_chats_user_id_timestamp', 'user_id', 'timestamp', 'id'),
+)
+RESPONSE = 'An Arduino is a microcontroller board. ' * 40
+LEGACY_OPTIONS = {'pool_pre_ping': True, 'pool_recycle': 3600}
+
+
+def make_engine(path, mode, busy_timeout_ms):
+    config = {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'SQLALCHEMY_ENGINE_OPTIONS': dict(LEGACY_OPTIONS),
+        'SQLITE_BUSY_TIMEOUT_MS': busy_timeout_ms,
+        'SQLITE_SYNCHRONOUS': 'NORMAL',
+    }
+    if mode == 'legacy':
+        return create_engine(config['SQLALCHEMY_DATABASE_URI'], **LEGACY_OPTIONS)
+    engine = create_engine(config['SQLALCHEMY_DATABASE_URI'], **engine_options(config))
+    configure_engine(engine, config)
+    return engine
+
+
+def worker(path, mode, threads, requests, busy_timeout_ms, results):
+    engine = make_engine(path, mode, busy_timeout_ms)
+
+    def insert_rows(rows):
+        with engine.begin() as conn:
+            conn.execute(insert(chats), rows)
+
+    writer = HistoryWriter(insert_rows, interval=0.05) if mode == 'buffered' else None
+    latencies, errors = [], []
+
+    def client(thread_id):
+        user_id = os.getpid() * 100 + thread_id
+        for n in range(requests):
+            row = {'user_id': user_id, 'query': f'question {n}', 'response': RESPONSE,
+                   'timestamp': datetime.now()}
+            start = time.perf_counter()
+            try:
+                if writer is None or not writer.submit(row):
+                    insert_rows([row])
+                with engine.connect() as conn:
+                    conn.execute(select(chats.c.id, chats.c.query)
+                                 .where(chats.c.user_id == user_id)
+                                 .order_by(chats.c.timestamp.desc(), chats.c.id.desc())
+                                 .limit(20)).all()
+            except OperationalError as e:
+                errors.append(str(e.orig))
+            latencies.append(time.perf_counter() - start)
+
+    pool = [threading.Thread(target=client, args=(i,)) for i in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    if writer is not None:
+        writer.close()
+        errors.extend(['write failed'] * writer.failed)
+    results.put((latencies, errors))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def run(mode, args):
+    directory = tempfile.mkdtemp(prefix=f'bench-sqlite-{mode}-')
+    path = os.path.join(directory, 'site.db')
+    engine = make_engine(path, mode, args.busy_timeout_ms)
+    metadata.create_all(engine)
+    engine.dispose()
+
+    results = multiprocessing.Queue()
+    start = time.perf_counter()
+    procs = [multiprocessing.Process(target=worker, args=(path, mode, args.threads, args.requests,
+                                                          args.busy_timeout_ms, results))
+             for _ in range(args.workers)]
+    for p in procs:
+        p.start()
+    latencies, errors = [], []
+    for _ in procs:
+        lat, err = results.get()
+        latencies += lat
+        errors += err
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+
+    check = create_engine(f'sqlite:///{path}')
+    with check.connect() as conn:
+        rows = conn.exec_driver_sql('SELECT COUNT(*) FROM chats').scalar()
+    check.dispose()
+    return {
+        'mode': mode,
+        'requests': len(latencies),
+        'rows_written': rows,
+        'locked_errors': sum('locked' in e for e in errors),
+        'other_errors': sum('locked' not in e for e in errors),
+        'requests_per_s': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(max(latencies) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200, help='saves per thread')
+    parser.add_argument('--busy-timeout-ms', type=int, default=5000)
+    parser.add_argument('--mode', action='append', choices=['legacy', 'wal', 'buffered'])
+    args = parser.parse_args()
+    print(json.dumps([run(mode, args) for mode in args.mode or ['legacy', 'wal', 'buffered']], indent=2))
+
+
+if __name__ == '__main__':
+    main()
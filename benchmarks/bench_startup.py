@@ -0,0 +1,86 @@
+"""Cold-start cost of a worker: importing app.py, create_app() and the first request.
+
+    python benchmarks/bench_startup.py --runs 5
+
+Every run is a fresh interpreter, so nothing is warm except the OS page
+cache. Also lists which heavy modules the import pulled in and the slowest
+imports from `python -X importtime`, so a new eager import shows up here.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ['openai', 'azure.identity', 'PyPDF2', 'requests', 'numpy', 'alembic', 'gevent']
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.create_app()
+created = time.perf_counter()
+loaded = [name for name in HEAVY if name in sys.modules]
+response = flask_app.test_client().get('/health')
+first_request = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000, 'create_app_ms': (created - imported) * 1000,
+                  'first_request_ms': (first_request - created) * 1000, 'status': response.status_code,
+                  'heavy_modules': loaded}))
+"""
+
+
+def run_probe(env):
+    code = f"HEAVY = {HEAVY_MODULES!r}\n{PROBE}"
+    out = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def slowest_imports(env, top):
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=ROOT, env=env,
+                            check=True, capture_output=True, text=True).stderr
+    rows, children = [], []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = len(name) - len(name.lstrip(' '))
+        # A module is printed after its own imports, so the direct imports of
+        # app.py are the depth-1 rows just before the depth-0 "app" row
+        if depth == 1:
+            if name.strip() == 'app':
+                rows = children
+            children = []
+        elif depth == 3:
+            children.append((int(cumulative) / 1000, name.strip()))
+    return [{'module': name, 'cumulative_ms': round(ms, 1)} for ms, name in sorted(rows, reverse=True)[:top]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=8, help='slowest imports to list')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as instance:
+        env = dict(os.environ, INSTANCE_PATH=instance, PYTHONPATH=ROOT)
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'bootstrap'], cwd=ROOT, env=env,
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        runs = [run_probe(env) for _ in range(args.runs)]
+        report = {
+            'runs': args.runs,
+            'heavy_modules_after_create_app': runs[-1]['heavy_modules'],
+            'slowest_imports': slowest_imports(env, args.top),
+        }
+        for field in ('import_ms', 'create_app_ms', 'first_request_ms'):
+            values = [run[field] for run in runs]
+            report[field] = {'median': round(statistics.median(values), 1), 'max': round(max(values), 1)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""PDF uploads: request latency, time until searchable, and the worker's latency meanwhile.
+
+    python benchmarks/bench_uploads.py --uploads 3 --pages 200 --processes 0,2
+
+For each UPLOAD_EXTRACT_PROCESSES value, boots gunicorn with one worker on
+a throwaway instance directory and uploads --uploads generated text PDFs
+of --pages pages each, back to back. While they are processed, a second
+user keeps requesting /chat/history from the same worker. Reports how long
+the upload requests took, how long until every job was done and its PDF
+showed up in the title lookup, and the history latency during processing.
+With 0 the parsing runs in a thread of the web worker; with a pool it runs
+in separate processes.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from load_concurrency import ROOT, free_port, wait_for  # noqa: E402
+
+WORDS = ('capacitor resistor voltage current circuit diode transistor inductor ground signal frequency '
+         'microcontroller sensor motor relay battery charge amplifier filter oscillator').split()
+
+
+def text_pdf_bytes(pages, lines_per_page=40, seed=0):
+    """A PDF with `pages` pages of text, built with correct xref offsets"""
+    rng = random.Random(seed)
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for _ in range(pages):
+        lines = [' '.join(rng.choice(WORDS) for _ in range(10)) for _ in range(lines_per_page)]
+        text = ' T* '.join(f"({line}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 750 Td {text} ET".encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R "
+                       b"/Resources << /Font << /F1 3 0 R >> >> >>" % (len(objects)))
+        kids.append(len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b' '.join(b"%d 0 R" % kid for kid in kids), pages)
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def logged_in(base_url, name):
+    http = requests.Session()
+    email = f"{name}@example.com"
+    http.post(f"{base_url}/register", data={'username': name, 'email': email, 'password': 'secret'})
+    http.post(f"{base_url}/login", data={'email': email, 'password': 'secret'})
+    return http
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return round(values[min(int(len(values) * q), len(values) - 1)] * 1000, 1) if values else None
+
+
+def run(processes, args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, INSTANCE_PATH=os.path.join(workdir, 'instance'),
+                   PDF_FOLDER=os.path.join(workdir, 'pdfs'), UPLOAD_EXTRACT_PROCESSES=str(processes),
+                   AZURE_OPENAI_ENDPOINT='http://127.0.0.1:9', AZURE_OPENAI_API_KEY='fake',
+                   DEPLOYMENT_NAME='fake', AZURE_OPENAI_MAX_RETRIES='0',
+                   PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, 'metrics'))
+        os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'])
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'bootstrap'], cwd=ROOT, env=env,
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+             '--bind', f"127.0.0.1:{port}", '--workers', '1',
+             '--log-level', 'warning', '--access-logfile', '/dev/null'],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(f"{base_url}/login")
+            uploader, reader = logged_in(base_url, 'uploader'), logged_in(base_url, 'reader')
+            pdfs = [text_pdf_bytes(args.pages, seed=n) for n in range(args.uploads)]
+            # Warm-up request so the probe measures steady state
+            reader.get(f"{base_url}/chat/history")
+            probe, stop = [], threading.Event()
+
+            def probe_loop():
+                while not stop.is_set():
+                    started = time.perf_counter()
+                    reader.get(f"{base_url}/chat/history")
+                    probe.append(time.perf_counter() - started)
+                    time.sleep(0.02)
+
+            thread = threading.Thread(target=probe_loop)
+            started = time.perf_counter()
+            thread.start()
+            upload_times, jobs = [], []
+            for n, body in enumerate(pdfs):
+                sent = time.perf_counter()
+                response = uploader.post(f"{base_url}/documents", params={'filename': f"Bench Notes {n}.pdf"},
+                                         data=body, headers={'Content-Type': 'application/pdf'})
+                upload_times.append(time.perf_counter() - sent)
+                response.raise_for_status()
+                jobs.append(response.json()['status_url'])
+            statuses = {}
+            while len(statuses) < len(jobs) and time.perf_counter() - started < args.timeout:
+                for url in jobs:
+                    job = uploader.get(f"{base_url}{url}").json()
+                    if job['status'] in ('done', 'failed'):
+                        statuses[url] = job['status']
+                time.sleep(0.1)
+            processed = time.perf_counter() - started
+            stop.set()
+            thread.join()
+            answer = uploader.post(f"{base_url}/chat", data={'query': f"bench notes {args.uploads - 1}"}).json()
+        finally:
+            proc.terminate()
+            proc.wait()
+    return {
+        'processes': processes,
+        'uploads': args.uploads,
+        'pages': args.pages,
+        'pdf_kb': round(len(pdfs[0]) / 1024),
+        'upload_request_ms_max': round(max(upload_times) * 1000, 1),
+        'all_done_s': round(processed, 2),
+        'jobs': {status: list(statuses.values()).count(status) for status in set(statuses.values())},
+        'visible_in_lookup': any(c['filename'] == f"Bench_Notes_{args.uploads - 1}.pdf"
+                                 for c in answer.get('pdf_candidates', [])),
+        'history_during_processing': {'requests': len(probe), 'p50_ms': percentile(probe, 0.5),
+                                      'p99_ms': percentile(probe, 0.99),
+                                      'max_ms': round(max(probe) * 1000, 1) if probe else None},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uploads', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--processes', default='0,2', help='UPLOAD_EXTRACT_PROCESSES values to compare')
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+    print(json.dumps([run(int(n), args) for n in args.processes.split(',')], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""Local stand-in for the Azure OpenAI chat/completions endpoint.
+
+Run it and point the app at it:
+
+    python benchmarks/fake_azure_openai.py --port 8089
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8089/ AZURE_OPENAI_API_KEY=fake DEPLOYMENT_NAME=fake python app.py
+
+Answers both plain and ``"stream": true`` requests, so the SSE path of
+/chat can be exercised without network access. Latency can be jittered,
+and a seeded fraction of calls can fail with injected statuses (429s carry
+Retry-After) or have their stream cut off halfway. GET /_stats returns
+the request and error counts.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+COMPLETIONS_PATH = re.compile(r'^/openai/deployments/(?P<deployment>[^/]+)/chat/completions$')
+
+DEFAULT_REPLY = (
+    "**Capacitors** store energy in an electric field. "
+    "A ceramic capacitor uses a ceramic dielectric, while an electrolytic "
+    "capacitor uses an electrolyte to reach a much higher capacitance. ##"
+)
+
+
+class FakeCompletionsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeAzureOpenAI/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/_stats':
+            self.send_json(404, {"error": {"code": "404", "message": "Resource not found"}})
+            return
+        with self.server.lock:
+            self.send_json(200, dict(self.server.stats))
+
+    def do_POST(self):
+        path = self.path.split('?', 1)[0]
+        if not COMPLETIONS_PATH.match(path):
+            self.send_json(404, {"error": {"code": "404", "message": "Resource not found"}})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        reply = self.server.reply
+        delay, error_status, drop = self.server.draw()
+        time.sleep(delay)
+
+        if error_status:
+            self.server.count(f"status_{error_status}")
+            headers = {'Retry-After': str(self.server.retry_after)} if error_status == 429 else {}
+            self.send_json(error_status, {"error": {"code": str(error_status), "message": "Injected failure"}},
+                           headers)
+            return
+
+        usage = {"prompt_tokens": len(json.dumps(body.get('messages', []))) // 4,
+                 "completion_tokens": len(reply.split())}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        if body.get('stream'):
+            include_usage = (body.get('stream_options') or {}).get('include_usage')
+            self.server.count('stream_dropped' if drop else 'stream')
+            self.stream_reply(reply, usage if include_usage else None, drop)
+        else:
+            self.server.count('status_200')
+            self.send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": reply}}],
+                "usage": usage,
+            })
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, payload):
+        self.wfile.write(f"data: {payload}\n\n".encode())
+        self.wfile.flush()
+
+    def stream_reply(self, reply, usage=None, drop=False):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        # Azure leads with a chunk that only carries prompt filter results
+        self.send_event(json.dumps({"choices": [], "prompt_filter_results": []}))
+        tokens = re.findall(r'\S+\s*', reply)
+        for index, token in enumerate(tokens):
+            if drop and index == len(tokens) // 2:
+                # Injected failure: the connection dies mid-answer
+                return
+            time.sleep(self.server.token_delay)
+            self.send_event(json.dumps({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "finish_reason": None, "delta": {"content": token}}],
+            }))
+        self.send_event(json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "choices": [{"index": 0, "finish_reason": "stop", "delta": {}}],
+        }))
+        if usage:
+            self.send_event(json.dumps({"id": "chatcmpl-fake", "object": "chat.completion.chunk",
+                                        "choices": [], "usage": usage}))
+        self.send_event('[DONE]')
+
+
+class FakeCompletionsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, jitter=0.0, token_delay=0.02, reply=DEFAULT_REPLY,
+                 error_rate=0.0, error_statuses=(429,), retry_after=1, drop_rate=0.0, seed=0, verbose=False):
+        super().__init__(address, FakeCompletionsHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.reply = reply
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.retry_after = retry_after
+        self.drop_rate = drop_rate
+        self.verbose = verbose
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = Counter()
+
+    def draw(self):
+        """(delay, injected error status or None, drop the stream?) for one call"""
+        with self.lock:
+            self.stats['requests'] += 1
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            error = self.rng.choice(self.error_statuses) if self.rng.random() < self.error_rate else None
+            drop = self.rng.random() < self.drop_rate
+        return delay, error, drop
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+
+def make_server(host='127.0.0.1', port=8089, latency=0.0, token_delay=0.02, reply=DEFAULT_REPLY, verbose=False,
+                **faults):
+    """faults: jitter, error_rate, error_statuses, retry_after, drop_rate, seed"""
+    return FakeCompletionsServer((host, port), latency=latency, token_delay=token_delay, reply=reply,
+                                 verbose=verbose, **faults)
+
+
+def add_fault_arguments(parser):
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random latency, 0..jitter seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls that fail')
+    parser.add_argument('--error-status', default='429',
+                        help='comma-separated statuses for failed calls, e.g. 429,500,503')
+    parser.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help='fraction of streams cut off halfway through the answer')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def fault_options(args):
+    return {'jitter': args.jitter, 'error_rate': args.error_rate,
+            'error_statuses': [int(status) for status in args.error_status.split(',')],
+            'retry_after': args.retry_after, 'drop_rate': args.drop_rate, 'seed': args.seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before the first byte')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='seconds between streamed tokens')
+    parser.add_argument('--reply', default=DEFAULT_REPLY)
+    parser.add_argument('--verbose', action='store_true')
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.token_delay, args.reply, args.verbose,
+                         **fault_options(args))
+    print(f"Fake Azure OpenAI listening on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
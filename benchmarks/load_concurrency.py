@@ -0,0 +1,124 @@
+"""Concurrent /chat requests served by a single gunicorn worker.
+
+Starts the fake Azure OpenAI server with a fixed latency, boots gunicorn
+with one worker of each requested class against a throwaway instance
+directory, fires N simultaneous POST /chat requests and reports how many
+of them the worker actually handled concurrently:
+
+    python benchmarks/load_concurrency.py --requests 50 --latency 1.0
+
+With sync workers the effective concurrency is 1; with gevent it should
+approach min(requests, MAX_INFLIGHT_UPSTREAM).
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_azure_openai import make_server  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def logged_in_session(base_url, index):
+    http = requests.Session()
+    email = f"load{index}@example.com"
+    http.post(f"{base_url}/register", data={'username': f"load{index}", 'email': email, 'password': 'secret'})
+    http.post(f"{base_url}/login", data={'email': email, 'password': 'secret'})
+    return http
+
+
+def run(worker_class, n_requests, upstream_url):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    with tempfile.TemporaryDirectory() as instance:
+        env = dict(os.environ, INSTANCE_PATH=instance, AZURE_OPENAI_ENDPOINT=upstream_url,
+                   AZURE_OPENAI_API_KEY='fake', DEPLOYMENT_NAME='fake', GUNICORN_WORKER_CLASS=worker_class)
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'bootstrap'], cwd=ROOT, env=env,
+                       check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+             '--bind', f"127.0.0.1:{port}", '--workers', '1',
+             '--log-level', 'warning', '--access-logfile', '/dev/null'],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_for(f"{base_url}/login")
+            sessions = [logged_in_session(base_url, i) for i in range(n_requests)]
+            barrier = threading.Barrier(n_requests)
+
+            def one(index):
+                barrier.wait()
+                start = time.perf_counter()
+                # Distinct queries so the response cache doesn't answer for upstream
+                response = sessions[index].post(f"{base_url}/chat", data={'query': f"capacitor {index}"})
+                return response.status_code, time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(n_requests) as pool:
+                results = list(pool.map(one, range(n_requests)))
+            wall = time.perf_counter() - start
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    latencies = sorted(elapsed for _, elapsed in results)
+    return {
+        'worker_class': worker_class,
+        'requests': n_requests,
+        'ok': sum(1 for status, _ in results if status == 200),
+        'wall_seconds': round(wall, 3),
+        'max_latency_seconds': round(latencies[-1], 3),
+        'requests_per_second': round(n_requests / wall, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=1.0, help='fake upstream latency in seconds')
+    parser.add_argument('--worker-class', action='append', dest='worker_classes',
+                        help='gunicorn worker class to measure (repeatable, default: sync and gevent)')
+    args = parser.parse_args()
+
+    upstream = make_server(port=free_port(), latency=args.latency, token_delay=0)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    upstream_url = f"http://127.0.0.1:{upstream.server_address[1]}/"
+
+    report = []
+    for worker_class in args.worker_classes or ['sync', 'gevent']:
+        result = run(worker_class, args.requests, upstream_url)
+        # Each request spends `latency` upstream, so this is the overlap the worker achieved
+        result['effective_concurrency'] = round(args.requests * args.latency / result['wall_seconds'], 1)
+        report.append(result)
+    upstream.shutdown()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+"""Load test of the app against the fake Azure OpenAI server; fully offline.
+
+    python benchmarks/loadgen.py --concurrency 32 --duration 30 --output before.json
+    python benchmarks/loadgen.py --concurrency 32 --duration 30 --compare before.json
+
+Boots the fake upstream and gunicorn (with gunicorn.conf.py) on a throwaway
+instance directory with a sample PDF. It registers and logs in
+--users accounts, then runs a closed loop: --concurrency clients each pick a
+weighted scenario (--mix) until --duration runs out. Pass --target to load
+an app that is already running instead.
+
+--hogs adds that many greedy users on top, each sending chat_post from
+--hog-concurrency tabs back to back, to check admission control: their
+queries should be turned away with 429 (counted as `rejected`, not as
+errors) while the latency of everyone else stays put. The limits are the
+app's own settings, e.g. USER_RATE_LIMIT=20 in the environment.
+
+The JSON report has throughput and p50/p95/p99 latency per scenario, the
+server-side stage means from /metrics and the fake upstream's counters.
+--compare prints the change against an earlier report.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_azure_openai import add_fault_arguments, fault_options, make_server  # noqa: E402
+from load_concurrency import ROOT, free_port, wait_for  # noqa: E402
+
+SCENARIOS = ('chat_post', 'chat_stream', 'chat_get', 'history', 'pdf')
+DEFAULT_MIX = 'chat_post=4,chat_stream=3,chat_get=1,history=1,pdf=1'
+SAMPLE_PDF = 'Capacitor Basics.pdf'
+TOPICS = ['capacitor', 'arduino servo', 'esp32 wifi', 'relay module', 'stepper motor driver',
+          'voltage divider', 'pwm dimming', 'i2c display', 'ultrasonic sensor', 'lipo battery charging']
+STAGE_RE = re.compile(r'^egpt_stage_duration_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+
+
+def sample_pdf_bytes(text='Capacitors store charge between two plates separated by a dielectric.'):
+    """A one-page PDF with a line of text, built with correct xref offsets"""
+    stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode()
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in SCENARIOS:
+            raise SystemExit(f"unknown scenario {name!r}; choose from {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def summarize(samples, elapsed):
+    """samples: [(latency seconds, ok)]; ok is None for a query rejected with 429"""
+    latencies = sorted(latency for latency, _ in samples)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None  # noqa: E731
+    return {
+        'count': len(samples),
+        'errors': sum(1 for _, ok in samples if ok is False),
+        'rejected': sum(1 for _, ok in samples if ok is None),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(latencies[-1]) if latencies else None,
+    }
+
+
+class VirtualUser:
+    """One logged-in browser: its own cookie jar and a seeded query stream"""
+
+    def __init__(self, base_url, index, rng, repeat_ratio, tab=0):
+        self.base_url = base_url
+        self.index = index
+        # Several tabs may share one account; their queries stay distinct
+        self.tab = tab
+        self.rng = rng
+        self.repeat_ratio = repeat_ratio
+        self.http = requests.Session()
+        self.sent = 0
+        self.history_cursor = None
+
+    def timed(self, fn):
+        start = time.perf_counter()
+        try:
+            ok = fn()
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - start, ok
+
+    def register_and_login(self):
+        email = f"load{self.index}@example.com"
+        register = self.timed(lambda: self.http.post(
+            f"{self.base_url}/register", allow_redirects=False,
+            data={'username': f"load{self.index}", 'email': email, 'password': 'secret'}).status_code < 400)
+        login = self.timed(lambda: self.http.post(
+            f"{self.base_url}/login", allow_redirects=False,
+            data={'email': email, 'password': 'secret'}).status_code == 302)
+        return register, login
+
+    def next_query(self):
+        # Repeated queries exercise the response cache; the rest are unique
+        self.sent += 1
+        topic = self.rng.choice(TOPICS)
+        if self.rng.random() < self.repeat_ratio:
+            return f"explain {topic}"
+        return f"explain {topic} ({self.index}.{self.tab}-{self.sent})"
+
+    def chat_post(self):
+        response = self.http.post(f"{self.base_url}/chat", data={'query': self.next_query()})
+        if response.status_code == 429:
+            return None
+        return response.status_code == 200 and bool(response.json().get('ai_response'))
+
+    def chat_stream(self):
+        response = self.http.post(f"{self.base_url}/chat", data={'query': self.next_query()},
+                                  headers={'Accept': 'text/event-stream'}, stream=True)
+        with response:
+            if response.status_code == 429:
+                return None
+            events = [line for line in response.iter_lines(decode_unicode=True) if line.startswith('event:')]
+        return response.status_code == 200 and bool(events) and events[-1] == 'event: done'
+
+    def chat_get(self):
+        return self.http.get(f"{self.base_url}/chat").status_code == 200
+
+    def history(self):
+        params = {'cursor': self.history_cursor} if self.history_cursor else {}
+        response = self.http.get(f"{self.base_url}/chat/history", params=params)
+        if response.status_code != 200:
+            return False
+        self.history_cursor = response.json().get('next_cursor')
+        return True
+
+    def pdf(self):
+        response = self.http.get(f"{self.base_url}/pdfs/{SAMPLE_PDF}")
+        return response.status_code == 200 and response.content.startswith(b'%PDF')
+
+
+def run_load(base_url, args):
+    rng = random.Random(args.seed)
+    users = [VirtualUser(base_url, index, random.Random(rng.random()), args.repeat_ratio)
+             for index in range(args.users)]
+    hogs = [VirtualUser(base_url, args.users + index, random.Random(rng.random()), 0, tab)
+            for index in range(args.hogs) for tab in range(args.hog_concurrency)]
+    samples = defaultdict(list)
+    with ThreadPoolExecutor(min(args.concurrency, args.users)) as pool:
+        for register, login in pool.map(VirtualUser.register_and_login, users):
+            samples['register'].append(register)
+            samples['login'].append(login)
+    for hog in hogs:
+        hog.register_and_login()
+
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def client(slot):
+        picker = random.Random(args.seed * 1000 + slot)
+        # Each client drives its own users, so no session is used by two threads
+        mine = users[slot::args.concurrency] or [users[slot % len(users)]]
+        local = defaultdict(list)
+        while time.perf_counter() < deadline:
+            user = mine[picker.randrange(len(mine))]
+            name = picker.choices(names, weights)[0]
+            local[name].append(user.timed(getattr(user, name)))
+        with lock:
+            for name, values in local.items():
+                samples[name].extend(values)
+
+    def hog_client(hog):
+        local = []
+        while time.perf_counter() < deadline:
+            local.append(hog.timed(hog.chat_post))
+        with lock:
+            samples['hog_chat_post'].extend(local)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(slot,)) for slot in range(args.concurrency)]
+    threads += [threading.Thread(target=hog_client, args=(hog,)) for hog in hogs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    scenarios = {name: summarize(values, elapsed) for name, values in samples.items()
+                 if name not in ('register', 'login')}
+    setup = {name: summarize(samples[name], 0) for name in ('register', 'login')}
+    overall = summarize([sample for name in scenarios if name != 'hog_chat_post' for sample in samples[name]],
+                        elapsed)
+    return {'elapsed_seconds': round(elapsed, 2), 'overall': overall, 'scenarios': scenarios, 'setup': setup}
+
+
+def server_stages(base_url):
+    """Mean milliseconds per stage from /metrics"""
+    try:
+        text = requests.get(f"{base_url}/metrics", timeout=10).text
+    except requests.RequestException:
+        return {}
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        match = STAGE_RE.match(line)
+        if match:
+            (sums if match.group(1) == 'sum' else counts)[match.group(2)] = float(match.group(3))
+    return {stage: round(sums[stage] / counts[stage] * 1000, 3) for stage in sorted(counts) if counts[stage]}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def boot_app(args, upstream_url, workdir):
+    pdf_folder = os.path.join(workdir, 'pdfs')
+    os.makedirs(pdf_folder)
+    with open(os.path.join(pdf_folder, SAMPLE_PDF), 'wb') as f:
+        f.write(sample_pdf_bytes())
+    port = free_port()
+    env = dict(os.environ, INSTANCE_PATH=os.path.join(workdir, 'instance'), PDF_FOLDER=pdf_folder,
+               AZURE_OPENAI_ENDPOINT=upstream_url, AZURE_OPENAI_API_KEY='fake', DEPLOYMENT_NAME='fake',
+               PROMETHEUS_MULTIPROC_DIR=os.path.join(workdir, 'metrics'),
+               WEB_CONCURRENCY=str(args.workers), GUNICORN_WORKER_CLASS=args.worker_class)
+    env.pop('FLASK_ENV', None)
+    os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'])
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'bootstrap'], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    log = open(os.path.join(workdir, 'gunicorn.log'), 'w')
+    proc = subprocess.Popen([sys.executable, '-m', 'gunicorn', '--config', 'gunicorn.conf.py',
+                             '--bind', f"127.0.0.1:{port}", '--log-level', 'warning',
+                             '--access-logfile', '/dev/null'],
+                            cwd=ROOT, env=env, stdout=log, stderr=log)
+    base_url = f"http://127.0.0.1:{port}"
+    wait_for(f"{base_url}/login", timeout=60)
+    return proc, base_url
+
+
+def compare(baseline, current):
+    """Print p50/p95/p99 and throughput changes per scenario"""
+    rows = [('overall', baseline['overall'], current['overall'])]
+    rows += [(name, baseline['scenarios'][name], current['scenarios'][name])
+             for name in current['scenarios'] if name in baseline['scenarios']]
+    print(f"{'scenario':<12} {'metric':<15} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, before, after in rows:
+        for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'errors', 'rejected'):
+            old, new = before.get(metric), after.get(metric)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else ''
+            print(f"{name:<12} {metric:<15} {old:>10} {new:>10} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', help='base URL of a running app; skips booting gunicorn and the fake upstream')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load after login')
+    parser.add_argument('--users', type=int, default=32)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument('--repeat-ratio', type=float, default=0.3,
+                        help='fraction of chat queries drawn from a small repeated set')
+    parser.add_argument('--hogs', type=int, default=0, help='extra users flooding chat_post')
+    parser.add_argument('--hog-concurrency', type=int, default=8, help='parallel tabs per hog')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--worker-class', default='gevent')
+    parser.add_argument('--latency', type=float, default=0.5, help='fake upstream latency in seconds')
+    parser.add_argument('--token-delay', type=float, default=0.01)
+    add_fault_arguments(parser)
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    parser.add_argument('--compare', help='earlier report to compare against')
+    args = parser.parse_args()
+
+    upstream, proc = None, None
+    with tempfile.TemporaryDirectory(prefix='loadgen-') as workdir:
+        try:
+            if args.target:
+                base_url = args.target.rstrip('/')
+            else:
+                upstream = make_server(port=free_port(), latency=args.latency, token_delay=args.token_delay,
+                                       **fault_options(args))
+                threading.Thread(target=upstream.serve_forever, daemon=True).start()
+                proc, base_url = boot_app(args, f"http://127.0.0.1:{upstream.server_address[1]}/", workdir)
+            result = run_load(base_url, args)
+            result['server_stage_mean_ms'] = server_stages(base_url)
+            if upstream is not None:
+                result['upstream'] = dict(upstream.stats)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+            if upstream is not None:
+                upstream.shutdown()
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'args': vars(args),
+        },
+        **result,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+"""Full-text search over a user's chat history.
+
+On SQLite the migration adds chats_fts, an FTS5 index of chats.query and
+chats.response. It is an external-content table, so the text is stored
+once, in chats, and triggers on chats keep the index in step. The user id
+is indexed as a token and the search term `user_id : "<id>"` is part of
+every query. FTS5 therefore only walks the user's rows, and other users'
+history is never read. On PostgreSQL the same migration adds a weighted
+tsvector column, chats.search_vector, with a GIN index and a trigger.
+
+Rows saved before the migration are indexed by `flask backfill-chat-search`,
+which `flask bootstrap` also runs. Results are ranked by relevance, with
+query matches counting twice as much as response matches. Highlighted
+snippets are returned as escaped HTML with the matches in <mark>.
+
+Any other database is searched with LIKE: every word must appear in the
+query or response, results come newest first rather than ranked, and every
+row of the user is scanned.
+"""
+import html
+import logging
+import re
+from collections import namedtuple
+
+from sqlalchemy import DateTime, text
+
+logger = logging.getLogger(__name__)
+
+# Search input is reduced to words, so FTS5 / tsquery syntax in it is never interpreted
+TERM_PATTERN = re.compile(r'\w+')
+MAX_TERMS = 16
+# Highlight markers that cannot occur in saved text; swapped for <mark> after escaping
+START, STOP = '\x02', '\x03'
+SNIPPET_TOKENS = 24
+# bm25 weights for the user_id, query and response columns
+RANK = 'bm25(0.0, 2.0, 1.0)'
+
+SQLITE_SEARCH = text(f"""
+    SELECT c.id, c.timestamp,
+           highlight(chats_fts, 1, :start, :stop) AS query_html,
+           snippet(chats_fts, 2, :start, :stop, '…', {SNIPPET_TOKENS}) AS snippet_html
+    FROM chats_fts JOIN chats c ON c.id = chats_fts.rowid
+    WHERE chats_fts MATCH :match AND rank MATCH '{RANK}'
+    ORDER BY rank
+    LIMIT :limit OFFSET :offset
+""").columns(timestamp=DateTime)
+
+# Ranked ids first, so ts_headline only runs on the rows of the page
+POSTGRES_SEARCH = text("""
+    WITH hits AS (
+        SELECT id, ts_rank_cd(search_vector, q) AS score
+        FROM chats, plainto_tsquery('english', :terms) q
+        WHERE user_id = :user_id AND search_vector @@ q
+        ORDER BY score DESC, id DESC
+        LIMIT :limit OFFSET :offset
+    )
+    SELECT c.id, c.timestamp,
+           ts_headline('english', c.query, q, :whole) AS query_html,
+           ts_headline('english', c.response, q, :fragments) AS snippet_html
+    FROM hits JOIN chats c ON c.id = hits.id, plainto_tsquery('english', :terms) q
+    ORDER BY hits.score DESC, c.id DESC
+""").columns(timestamp=DateTime)
+HEADLINE_WHOLE = f'StartSel="{START}", StopSel="{STOP}", HighlightAll=true'
+HEADLINE_FRAGMENTS = (f'StartSel="{START}", StopSel="{STOP}", MaxFragments=2, '
+                      f'MaxWords={SNIPPET_TOKENS}, MinWords=8, FragmentDelimiter=" … "')
+
+# Fallback without an index; a term is \w+, so `_` is the only LIKE wildcard in it
+LIKE_TERM = "(query LIKE :term{n} ESCAPE '\\' OR response LIKE :term{n} ESCAPE '\\')"
+LIKE_SEARCH = """
+    SELECT id, timestamp, query, response FROM chats
+    WHERE user_id = :user_id AND {matches}
+    ORDER BY timestamp DESC, id DESC
+    LIMIT :limit OFFSET :offset
+"""
+SearchRow = namedtuple('SearchRow', 'id timestamp query_html snippet_html')
+
+SQLITE_BACKFILL = text("""
+    INSERT INTO chats_fts(rowid, user_id, query, response)
+    SELECT id, user_id, query, response FROM chats
+    WHERE id > :after AND id <= :until
+      AND NOT EXISTS (SELECT 1 FROM chats_fts_docsize d WHERE d.id = chats.id)
+""")
+# The search_vector trigger fires on any UPDATE that sets query
+POSTGRES_BACKFILL = text("""
+    UPDATE chats SET query = query
+    WHERE id > :after AND id <= :until AND (search_vector IS NULL OR :rebuild)
+""")
+
+
+def search_terms(query):
+    """The words of a search, lowercased and de-duplicated"""
+    return list(dict.fromkeys(term.lower() for term in TERM_PATTERN.findall(query)))[:MAX_TERMS]
+
+
+def match_expression(user_id, terms):
+    """FTS5 query for rows of `user_id` that contain every term in the query or response"""
+    phrases = ' '.join(f'"{term}"' for term in terms)
+    return f'user_id : "{int(user_id)}" AND {{query response}} : ({phrases})'
+
+
+def markup(highlighted):
+    """Escaped HTML of a highlighted text, matches wrapped in <mark>"""
+    return html.escape(highlighted or '').replace(START, '<mark>').replace(STOP, '</mark>')
+
+
+def highlight(saved, terms):
+    """The saved text with every occurrence of a term between the highlight markers"""
+    pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+    return pattern.sub(lambda match: f"{START}{match.group(0)}{STOP}", saved or '')
+
+
+def snippet(saved, terms):
+    """About SNIPPET_TOKENS words of the saved text around its first match, highlighted"""
+    words = (saved or '').split()
+    first = next((index for index, word in enumerate(words) if any(term in word.lower() for term in terms)), 0)
+    start = max(0, first - SNIPPET_TOKENS // 4)
+    before = '…' if start else ''
+    after = '…' if start + SNIPPET_TOKENS < len(words) else ''
+    return before + highlight(' '.join(words[start:start + SNIPPET_TOKENS]), terms) + after
+
+
+def like_search(session, user_id, terms, limit, offset):
+    """Rows of the user containing every term, newest first, found by scanning"""
+    matches = ' AND '.join(LIKE_TERM.format(n=n) for n in range(len(terms)))
+    params = {f"term{n}": '%' + term.replace('_', '\\_') + '%' for n, term in enumerate(terms)}
+    rows = session.execute(text(LIKE_SEARCH.format(matches=matches)).columns(timestamp=DateTime),
+                           dict(params, user_id=user_id, limit=limit, offset=offset)).all()
+    return [SearchRow(row.id, row.timestamp, highlight(row.query, terms), snippet(row.response, terms))
+            for row in rows]
+
+
+def search(session, user_id, query, limit, offset=0):
+    """One page of the user's chats matching every word of `query`, best first
+    (newest first on databases without a search index).
+
+    Returns (rows, next_offset); each row has id, timestamp, query_html and
+    snippet_html. next_offset is None on the last page.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return [], None
+    dialect = session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        rows = session.execute(SQLITE_SEARCH, {
+            'match': match_expression(user_id, terms), 'start': START, 'stop': STOP,
+            'limit': limit + 1, 'offset': offset}).all()
+    elif dialect == 'postgresql':
+        rows = session.execute(POSTGRES_SEARCH, {
+            'terms': ' '.join(terms), 'user_id': user_id, 'whole': HEADLINE_WHOLE,
+            'fragments': HEADLINE_FRAGMENTS, 'limit': limit + 1, 'offset': offset}).all()
+    else:
+        rows = like_search(session, user_id, terms, limit + 1, offset)
+    next_offset = offset + limit if len(rows) > limit else None
+    return rows[:limit], next_offset
+
+
+def unindexed(connection):
+    """Number of chats the search index is missing"""
+    if connection.dialect.name == 'sqlite':
+        return connection.execute(text(
+            "SELECT (SELECT count(*) FROM chats) - (SELECT count(*) FROM chats_fts_docsize)")).scalar()
+    return connection.execute(text("SELECT count(*) FROM chats WHERE search_vector IS NULL")).scalar()
+
+
+def backfill(engine, batch_size=5000, rebuild=False):
+    """Index the chats the search index is missing; returns how many were indexed.
+
+    Works through the table in id ranges of batch_size, one transaction each,
+    so the write lock is never held for long and chats keep being saved
+    meanwhile. rebuild=True reindexes every row instead; on SQLite that is
+    FTS5's own rebuild, in a single transaction.
+    """
+    if engine.dialect.name not in ('sqlite', 'postgresql'):
+        # Searched with LIKE, there is no index to fill
+        return 0
+    sqlite = engine.dialect.name == 'sqlite'
+    if sqlite and rebuild:
+        with engine.begin() as connection:
+            connection.execute(text("INSERT INTO chats_fts(chats_fts) VALUES ('rebuild')"))
+            return connection.execute(text("SELECT count(*) FROM chats")).scalar()
+    with engine.connect() as connection:
+        if not rebuild and not unindexed(connection):
+            return 0
+        first, last = connection.execute(text("SELECT min(id), max(id) FROM chats")).one()
+    if first is None:
+        return 0
+    indexed = 0
+    for after in range(first - 1, last, batch_size):
+        with engine.begin() as connection:
+            if sqlite:
+                result = connection.execute(SQLITE_BACKFILL, {'after': after, 'until': after + batch_size})
+            else:
+                result = connection.execute(POSTGRES_BACKFILL, {
+                    'after': after, 'until': after + batch_size, 'rebuild': rebuild})
+            indexed += result.rowcount
+        logger.debug(f"Chat search backfill up to id {after + batch_size}: {indexed} rows")
+    return indexed
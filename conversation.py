@@ -0,0 +1,117 @@
+"""Conversation context for follow-up questions, held to a token budget.
+
+Only questions that read as follow-ups ("why is that?", "and for a 9V
+battery?") get context; a standalone question is sent, cached and shared
+on its own, like one from a user without history. The prompt gets the
+user's most recent turns, newest first until the budget is spent,
+preceded by a rolling summary of the turns before them. Tokens
+are counted locally with a word-based estimate that errs on the high side
+(tiktoken would need to download its encoding on first use). The summary
+itself is stored by the app and only regenerated after several turns have
+dropped out of the window, so most requests reuse it.
+"""
+import hashlib
+import json
+import re
+
+# Chat-format overhead per message (role and separators), as in OpenAI's counting recipe
+MESSAGE_OVERHEAD = 4
+
+WORD = re.compile(r"\w+|[^\w\s]")
+
+# Words that point back at the conversation, openings that continue it, and
+# whole queries that only make sense after an answer
+FOLLOW_UP_WORDS = frozenset({
+    'it', 'its', 'they', 'them', 'their', 'this', 'that', 'these', 'those', 'he', 'she', 'him', 'her',
+    'same', 'above', 'previous', 'earlier', 'again', 'else', 'instead', 'another',
+})
+FOLLOW_UP_OPENINGS = ('and', 'but', 'so', 'also', 'then', 'what about', 'how about', 'what if', 'more',
+                      'explain more', 'tell me more')
+FOLLOW_UP_QUERIES = frozenset({'why', 'how', 'really', 'example', 'an example', 'ok', 'okay', 'thanks',
+                               'go on', 'continue'})
+
+SUMMARY_PROMPT = ("Summarize the conversation so far for the assistant that will continue it. "
+                  "Keep the topics, facts, names and any open questions; leave out pleasantries. "
+                  "Answer in at most {words} words.")
+
+
+def is_follow_up(query):
+    """Whether a query reads as continuing the conversation rather than standing alone"""
+    words = re.findall(r"[a-z]+", query.lower())
+    if not words:
+        return False
+    text = ' '.join(words)
+    return (text in FOLLOW_UP_QUERIES or any(word in FOLLOW_UP_WORDS for word in words)
+            or any(text == start or text.startswith(start + ' ') for start in FOLLOW_UP_OPENINGS))
+
+
+def count_tokens(text):
+    """Estimated GPT tokens in text: about four characters per token for words,
+    one per punctuation mark, rounded up"""
+    if not text:
+        return 0
+    return sum(-(-len(word) // 4) for word in WORD.findall(text))
+
+
+def message_tokens(content):
+    return count_tokens(content) + MESSAGE_OVERHEAD
+
+
+def turn_tokens(turn):
+    return message_tokens(turn.query) + message_tokens(turn.response)
+
+
+def fit_turns(turns, budget):
+    """Split newest-first turns into the ones that fit the budget (returned oldest
+    first, ready for the prompt) and the older ones left over (newest first)"""
+    used = 0
+    for index, turn in enumerate(turns):
+        used += turn_tokens(turn)
+        if used > budget:
+            return list(reversed(turns[:index])), turns[index:]
+    return list(reversed(turns)), []
+
+
+def summary_chunks(turns, budget):
+    """Newest-first turns as oldest-first chunks of at most `budget` tokens each (a
+    single turn over the budget is a chunk of its own), in the order to summarize them"""
+    chunks, chunk, used = [], [], 0
+    for turn in reversed(turns):
+        tokens = turn_tokens(turn)
+        if chunk and used + tokens > budget:
+            chunks.append(chunk)
+            chunk, used = [], 0
+        chunk.append(turn)
+        used += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def turn_messages(turns):
+    messages = []
+    for turn in turns:
+        messages.append({"role": "user", "content": turn.query})
+        messages.append({"role": "assistant", "content": turn.response})
+    return messages
+
+
+def summary_messages(previous_summary, turns, max_tokens):
+    """chat/completions messages asking to fold `turns` (oldest first) into the summary"""
+    transcript = []
+    if previous_summary:
+        transcript.append(f"Summary of the earlier conversation: {previous_summary}")
+    for turn in turns:
+        transcript.append(f"User: {turn.query}\nAssistant: {turn.response}")
+    return [
+        {"role": "system", "content": SUMMARY_PROMPT.format(words=max_tokens * 3 // 4)},
+        {"role": "user", "content": "\n\n".join(transcript)},
+    ]
+
+
+def fingerprint(summary, turns):
+    """Short digest of the context, so cached answers are only reused for the same conversation"""
+    if not summary and not turns:
+        return None
+    payload = json.dumps([summary, [[turn.query, turn.response] for turn in turns]])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
@@ -0,0 +1,162 @@
+"""Engine settings for the chat database and a buffered writer for history rows.
+
+SQLite (the default) is switched to WAL so readers never block the single
+writer, and every connection waits up to busy_timeout for the write lock
+instead of failing with "database is locked". Any other SQLALCHEMY_DATABASE_URI,
+such as postgresql+psycopg2://..., gets a sized connection pool instead.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database"""
+    options = dict(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    if make_url(config['SQLALCHEMY_DATABASE_URI']).get_backend_name() == 'sqlite':
+        # busy_timeout is set by the connect pragma; keep the driver's own wait in step
+        options.setdefault('connect_args', {}).setdefault('timeout', config['SQLITE_BUSY_TIMEOUT_MS'] / 1000)
+    else:
+        options.setdefault('pool_size', config['SQLALCHEMY_POOL_SIZE'])
+        options.setdefault('max_overflow', config['SQLALCHEMY_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', config['SQLALCHEMY_POOL_TIMEOUT'])
+    return options
+
+
+def configure_engine(engine, config):
+    """Apply the SQLite connect pragmas to every new connection of the engine"""
+    if engine.dialect.name != 'sqlite':
+        return
+    busy_timeout = int(config['SQLITE_BUSY_TIMEOUT_MS'])
+    synchronous = config['SQLITE_SYNCHRONOUS'].upper()
+    if synchronous not in SYNCHRONOUS_LEVELS:
+        raise ValueError(f"SQLITE_SYNCHRONOUS must be one of {', '.join(SYNCHRONOUS_LEVELS)}")
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f'PRAGMA busy_timeout={busy_timeout}')
+            cursor.execute('PRAGMA journal_mode=WAL')
+            # NORMAL only fsyncs at checkpoints in WAL mode; a power loss can drop
+            # the last commits but never corrupts the database
+            cursor.execute(f'PRAGMA synchronous={synchronous}')
+        finally:
+            cursor.close()
+
+    logger.info(f"SQLite engine using WAL, busy_timeout={busy_timeout}ms, synchronous={synchronous}")
+
+
+class HistoryWriter:
+    """Queues history rows and inserts them in batches from a background thread.
+
+    `flush_rows` receives a list of row dicts and must write them in one
+    transaction. submit() never blocks: it returns False when the queue is
+    full so the caller can fall back to a synchronous insert. A batch that
+    fails is retried `retries` times with backoff (a locked or restarting
+    database), then written row by row, so only rows the database rejects
+    on their own are lost.
+    """
+
+    def __init__(self, flush_rows, interval=1.0, batch_size=100, max_pending=10000, retries=3):
+        self.flush_rows = flush_rows
+        self.interval = interval
+        self.batch_size = batch_size
+        self.retries = retries
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pid = None
+        self.stopping = False
+        self.written = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        # Started lazily and per process: a thread started before gunicorn forks
+        # does not exist in the workers
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+            self.pid = os.getpid()
+            self.stopping = False
+            self.thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+            self.thread.start()
+            atexit.register(self.close)
+
+    def submit(self, row):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(row)
+            return True
+        except queue.Full:
+            logger.warning("History writer queue full, writing synchronously")
+            return False
+
+    def _take_batch(self, timeout):
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(min(self.interval * 2 ** (attempt - 1), 30))
+            try:
+                self.flush_rows(batch)
+                self.written += len(batch)
+                return
+            except Exception as e:
+                logger.warning(f"Writing {len(batch)} history rows failed (attempt {attempt + 1}): {str(e)}")
+        for row in batch:
+            try:
+                self.flush_rows([row])
+                self.written += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Failed to write a history row of user {row.get('user_id')}: {str(e)}")
+
+    def _run(self):
+        while not self.stopping:
+            batch = self._take_batch(self.interval)
+            if batch:
+                self._write(batch)
+
+    def flush(self):
+        """Write everything queued so far from the calling thread"""
+        while True:
+            batch = self._take_batch(0)
+            if not batch:
+                return
+            self._write(batch)
+
+    def close(self):
+        if self.pid != os.getpid():
+            return
+        self.stopping = True
+        if self.thread is not None:
+            self.thread.join(timeout=self.interval + 5)
+        self.flush()
+
+    def stats(self):
+        return {'pending': self.queue.qsize(), 'written': self.written, 'failed': self.failed}
@@ -0,0 +1,238 @@
+"""PDF uploads: streamed to disk, then parsed and indexed in a process pool.
+
+An upload request only copies the body to UPLOAD_FOLDER in fixed-size
+chunks (hashing it on the way), records a job and returns 202. Text
+extraction, the content-addressed store and the index rebuild run in a
+pool of UPLOAD_EXTRACT_PROCESSES processes, so PyPDF2's pure-Python
+parsing does not hold the web worker's GIL. The child process writes its
+progress into the job row, which any worker can read back. Once the job is
+done the title lookup and the retrieval index of every worker pick the new
+PDF up on their next check, no restart needed.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+PDF_MAGIC = b'%PDF-'
+# Progress is written at most this often (seconds), not once per page
+PROGRESS_INTERVAL = 0.5
+
+
+class UploadRejected(Exception):
+    """The upload is not an acceptable PDF; status_code is the HTTP status to answer with"""
+
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def receive_upload(stream, folder, max_bytes):
+    """Copy a request body to a new file in folder, CHUNK_SIZE bytes at a time.
+
+    Returns (path, sha256, size). The body must start like a PDF and stay
+    within max_bytes; otherwise the partial file is removed and
+    UploadRejected is raised.
+    """
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{uuid.uuid4().hex}.pdf.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0 and not chunk.startswith(PDF_MAGIC[:len(chunk)]):
+                    raise UploadRejected("Only PDF files can be uploaded", 415)
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(f"File is larger than {max_bytes // (1024 * 1024)} MB", 413)
+                digest.update(chunk)
+                f.write(chunk)
+        if size < len(PDF_MAGIC):
+            raise UploadRejected("Only PDF files can be uploaded", 415)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest(), size
+
+
+class SQLiteJobs:
+    """Upload jobs in a SQLite file, written by the web workers and the extraction processes"""
+
+    FIELDS = ('id', 'user_id', 'filename', 'sha256', 'size', 'status', 'pages_done', 'pages_total',
+              'error', 'created_at', 'updated_at')
+
+    def __init__(self, path):
+        self.path = path
+        self.ready = False
+
+    def _connect(self):
+        if not self.ready:
+            # First use in this process
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with closing(sqlite3.connect(self.path, timeout=5)) as conn, conn:
+                self._create_table(conn)
+            self.ready = True
+        return sqlite3.connect(self.path, timeout=5)
+
+    def _create_table(self, conn):
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS upload_jobs ('
+                     'id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, filename TEXT NOT NULL, '
+                     'sha256 TEXT NOT NULL, size INTEGER NOT NULL, status TEXT NOT NULL, '
+                     'pages_done INTEGER NOT NULL DEFAULT 0, pages_total INTEGER, error TEXT, '
+                     'created_at REAL NOT NULL, updated_at REAL NOT NULL)')
+
+    def create(self, user_id, filename, sha, size):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute('INSERT INTO upload_jobs (id, user_id, filename, sha256, size, status, '
+                         'created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (job_id, user_id, filename, sha, size, 'queued', now, now))
+        return job_id
+
+    def update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(f'UPDATE upload_jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with closing(self._connect()) as conn:
+            row = conn.execute(f"SELECT {', '.join(self.FIELDS)} FROM upload_jobs WHERE id = ?",
+                               (job_id,)).fetchone()
+        return dict(zip(self.FIELDS, row)) if row is not None else None
+
+
+def process_upload(job_id, path, filename, sha, settings):
+    """Extract, store and index one uploaded PDF. Runs in an extraction process."""
+    from pdf_index import PdfIndex, extract_pages
+    from pdf_store import PdfStore
+
+    jobs = SQLiteJobs(settings['jobs_path'])
+    store = PdfStore(settings['pdf_folder'])
+    index = PdfIndex(settings['index_path'], settings['pdf_folder'], settings['chunk_words'],
+                     list_files=store.files)
+    reported_at = 0.0
+
+    def progress(done, total):
+        nonlocal reported_at
+        now = time.monotonic()
+        if done == total or now - reported_at >= PROGRESS_INTERVAL:
+            reported_at = now
+            jobs.update(job_id, pages_done=done, pages_total=total)
+
+    try:
+        if not index.has_shard(sha):
+            jobs.update(job_id, status='extracting')
+            index.write_shard(sha, extract_pages(path, progress))
+        jobs.update(job_id, status='indexing')
+        stored = store.add(filename, path, sha=sha)
+        if stored != filename:
+            # Another PDF already has this name
+            jobs.update(job_id, filename=stored)
+        if settings['rag_enabled']:
+            index.refresh()
+    except Exception as e:
+        if os.path.exists(path):
+            os.remove(path)
+        jobs.update(job_id, status='failed', error=str(e))
+        raise
+    jobs.update(job_id, status='done')
+
+
+class DocumentQueue:
+    """Background processing of uploaded PDFs; one per web worker.
+
+    With `processes` > 0 jobs run in a process pool, otherwise in a single
+    thread of the web worker itself.
+    """
+
+    def __init__(self, jobs, settings, processes=2, job_timeout=600, on_done=None):
+        self.jobs = jobs
+        self.settings = settings
+        self.processes = processes
+        self.job_timeout = job_timeout
+        self.on_done = on_done
+        self.executor = None
+        self.lock = threading.Lock()
+        self.pending = 0
+
+    def _executor(self):
+        with self.lock:
+            if self.executor is None:
+                if self.processes > 0:
+                    import multiprocessing
+                    # Fresh interpreters: a forked copy of the worker would inherit its
+                    # sockets, database pool and gevent hub
+                    self.executor = ProcessPoolExecutor(self.processes,
+                                                        mp_context=multiprocessing.get_context('spawn'))
+                else:
+                    self.executor = ThreadPoolExecutor(1, thread_name_prefix='documents')
+            return self.executor
+
+    def submit(self, user_id, filename, path, sha, size):
+        """Record a job for a received upload and queue it; returns the job id"""
+        executor = self._executor()
+        job_id = self.jobs.create(user_id, filename, sha, size)
+        with self.lock:
+            self.pending += 1
+        future = executor.submit(process_upload, job_id, path, filename, sha, self.settings)
+        future.add_done_callback(lambda f: self._finished(job_id, filename, f))
+        return job_id
+
+    def _finished(self, job_id, filename, future):
+        with self.lock:
+            self.pending -= 1
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Processing upload {filename} failed: {str(error)}")
+            try:
+                # The job row is already marked unless the process itself died
+                job = self.jobs.get(job_id)
+                if job is not None and job['status'] != 'failed':
+                    self.jobs.update(job_id, status='failed', error=str(error) or type(error).__name__)
+            except sqlite3.Error as e:
+                logger.error(f"Upload job update failed: {str(e)}")
+            return
+        logger.info(f"Upload {filename} processed")
+        if self.on_done is not None:
+            self.on_done()
+
+    def status(self, job_id):
+        """The job as a dict, or None; a job silent for longer than job_timeout is reported failed"""
+        job = self.jobs.get(job_id)
+        if job is not None and job['status'] not in ('done', 'failed') \
+                and time.time() - job['updated_at'] > self.job_timeout:
+            job['status'] = 'failed'
+            job['error'] = 'Processing stopped without finishing'
+        return job
+
+    def stats(self):
+        with self.lock:
+            return {'processes': self.processes, 'pending': self.pending}
+
+
+def create_document_queue(config, on_done=None):
+    settings = {
+        'jobs_path': config['DOCUMENTS_DB_PATH'],
+        'pdf_folder': config['PDF_FOLDER'],
+        'index_path': config['RAG_INDEX_PATH'],
+        'chunk_words': config['RAG_CHUNK_WORDS'],
+        'rag_enabled': config['RAG_ENABLED'],
+    }
+    return DocumentQueue(SQLiteJobs(config['DOCUMENTS_DB_PATH']), settings,
+                         processes=config['UPLOAD_EXTRACT_PROCESSES'],
+                         job_timeout=config['UPLOAD_JOB_TIMEOUT'], on_done=on_done)
@@ -1,10 +1,54 @@
+import gc
 import multiprocessing
+import os
+import shutil
+import tempfile
 
+wsgi_app = "app:create_app()"
 bind = "0.0.0.0:8000"
-workers = multiprocessing.cpu_count() * 2 + 1
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
 timeout = 600
 keepalive = 5
-worker_class = "sync"
-worker_connections = 1000
+# /chat spends nearly all of its time waiting on Azure OpenAI, so each worker
+# runs cooperative gevent greenlets instead of one request per process.
+# Upstream calls per worker are capped separately by MAX_INFLIGHT_UPSTREAM.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
 accesslog = "-"
-errorlog = "-"
\ No newline at end of file
+errorlog = "-"
+# Per-request debug lines from gunicorn are written synchronously by the worker
+loglevel = os.environ.get("GUNICORN_LOG_LEVEL", "info")
+
+# Prometheus multiprocess mode: each worker writes its samples to files in this
+# directory and /metrics merges them. Stale files from the last run are removed
+# here, before the app (and prometheus_client) is imported.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "egpt-metrics"))
+shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+# Import the app once in the master and fork workers from it, so the code and
+# the read-only PDF catalog/index/keyword matcher are shared copy-on-write.
+# One-time setup (tables, migrations, index build) is `flask bootstrap`, run
+# by startup.sh before gunicorn starts.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+
+if preload_app and worker_class == "gevent":
+    # Workers would patch after the app is imported; patch first so nothing
+    # loaded in the master keeps the blocking socket/ssl/threading objects
+    from gevent import monkey
+    monkey.patch_all()
+
+
+def when_ready(server):
+    if not preload_app:
+        return
+    server.app.wsgi().extensions["services"].preload()
+    # Move everything loaded so far out of the collector's reach, so garbage
+    # collections in the workers don't write to (and un-share) those pages
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges (in-flight counts); its counters stay
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
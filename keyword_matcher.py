@@ -0,0 +1,105 @@
+"""Find every topic from keyword_links.json mentioned anywhere in a query.
+
+Keywords are normalized (lowercased, punctuation dropped, light suffix
+stemming) into token sequences and compiled into a token-level Aho-Corasick
+automaton, so a query is scanned once regardless of how many keywords the
+catalog holds.
+"""
+import json
+import re
+from collections import deque
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def stem(token):
+    if len(token) <= 3 or token.isdigit():
+        return token
+    if len(token) > 5 and token.endswith('ing'):
+        return token[:-3]
+    if len(token) > 5 and token.endswith('er'):
+        return token[:-2]
+    if token.endswith('ies'):
+        return token[:-3] + 'y'
+    if token.endswith('sses'):
+        return token[:-2]
+    if token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def normalize_tokens(text):
+    return [stem(token) for token in TOKEN_RE.findall(text.lower())]
+
+
+class KeywordMatcher:
+    def __init__(self, topics):
+        """topics: [{'topic': str, 'keywords': [str], 'links': [str]}]"""
+        self.topics = topics
+        # Node 0 is the root; each node has goto transitions, a failure link
+        # and the (topic index, pattern length) pairs that end there
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for topic_index, topic in enumerate(topics):
+            for keyword in [topic['topic']] + topic.get('keywords', []):
+                tokens = normalize_tokens(keyword)
+                if tokens:
+                    self._add(tokens, topic_index)
+        self._build_failure_links()
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f)['topics'])
+
+    def _add(self, tokens, topic_index):
+        node = 0
+        for token in tokens:
+            nxt = self.goto[node].get(token)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][token] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = nxt
+        hit = (topic_index, len(tokens))
+        if hit not in self.output[node]:
+            self.output[node].append(hit)
+
+    def _build_failure_links(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and token not in self.goto[state]:
+                    state = self.fail[state]
+                target = self.goto[state].get(token, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child].extend(hit for hit in self.output[self.fail[child]]
+                                          if hit not in self.output[child])
+
+    def match(self, query, limit=5):
+        """Topics mentioned in the query, best first.
+
+        Returns [{'topic', 'links', 'score'}]; topics are ranked by the
+        longest keyword they matched, then by how often, then by position.
+        """
+        found = {}
+        node = 0
+        for position, token in enumerate(normalize_tokens(query)):
+            while node and token not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(token, 0)
+            for topic_index, length in self.output[node]:
+                best, count, first = found.get(topic_index, (0, 0, position))
+                found[topic_index] = (max(best, length), count + 1, min(first, position - length + 1))
+
+        ranked = sorted(found.items(), key=lambda item: (-item[1][0], -item[1][1], item[1][2], item[0]))
+        return [{'topic': self.topics[topic_index]['topic'],
+                 'links': self.topics[topic_index]['links'],
+                 'score': best}
+                for topic_index, (best, count, first) in ranked[:limit]]
@@ -0,0 +1,208 @@
+"""Logging off the request path: JSON lines, request ids, sampling and redaction.
+
+init_app() puts a single BackgroundHandler on the root logger. On the
+calling thread a record is only stamped with the request id and put on a
+bounded queue; a QueueListener thread (a greenlet in gevent workers)
+redacts, formats and writes it to stdout. If the writer falls behind and
+LOG_QUEUE_SIZE records are waiting, new records are dropped and counted
+instead of blocking requests. With LOG_LEVEL=DEBUG only
+LOG_DEBUG_SAMPLE_RATE of the debug records are kept.
+
+Every request gets an id, taken from a well-formed X-Request-ID header or
+generated, which is echoed in the response and added to its log records.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_app_context, request
+
+REQUEST_ID_PATTERN = re.compile(r'[A-Za-z0-9._-]{1,64}')
+REDACTED = '[REDACTED]'
+# key=value / key: value pairs whose value is a secret, and bearer tokens
+SECRET_NAMES = r'password|passwd|pwd|secret(?:_key)?|api[-_]?key|token|authorization|cookie|session'
+SECRET_PATTERNS = [
+    re.compile(rf'(?i)\b({SECRET_NAMES})'
+               r'(\s*[=:]\s*)((?:bearer\s+|basic\s+)?(?:"[^"]*"|\'[^\']*\'|[^\s,;&]+))'),
+    re.compile(r'(?i)\b(bearer)(\s+)([A-Za-z0-9._~+/=-]+)'),
+]
+SECRET_FIELD = re.compile(rf'(?i)({SECRET_NAMES})$')
+# LogRecord attributes; anything else on a record came in through `extra=`
+RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {
+    'message', 'asctime', 'request_id', 'sample_rate'}
+
+
+def redact(text, secrets=()):
+    for secret in secrets:
+        text = text.replace(secret, REDACTED)
+    for pattern in SECRET_PATTERNS:
+        text = pattern.sub(lambda m: f"{m.group(1)}{m.group(2)}{REDACTED}", text)
+    return text
+
+
+class RedactingFilter(logging.Filter):
+    """Blanks secrets in the message, `extra=` fields and traceback of every record
+    the handler writes.
+
+    `secrets` are literal values (API key, secret key) removed wherever they appear.
+    """
+
+    def __init__(self, secrets=()):
+        super().__init__()
+        self.secrets = [secret for secret in secrets if secret and len(secret) >= 8]
+
+    def filter(self, record):
+        record.msg = redact(record.getMessage(), self.secrets)
+        record.args = None
+        for key, value in vars(record).items():
+            if key in RECORD_FIELDS:
+                continue
+            if SECRET_FIELD.match(key):
+                setattr(record, key, REDACTED)
+            elif isinstance(value, str):
+                setattr(record, key, redact(value, self.secrets))
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        if record.exc_text:
+            record.exc_text = redact(record.exc_text, self.secrets)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; `extra=` fields are included as keys"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if getattr(record, 'sample_rate', None):
+            entry['sample_rate'] = record.sample_rate
+        for key, value in vars(record).items():
+            if key not in RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps every INFO and higher record and `rate` of the ones below"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.INFO or self.rate >= 1:
+            return True
+        if random.random() < self.rate:
+            record.sample_rate = self.rate
+            return True
+        return False
+
+
+class _Listener(QueueListener):
+    def enqueue_sentinel(self):
+        # Blocking: the queue may be full when the process stops
+        self.queue.put(self._sentinel)
+
+
+class BackgroundHandler(QueueHandler):
+    """Hands records to a listener thread that runs `handlers`"""
+
+    def __init__(self, handlers, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.handlers = handlers
+        self.maxsize = maxsize
+        self.listener = None
+        self.pid = None
+        self.dropped = 0
+
+    def start(self):
+        # Per process: a forked worker inherits neither the listener thread nor a usable queue
+        self.queue = queue.Queue(self.maxsize)
+        self.listener = _Listener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+        self.pid = os.getpid()
+        self.dropped = 0
+
+    def stop(self):
+        """Write out what is queued; called at exit"""
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+
+    def prepare(self, record):
+        # Formatting is left to the listener; only the request id must be read here
+        record.request_id = g.get('request_id') if has_app_context() else None
+        return record
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'dropped': self.dropped}
+
+
+def configure(config, stream=None):
+    """Route all logging through a BackgroundHandler; returns it"""
+    root = logging.getLogger()
+    for handler in root.handlers:
+        if isinstance(handler, BackgroundHandler):
+            return handler
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if config['LOG_JSON'] else logging.Formatter(config['LOG_FORMAT']))
+    output.addFilter(RedactingFilter([config.get('AZURE_OPENAI_API_KEY'), config.get('SECRET_KEY')]))
+    handler = BackgroundHandler([output], config['LOG_QUEUE_SIZE'])
+    handler.addFilter(SamplingFilter(config['LOG_DEBUG_SAMPLE_RATE']))
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(config['LOG_LEVEL'])
+    handler.start()
+    atexit.register(handler.stop)
+    return handler
+
+
+def stats():
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, BackgroundHandler):
+            return handler.stats()
+    return None
+
+
+def init_app(app):
+    """Background logging for the process, and a request id for every request"""
+    configure(app.config)
+
+    @app.before_request
+    def assign_request_id():
+        supplied = request.headers.get('X-Request-ID', '')
+        g.request_id = supplied if REQUEST_ID_PATTERN.fullmatch(supplied) else uuid.uuid4().hex
+
+    @app.after_request
+    def add_request_id(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
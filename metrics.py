@@ -0,0 +1,139 @@
+"""Prometheus metrics and per-request stage timings.
+
+Stages timed with `stage()` feed the egpt_stage_duration_seconds histogram
+and the request's Server-Timing header. Under gunicorn every worker writes
+its samples to PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py) and
+/metrics merges the files of all workers, live and dead; without that
+variable the metrics are per process.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+from sqlalchemy import event
+
+# 0.5 ms to 2 minutes: in-memory lookups at the bottom, completions at the top
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10, 30, 60, 120)
+
+REQUEST_SECONDS = Histogram('egpt_request_duration_seconds', 'HTTP request latency, streamed body included',
+                            ['endpoint', 'method'], buckets=LATENCY_BUCKETS)
+REQUESTS = Counter('egpt_requests_total', 'HTTP requests by status', ['endpoint', 'method', 'status'])
+REQUESTS_IN_FLIGHT = Gauge('egpt_requests_in_flight', 'HTTP requests being handled',
+                           multiprocess_mode='livesum')
+STAGE_SECONDS = Histogram('egpt_stage_duration_seconds', 'Time spent in each stage of a chat request',
+                          ['stage'], buckets=LATENCY_BUCKETS)
+DB_SECONDS = Histogram('egpt_db_query_duration_seconds', 'Database statement latency',
+                       ['operation'], buckets=LATENCY_BUCKETS)
+UPSTREAM_RESPONSES = Counter('egpt_upstream_responses_total',
+                             'Azure OpenAI calls by final HTTP status (or busy/circuit_open/error)', ['status'])
+UPSTREAM_TOKENS = Counter('egpt_upstream_tokens_total', 'Tokens reported in completion usage', ['kind'])
+COMPLETION_FLIGHTS = Counter('egpt_completion_flights_total',
+                             'Uncached completions by who produced them: leader called upstream, '
+                             'local/remote waited on an identical call in this/another worker', ['role'])
+SIMILAR_LOOKUPS = Counter('egpt_similar_query_lookups_total',
+                          'Near-duplicate lookups after an exact cache miss (hit, miss, or stale when '
+                          'the matched answer had left the cache)', ['result'])
+CONTEXT_TOKENS = Histogram('egpt_context_tokens', 'Conversation summary and turns put into a prompt, in tokens',
+                           buckets=(0, 100, 250, 500, 750, 1000, 1500, 2000, 3000, 4000, 8000))
+ADMISSION_DECISIONS = Counter('egpt_admission_decisions_total',
+                              'Chat queries admitted or turned away (rate_limited, queue_full, '
+                              'user_queue_full, queue_timeout)', ['result'])
+ADMISSION_QUEUED = Gauge('egpt_admission_queued', 'Chat queries waiting for a place in their worker',
+                         multiprocess_mode='livesum')
+UPSTREAM_IN_FLIGHT = Gauge('egpt_upstream_in_flight', 'Azure OpenAI calls holding an upstream slot',
+                           multiprocess_mode='livesum')
+
+
+def _add_timing(name, seconds):
+    if has_app_context():
+        timings = g.setdefault('server_timing', {})
+        timings[name] = timings.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    """Time a block as one stage of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(name).observe(elapsed)
+        _add_timing(name, elapsed)
+
+
+def record_usage(usage):
+    """Count the tokens of a completion's `usage` object"""
+    if not usage:
+        return
+    for kind in ('prompt_tokens', 'completion_tokens'):
+        if usage.get(kind):
+            UPSTREAM_TOKENS.labels(kind[:-len('_tokens')]).inc(usage[kind])
+
+
+def server_timing_header(timings, total):
+    entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(entries)
+
+
+def instrument_engine(engine):
+    """Time every statement; the sum per request shows up as the `db` timing"""
+
+    # The start goes on the statement's execution context, which is dropped with it, so a
+    # statement that fails (no after_cursor_execute) leaves nothing behind on the connection.
+    # The few internal statements run without a context are not timed.
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, '_query_start', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        DB_SECONDS.labels(statement.lstrip().split(None, 1)[0].upper()).observe(elapsed)
+        _add_timing('db', elapsed)
+
+
+def init_app(app):
+    """Request latency, status and in-flight tracking, plus the Server-Timing header"""
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def add_server_timing(response):
+        g.response_status = response.status_code
+        # Streamed bodies only report the stages finished before the first byte
+        response.headers['Server-Timing'] = server_timing_header(
+            g.get('server_timing', {}), time.perf_counter() - g.request_started)
+        return response
+
+    @app.teardown_request
+    def finish_request(exc):
+        started = g.pop('request_started', None)
+        if started is None:
+            return
+        REQUESTS_IN_FLIGHT.dec()
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_SECONDS.labels(endpoint, request.method).observe(time.perf_counter() - started)
+        REQUESTS.labels(endpoint, request.method, str(g.get('response_status', 500))).inc()
+
+
+def render():
+    """(body, content type) for /metrics"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,28 @@
+"""add chats (user_id, timestamp, id) index for history pagination
+
+Revision ID: 3f2a9c1d7b10
+Revises: 
+Create Date: 2026-10-17 12:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # create_all in initialize_database may already have built it on new databases
+    with op.batch_alter_table('chats', schema=None) as batch_op:
+        batch_op.create_index('ix_chats_user_id_timestamp', ['user_id', 'timestamp', 'id'],
+                              unique=False, if_not_exists=True)
+
+
+def downgrade():
+    with op.batch_alter_table('chats', schema=None) as batch_op:
+        batch_op.drop_index('ix_chats_user_id_timestamp', if_exists=True)
@@ -0,0 +1,78 @@
+"""add the full-text search index over chat history
+
+Revision ID: 5d7e1b9c4a26
+Revises: 8c41d2e6a9f3
+Create Date: 2026-10-17 18:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7e1b9c4a26'
+down_revision = '8c41d2e6a9f3'
+branch_labels = None
+depends_on = None
+
+# Existing rows are indexed by `flask backfill-chat-search`, not here, so the
+# upgrade stays quick on a large table
+SQLITE_UPGRADE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS chats_fts USING fts5(
+        user_id, query, response,
+        content='chats', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER IF NOT EXISTS chats_fts_insert AFTER INSERT ON chats BEGIN
+        INSERT INTO chats_fts(rowid, user_id, query, response)
+        VALUES (new.id, new.user_id, new.query, new.response);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chats_fts_delete AFTER DELETE ON chats BEGIN
+        INSERT INTO chats_fts(chats_fts, rowid, user_id, query, response)
+        VALUES ('delete', old.id, old.user_id, old.query, old.response);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS chats_fts_update AFTER UPDATE OF user_id, query, response ON chats BEGIN
+        INSERT INTO chats_fts(chats_fts, rowid, user_id, query, response)
+        VALUES ('delete', old.id, old.user_id, old.query, old.response);
+        INSERT INTO chats_fts(rowid, user_id, query, response)
+        VALUES (new.id, new.user_id, new.query, new.response);
+    END""",
+]
+
+POSTGRES_UPGRADE = [
+    """CREATE OR REPLACE FUNCTION chats_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.query, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.response, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER chats_search_vector_update BEFORE INSERT OR UPDATE OF query, response ON chats
+        FOR EACH ROW EXECUTE FUNCTION chats_search_vector_update()""",
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_UPGRADE:
+            op.execute(statement)
+    elif dialect == 'postgresql':
+        op.add_column('chats', sa.Column('search_vector', postgresql.TSVECTOR(), nullable=True))
+        op.create_index('ix_chats_search_vector', 'chats', ['search_vector'], postgresql_using='gin')
+        for statement in POSTGRES_UPGRADE:
+            op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for trigger in ('chats_fts_insert', 'chats_fts_delete', 'chats_fts_update'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS chats_fts")
+    elif dialect == 'postgresql':
+        op.execute("DROP TRIGGER IF EXISTS chats_search_vector_update ON chats")
+        op.execute("DROP FUNCTION IF EXISTS chats_search_vector_update()")
+        op.drop_index('ix_chats_search_vector', table_name='chats')
+        op.drop_column('chats', 'search_vector')
@@ -0,0 +1,35 @@
+"""add chat_summaries for the rolling conversation summary
+
+Revision ID: 8c41d2e6a9f3
+Revises: 3f2a9c1d7b10
+Create Date: 2026-10-17 15:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41d2e6a9f3'
+down_revision = '3f2a9c1d7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # create_all in initialize_database may already have built it on new databases
+    op.create_table(
+        'chat_summaries',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('summary', sa.Text(), nullable=False),
+        sa.Column('last_chat_id', sa.Integer(), nullable=False),
+        sa.Column('tokens', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('user_id'),
+        if_not_exists=True
+    )
+
+
+def downgrade():
+    op.drop_table('chat_summaries', if_exists=True)
@@ -0,0 +1,30 @@
+"""store every chats.timestamp in the format SQLAlchemy binds
+
+Revision ID: a4c8e2f61b37
+Revises: 5d7e1b9c4a26
+Create Date: 2026-10-18 10:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c8e2f61b37'
+down_revision = '5d7e1b9c4a26'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Rows saved with the old CURRENT_TIMESTAMP default read 'YYYY-MM-DD HH:MM:SS'; SQLite
+    # compares them as text, so against a bound '... HH:MM:SS.000000' the history cursor
+    # and the context window cut between rows of the same second. The FTS and tsvector
+    # triggers do not watch this column.
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("UPDATE chats SET timestamp = timestamp || '.000000' WHERE length(timestamp) = 19")
+
+
+def downgrade():
+    # Both formats read back as the same datetime
+    pass
@@ -0,0 +1,127 @@
+import difflib
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset(
+    'a an and about are as at be by can do does explain for from how i in is it me of on or '
+    'pdf show tell that the this to vs what which with'.split()
+)
+
+
+def title_tokens(text):
+    """Lowercased words without stopwords, with a plural 's' stripped"""
+    tokens = []
+    for word in WORD_RE.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def token_similarity(a, b):
+    if a == b:
+        return 1.0
+    if abs(len(a) - len(b)) > max(len(a), len(b)) // 2:
+        return 0.0
+    return difflib.SequenceMatcher(None, a, b).ratio()
+
+
+class PdfCatalog:
+    """In-memory list of the PDFs in a folder with fuzzy title matching.
+
+    The names (from the folder, or from `list_names` such as a PdfStore) are
+    re-read only when the folder mtime changes, and that mtime is checked at
+    most once every `check_interval` seconds, so lookups do not touch the
+    disk. User input is never joined into a filesystem path.
+    """
+
+    def __init__(self, folder, check_interval=5.0, threshold=0.6, fuzzy_cutoff=0.8, list_names=None):
+        self.folder = folder
+        self.list_names = list_names or self._list_folder
+        self.check_interval = check_interval
+        self.threshold = threshold
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.entries = []
+        self.folder_mtime = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def _list_folder(self):
+        return [name for name in os.listdir(self.folder)
+                if name.lower().endswith('.pdf') and not name.startswith('.')]
+
+    def refresh(self, force=False):
+        """Re-list the folder if it changed since the last listing"""
+        now = time.monotonic()
+        if not force and now - self.checked_at < self.check_interval:
+            return
+        self.checked_at = now
+        try:
+            mtime = os.stat(self.folder).st_mtime
+        except OSError:
+            mtime = None
+        if not force and mtime == self.folder_mtime:
+            return
+
+        entries = []
+        if mtime is not None:
+            for name in sorted(self.list_names()):
+                tokens = title_tokens(name[:-4])
+                entries.append({
+                    'filename': name,
+                    'normalized': ' '.join(tokens),
+                    'compact': ''.join(tokens),
+                    'tokens': tokens,
+                })
+        with self.lock:
+            self.entries = entries
+            self.folder_mtime = mtime
+        logger.info(f"PDF catalog loaded {len(entries)} files from {self.folder}")
+
+    def _score(self, entry, query_tokens, query_compact, candidates):
+        if not entry['tokens']:
+            return 0.0
+        if entry['normalized'] == ' '.join(query_tokens) or entry['compact'] == query_compact:
+            return 1.0
+
+        def coverage(tokens, against):
+            total = 0.0
+            for token in tokens:
+                best = max((token_similarity(token, other) for other in against), default=0.0)
+                if best >= self.fuzzy_cutoff:
+                    total += best
+            return total / len(tokens)
+
+        title_coverage = coverage(entry['tokens'], candidates)
+        if not title_coverage:
+            return 0.0
+        query_coverage = coverage(query_tokens, entry['tokens'])
+        return 0.7 * title_coverage + 0.3 * query_coverage
+
+    def match(self, query, limit=5):
+        """Ranked [{'filename', 'score'}] of PDFs whose title matches the query"""
+        self.refresh()
+        query_tokens = title_tokens(query)
+        if not query_tokens:
+            return []
+        query_compact = ''.join(query_tokens)
+        # Joined neighbours let "node mcu" match "NodeMCU"
+        candidates = query_tokens + [a + b for a, b in zip(query_tokens, query_tokens[1:])]
+
+        with self.lock:
+            entries = self.entries
+        scored = []
+        for entry in entries:
+            score = self._score(entry, query_tokens, query_compact, candidates)
+            if score >= self.threshold:
+                scored.append({'filename': entry['filename'], 'score': round(score, 3)})
+        scored.sort(key=lambda item: (-item['score'], item['filename']))
+        return scored[:limit]
@@ -0,0 +1,292 @@
+"""Persistent BM25 index over the text of the PDFs in PDF_FOLDER.
+
+Layout of the index directory:
+
+    manifest.json          per-file mtime/size/sha256 and the live generation
+    shards/<sha256>.json   extracted chunks of one PDF, reused across restarts
+    gen-<n>/               compiled index, memory-mapped by every worker
+        vocab.json         term -> [postings offset, document frequency]
+        postings_doc.npy   chunk ids, grouped by term
+        postings_tf.npy    term frequency for each posting
+        doc_len.npy        token count per chunk
+        text_offsets.npy   byte offsets of each chunk in texts.bin
+        texts.bin          UTF-8 chunk text
+        sources.json       [file name, page] per chunk
+
+Only PDFs whose mtime/size changed are re-hashed, and only content that has
+never been seen before is re-parsed, so a restart costs a few stat calls.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset(
+    'a an and are as at be by for from has have how in is it its of on or that the this to was '
+    'were what when where which who why will with you your'.split()
+)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_pages(path, progress=None):
+    """Text of each page of a PDF; progress(pages_done, pages_total) is called as it goes"""
+    import PyPDF2
+
+    reader = PyPDF2.PdfReader(path)
+    total = len(reader.pages)
+    pages = []
+    for page in reader.pages:
+        pages.append(page.extract_text() or '')
+        if progress is not None:
+            progress(len(pages), total)
+    return pages
+
+
+def chunk_pages(pages, chunk_words=200, overlap=40):
+    """Split page text into overlapping windows of roughly chunk_words words"""
+    chunks = []
+    step = max(chunk_words - overlap, 1)
+    for page_number, text in enumerate(pages, start=1):
+        words = text.split()
+        for start in range(0, len(words), step):
+            window = words[start:start + chunk_words]
+            if window:
+                chunks.append({'page': page_number, 'text': ' '.join(window)})
+            if start + chunk_words >= len(words):
+                break
+    return chunks
+
+
+def _write_json(path, data):
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+class PdfIndex:
+    def __init__(self, index_dir, pdf_folder, chunk_words=200, overlap=40, list_files=None):
+        self.index_dir = index_dir
+        self.pdf_folder = pdf_folder
+        self.list_files = list_files or self._list_folder
+        self.chunk_words = chunk_words
+        self.overlap = overlap
+        self.shard_dir = os.path.join(index_dir, 'shards')
+        self.manifest_path = os.path.join(index_dir, 'manifest.json')
+        self.generation = None
+        self.lock = threading.Lock()
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'generation': 0, 'files': {}}
+
+    def _list_folder(self):
+        if not os.path.isdir(self.pdf_folder):
+            return []
+        return [(name, os.path.join(self.pdf_folder, name)) for name in sorted(os.listdir(self.pdf_folder))
+                if name.lower().endswith('.pdf') and os.path.isfile(os.path.join(self.pdf_folder, name))]
+
+    def refresh(self):
+        """Bring the on-disk index in line with PDF_FOLDER and load it.
+
+        Serialized across worker processes with an flock on the index
+        directory; returns True if the index had to be recompiled.
+        """
+        os.makedirs(self.shard_dir, exist_ok=True)
+        with open(os.path.join(self.index_dir, '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                changed = self._refresh_locked()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self.load()
+        return changed
+
+    def has_shard(self, sha):
+        return os.path.exists(os.path.join(self.shard_dir, f"{sha}.json"))
+
+    def write_shard(self, sha, pages):
+        """Store the chunks of a PDF's page texts; the next refresh() indexes them without re-parsing"""
+        os.makedirs(self.shard_dir, exist_ok=True)
+        _write_json(os.path.join(self.shard_dir, f"{sha}.json"),
+                    {'chunks': chunk_pages(pages, self.chunk_words, self.overlap)})
+
+    def _refresh_locked(self):
+        manifest = self._read_manifest()
+        old_files = manifest['files']
+        files = {}
+        for name, path in self.list_files():
+            st = os.stat(path)
+            previous = old_files.get(name)
+            if previous and previous['mtime'] == st.st_mtime and previous['size'] == st.st_size:
+                files[name] = previous
+                continue
+            sha = file_sha256(path)
+            if not self.has_shard(sha):
+                logger.info(f"Extracting text from {name}")
+                try:
+                    pages = extract_pages(path)
+                except Exception as e:
+                    logger.error(f"Failed to extract text from {name}: {str(e)}")
+                    pages = []
+                self.write_shard(sha, pages)
+            files[name] = {'mtime': st.st_mtime, 'size': st.st_size, 'sha256': sha}
+
+        generation_dir = os.path.join(self.index_dir, f"gen-{manifest['generation']}")
+        if files == old_files and os.path.isdir(generation_dir):
+            return False
+
+        generation = manifest['generation'] + 1
+        self._compile(files, os.path.join(self.index_dir, f"gen-{generation}"))
+        _write_json(self.manifest_path, {'generation': generation, 'files': files})
+        self._remove_stale(files, generation)
+        logger.info(f"PDF index generation {generation} built from {len(files)} files")
+        return True
+
+    def _compile(self, files, target):
+        # Identical PDFs (same sha256) are indexed once under their first name
+        names_by_sha = defaultdict(list)
+        for name, info in files.items():
+            names_by_sha[info['sha256']].append(name)
+
+        postings = defaultdict(list)
+        doc_len, texts, sources = [], [], []
+        for sha, names in sorted(names_by_sha.items(), key=lambda item: item[1][0]):
+            with open(os.path.join(self.shard_dir, f"{sha}.json"), encoding='utf-8') as f:
+                chunks = json.load(f)['chunks']
+            for chunk in chunks:
+                doc_id = len(doc_len)
+                tokens = tokenize(chunk['text'])
+                for term, tf in Counter(tokens).items():
+                    postings[term].append((doc_id, tf))
+                doc_len.append(len(tokens))
+                texts.append(chunk['text'].encode('utf-8'))
+                sources.append([names[0], chunk['page']])
+
+        vocab, docs, tfs = {}, [], []
+        for term in sorted(postings):
+            vocab[term] = [len(docs), len(postings[term])]
+            for doc_id, tf in postings[term]:
+                docs.append(doc_id)
+                tfs.append(tf)
+        offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        np.cumsum([len(t) for t in texts], out=offsets[1:])
+
+        tmp = f"{target}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        np.save(os.path.join(tmp, 'postings_doc.npy'), np.asarray(docs, dtype=np.int32))
+        np.save(os.path.join(tmp, 'postings_tf.npy'), np.asarray(tfs, dtype=np.float32))
+        np.save(os.path.join(tmp, 'doc_len.npy'), np.asarray(doc_len, dtype=np.float32))
+        np.save(os.path.join(tmp, 'text_offsets.npy'), offsets)
+        with open(os.path.join(tmp, 'texts.bin'), 'wb') as f:
+            f.write(b''.join(texts))
+        _write_json(os.path.join(tmp, 'vocab.json'), vocab)
+        _write_json(os.path.join(tmp, 'sources.json'), sources)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(tmp, target)
+
+    def _remove_stale(self, files, generation):
+        live_shards = {f"{info['sha256']}.json" for info in files.values()}
+        for name in os.listdir(self.shard_dir):
+            if name not in live_shards:
+                os.remove(os.path.join(self.shard_dir, name))
+        for name in os.listdir(self.index_dir):
+            if name.startswith('gen-') and name != f"gen-{generation}":
+                shutil.rmtree(os.path.join(self.index_dir, name), ignore_errors=True)
+
+    def load(self):
+        """Memory-map the live generation if it changed since the last load"""
+        generation = self._read_manifest()['generation']
+        if generation == self.generation:
+            return
+        directory = os.path.join(self.index_dir, f"gen-{generation}")
+        if not os.path.isdir(directory):
+            return
+        with open(os.path.join(directory, 'vocab.json'), encoding='utf-8') as f:
+            vocab = json.load(f)
+        with open(os.path.join(directory, 'sources.json'), encoding='utf-8') as f:
+            sources = json.load(f)
+        postings_doc = np.load(os.path.join(directory, 'postings_doc.npy'), mmap_mode='r')
+        postings_tf = np.load(os.path.join(directory, 'postings_tf.npy'), mmap_mode='r')
+        doc_len = np.load(os.path.join(directory, 'doc_len.npy'))
+        text_offsets = np.load(os.path.join(directory, 'text_offsets.npy'), mmap_mode='r')
+        texts = np.memmap(os.path.join(directory, 'texts.bin'), dtype=np.uint8, mode='r') \
+            if text_offsets[-1] else np.zeros(0, dtype=np.uint8)
+        with self.lock:
+            self.vocab, self.sources = vocab, sources
+            self.postings_doc, self.postings_tf = postings_doc, postings_tf
+            self.doc_len, self.text_offsets, self.texts = doc_len, text_offsets, texts
+            self.avg_len = float(doc_len.mean()) if len(doc_len) else 0.0
+            self.generation = generation
+
+    def search(self, query, k=3):
+        """Top-k chunks for a query as dicts with file, page, text and score"""
+        if self.generation is None:
+            return []
+        with self.lock:
+            vocab, postings_doc, postings_tf = self.vocab, self.postings_doc, self.postings_tf
+            doc_len, avg_len = self.doc_len, self.avg_len
+            sources, text_offsets, texts = self.sources, self.text_offsets, self.texts
+        n_docs = len(doc_len)
+        if not n_docs:
+            return []
+
+        scores = np.zeros(n_docs, dtype=np.float32)
+        matched = False
+        for term in set(tokenize(query)):
+            entry = vocab.get(term)
+            if entry is None:
+                continue
+            offset, df = entry
+            docs = postings_doc[offset:offset + df]
+            tf = postings_tf[offset:offset + df]
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[docs] / avg_len)
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+            matched = True
+        if not matched:
+            return []
+
+        k = min(k, n_docs)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for doc_id in top:
+            if scores[doc_id] <= 0:
+                break
+            start, end = int(text_offsets[doc_id]), int(text_offsets[doc_id + 1])
+            results.append({
+                'file': sources[doc_id][0],
+                'page': sources[doc_id][1],
+                'text': bytes(texts[start:end]).decode('utf-8'),
+                'score': float(scores[doc_id]),
+            })
+        return results
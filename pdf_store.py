@@ -0,0 +1,167 @@
+"""Content-addressed storage for the PDFs in PDF_FOLDER.
+
+Each distinct PDF is kept once as ``.blobs/<sha256>.pdf`` and every file name
+users see is an alias recorded in ``.aliases.json``. PDFs copied straight into
+the folder keep working as loose files until ``flask dedupe-pdfs`` folds them
+into the store.
+"""
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+logger = logging.getLogger(__name__)
+
+BLOB_DIR = '.blobs'
+ALIASES_FILE = '.aliases.json'
+ALIASES_LOCK = '.aliases.lock'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PdfStore:
+    def __init__(self, folder):
+        self.folder = folder
+        self.blob_dir = os.path.join(folder, BLOB_DIR)
+        self.aliases_path = os.path.join(folder, ALIASES_FILE)
+        self._aliases = {}
+        self._aliases_mtime = None
+        # (mtime, size) -> sha256 for loose files, so they are hashed once
+        self._loose_hashes = {}
+        self.lock = threading.Lock()
+
+    def blob_path(self, sha):
+        return os.path.join(self.blob_dir, f"{sha}.pdf")
+
+    def aliases(self):
+        """Alias name -> sha256, re-read only when the aliases file changes"""
+        try:
+            mtime = os.stat(self.aliases_path).st_mtime
+        except OSError:
+            return {}
+        with self.lock:
+            if mtime != self._aliases_mtime:
+                with open(self.aliases_path, encoding='utf-8') as f:
+                    self._aliases = json.load(f)
+                self._aliases_mtime = mtime
+            return self._aliases
+
+    def _write_aliases(self, aliases):
+        tmp = f"{self.aliases_path}.tmp.{os.getpid()}"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(aliases, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.aliases_path)
+
+    def _loose_names(self):
+        if not os.path.isdir(self.folder):
+            return []
+        return [name for name in os.listdir(self.folder)
+                if name.lower().endswith('.pdf') and not name.startswith('.')
+                and os.path.isfile(os.path.join(self.folder, name))]
+
+    def files(self):
+        """(name, path) for every servable PDF; aliases win over loose files"""
+        aliases = self.aliases()
+        entries = {name: self.blob_path(sha) for name, sha in aliases.items()}
+        for name in self._loose_names():
+            entries.setdefault(name, os.path.join(self.folder, name))
+        return sorted(entries.items())
+
+    def names(self):
+        return [name for name, _ in self.files()]
+
+    def resolve(self, name):
+        """(path, sha256) for a PDF name, or None if there is no such PDF"""
+        sha = self.aliases().get(name)
+        if sha is not None:
+            path = self.blob_path(sha)
+            return (path, sha) if os.path.isfile(path) else None
+        if os.path.basename(name) != name or name.startswith('.') or not name.lower().endswith('.pdf'):
+            return None
+        path = os.path.join(self.folder, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        key = (name, st.st_mtime, st.st_size)
+        sha = self._loose_hashes.get(key)
+        if sha is None:
+            sha = file_sha256(path)
+            self._loose_hashes[key] = sha
+        return path, sha
+
+    def add(self, name, source_path, move=True, sha=None):
+        """Store source_path under `name`; identical content is kept only once.
+
+        A name that already belongs to a different PDF is never reassigned:
+        the file is stored as `<stem>-<sha prefix>.pdf` instead. Returns the
+        name it was stored under.
+        """
+        sha = sha or file_sha256(source_path)
+        os.makedirs(self.blob_dir, exist_ok=True)
+        blob = self.blob_path(sha)
+        if os.path.exists(blob):
+            if move:
+                os.remove(source_path)
+        elif move:
+            os.replace(source_path, blob)
+        else:
+            shutil.copyfile(source_path, blob)
+        # Uploads are stored from several processes; don't lose each other's aliases
+        with open(os.path.join(self.folder, ALIASES_LOCK), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                aliases = dict(self.aliases())
+                if self._taken(name, sha, aliases, source_path):
+                    stem, ext = os.path.splitext(name)
+                    name = f"{stem}-{sha[:12]}{ext}"
+                if aliases.get(name) != sha:
+                    aliases[name] = sha
+                    self._write_aliases(aliases)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return name
+
+    def _taken(self, name, sha, aliases, source_path):
+        """Whether `name` already serves a PDF other than `sha`"""
+        if name in aliases:
+            return aliases[name] != sha
+        loose = os.path.join(self.folder, name)
+        if os.path.abspath(loose) == os.path.abspath(source_path) or not os.path.isfile(loose):
+            return False
+        return file_sha256(loose) != sha
+
+    def dedupe(self):
+        """Fold every loose PDF into the blob store; returns a summary"""
+        loose = [name for name in self._loose_names() if name not in self.aliases()]
+        saved = 0
+        for name in loose:
+            path = os.path.join(self.folder, name)
+            size = os.path.getsize(path)
+            sha = file_sha256(path)
+            existed = os.path.exists(self.blob_path(sha))
+            self.add(name, path, sha=sha)
+            if existed:
+                saved += size
+            logger.info(f"Stored {name} by content hash")
+        self.collect_garbage()
+        blobs = os.listdir(self.blob_dir) if os.path.isdir(self.blob_dir) else []
+        return {'files': len(loose), 'aliases': len(self.aliases()), 'blobs': len(blobs), 'bytes_saved': saved}
+
+    def collect_garbage(self):
+        """Delete blobs no alias points at"""
+        live = {f"{sha}.pdf" for sha in self.aliases().values()}
+        if not os.path.isdir(self.blob_dir):
+            return
+        for name in os.listdir(self.blob_dir):
+            if name not in live:
+                os.remove(os.path.join(self.blob_dir, name))
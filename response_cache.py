@@ -0,0 +1,187 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    return re.sub(r'\s+', ' ', query).strip().lower()
+
+
+def cache_key(query, deployment, temperature, max_tokens, context=None):
+    """Stable key for a completion: normalized query plus the model parameters and,
+    for a follow-up question, the fingerprint of the conversation before it"""
+    fields = [normalize_query(query), deployment, temperature, max_tokens]
+    if context:
+        fields.append(context)
+    payload = json.dumps(fields)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryCache:
+    """In-process LRU cache with a TTL; hits are only shared within one worker"""
+
+    backend = 'memory'
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {'backend': self.backend, 'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self.entries)}
+
+
+class SQLiteCache:
+    """Cache in a SQLite file so every gunicorn worker shares the same hits.
+
+    Each operation opens its own short-lived connection, which keeps the
+    class safe under both threads and gevent greenlets. A lookup only reads:
+    expired rows are pruned by set(), hits and misses are counted per worker,
+    and an entry's last_used (for LRU eviction) is only rewritten once it is
+    LAST_USED_RESOLUTION of the TTL old, so reads rarely wait for the write lock.
+    """
+
+    backend = 'sqlite'
+
+    LAST_USED_RESOLUTION = 0.05
+
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS response_cache ('
+                         'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                         'created_at REAL NOT NULL, last_used REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_response_cache_last_used '
+                         'ON response_cache (last_used)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_response_cache_created_at '
+                         'ON response_cache (created_at)')
+            # Shared hit and miss counters of earlier versions, written on every lookup
+            conn.execute('DROP TABLE IF EXISTS response_cache_stats')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def get(self, key):
+        try:
+            return self._get(key)
+        except sqlite3.Error as e:
+            logger.error(f"Response cache read failed: {str(e)}")
+            return None
+
+    def set(self, key, value):
+        try:
+            self._set(key, value)
+        except sqlite3.Error as e:
+            logger.error(f"Response cache write failed: {str(e)}")
+
+    def _get(self, key):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT value, created_at, last_used FROM response_cache WHERE key = ?',
+                               (key,)).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            self._count(hit=False)
+            return None
+        self._count(hit=True)
+        if now - row[2] > self.ttl * self.LAST_USED_RESOLUTION:
+            self._touch(key, now)
+        return json.loads(row[0])
+
+    def _count(self, hit):
+        with self.lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _touch(self, key, now):
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.execute('UPDATE response_cache SET last_used = ? WHERE key = ?', (now, key))
+        except sqlite3.Error as e:
+            # Only eviction order is affected; the hit still counts
+            logger.warning(f"Response cache last_used update failed: {str(e)}")
+
+    def _set(self, key, value):
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            conn.execute('INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?)',
+                         (key, json.dumps(value), now, now))
+            conn.execute('DELETE FROM response_cache WHERE created_at < ?', (now - self.ttl,))
+            # Least recently used rows beyond max_entries
+            conn.execute('DELETE FROM response_cache WHERE key IN ('
+                         'SELECT key FROM response_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                         (self.max_entries,))
+
+    def stats(self):
+        """Entries shared by all workers; hits and misses of this worker"""
+        with closing(self._connect()) as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM response_cache').fetchone()[0]
+        with self.lock:
+            return {'backend': self.backend, 'hits': self.hits, 'misses': self.misses, 'entries': entries}
+
+
+class NullCache:
+    backend = 'none'
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def stats(self):
+        return {'backend': self.backend, 'hits': 0, 'misses': 0, 'entries': 0}
+
+
+def create_cache(config):
+    """Build the response cache selected by RESPONSE_CACHE_BACKEND"""
+    backend = config['RESPONSE_CACHE_BACKEND']
+    if backend == 'memory':
+        return MemoryCache(config['RESPONSE_CACHE_TTL'], config['RESPONSE_CACHE_MAX_ENTRIES'])
+    if backend == 'sqlite':
+        return SQLiteCache(config['RESPONSE_CACHE_PATH'], config['RESPONSE_CACHE_TTL'],
+                           config['RESPONSE_CACHE_MAX_ENTRIES'])
+    if backend == 'none':
+        return NullCache()
+    raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {backend}")
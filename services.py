@@ -0,0 +1,166 @@
+"""Clients and indexes shared by the request handlers, built on first use.
+
+create_app() keeps one Services per app in app.extensions['services'].
+Nothing here touches the disk or the network until a request needs it, so
+importing and creating the app stays cheap. Under gunicorn preload_app the
+master can call preload() to build the read-only parts once and share them
+with every worker copy-on-write; per-process parts (the HTTP connection
+pool, the upstream slots) are dropped after fork and rebuilt in the worker.
+"""
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Safe to build before fork: plain data, mmaps and files, no sockets or threads
+SHARED = ('keyword_matcher', 'pdf_store', 'pdf_catalog', 'pdf_index', 'assets')
+
+
+class Services:
+    def __init__(self, config, history_flush=None):
+        self.config = config
+        self.history_flush = history_flush
+        self.objects = {}
+        # Re-entrant: building the catalog needs the store
+        self.lock = threading.RLock()
+        os.register_at_fork(after_in_child=self.after_fork)
+
+    def _get(self, name, build):
+        obj = self.objects.get(name)
+        if obj is None:
+            with self.lock:
+                obj = self.objects.get(name)
+                if obj is None:
+                    obj = self.objects[name] = build()
+        return obj
+
+    def after_fork(self):
+        self.lock = threading.RLock()
+        self.objects = {name: obj for name, obj in self.objects.items() if name in SHARED}
+
+    def preload(self):
+        """Build the fork-safe objects now (in the gunicorn master)"""
+        for name in SHARED:
+            getattr(self, name)
+
+    @property
+    def azure_client(self):
+        def build():
+            from azure_client import AzureOpenAIClient
+            # One pooled keep-alive client per worker process
+            return AzureOpenAIClient.from_config(self.config)
+        return self._get('azure_client', build)
+
+    @property
+    def response_cache(self):
+        def build():
+            from response_cache import create_cache
+            return create_cache(self.config)
+        return self._get('response_cache', build)
+
+    @property
+    def user_cache(self):
+        def build():
+            from response_cache import MemoryCache
+            # Logged-in user ids that still exist, so a request does not hit the users table
+            return MemoryCache(self.config['USER_CACHE_TTL'], 10000)
+        return self._get('user_cache', build)
+
+    @property
+    def similar_queries(self):
+        def build():
+            from similar_queries import create_similar_queries
+            return create_similar_queries(self.config, self.response_cache)
+        return self._get('similar_queries', build)
+
+    @property
+    def single_flight(self):
+        def build():
+            from single_flight import create_single_flight
+            return create_single_flight(self.config)
+        return self._get('single_flight', build)
+
+    @property
+    def admission(self):
+        def build():
+            from admission import create_admission
+            # Per worker: the wait queue and its places belong to this process
+            return create_admission(self.config)
+        return self._get('admission', build)
+
+    @property
+    def keyword_matcher(self):
+        def build():
+            from keyword_matcher import KeywordMatcher
+            return KeywordMatcher.from_file(self.config['KEYWORD_LINKS_FILE'])
+        return self._get('keyword_matcher', build)
+
+    @property
+    def pdf_store(self):
+        def build():
+            from pdf_store import PdfStore
+            return PdfStore(self.config['PDF_FOLDER'])
+        return self._get('pdf_store', build)
+
+    @property
+    def pdf_catalog(self):
+        def build():
+            from pdf_catalog import PdfCatalog
+            catalog = PdfCatalog(self.config['PDF_FOLDER'], self.config['PDF_CATALOG_CHECK_INTERVAL'],
+                                 self.config['PDF_MATCH_THRESHOLD'], list_names=self.pdf_store.names)
+            catalog.refresh(force=True)
+            return catalog
+        return self._get('pdf_catalog', build)
+
+    @property
+    def pdf_index(self):
+        def build():
+            from pdf_index import PdfIndex
+            index = PdfIndex(self.config['RAG_INDEX_PATH'], self.config['PDF_FOLDER'],
+                             self.config['RAG_CHUNK_WORDS'], list_files=self.pdf_store.files)
+            if self.config['RAG_ENABLED']:
+                index.load()
+                if index.generation is None:
+                    # `flask bootstrap` has not built it yet
+                    try:
+                        index.refresh()
+                    except Exception as e:
+                        logger.error(f"PDF index refresh failed: {str(e)}")
+            return index
+        return self._get('pdf_index', build)
+
+    @property
+    def assets(self):
+        def build():
+            from assets import AssetManifest
+            return AssetManifest(self.config['ASSETS_BUILD_DIR'])
+        return self._get('assets', build)
+
+    @property
+    def documents(self):
+        def build():
+            from documents import create_document_queue
+            return create_document_queue(self.config, on_done=self.documents_changed)
+        return self._get('documents', build)
+
+    def documents_changed(self):
+        """Show a processed upload in this worker's lookups now; other workers
+        notice it on their next catalog check and index load"""
+        self.pdf_catalog.refresh(force=True)
+        if self.config['RAG_ENABLED']:
+            self.pdf_index.load()
+
+    @property
+    def history_writer(self):
+        """HistoryWriter when HISTORY_BUFFERED is on, else None"""
+        if not self.config['HISTORY_BUFFERED']:
+            return None
+
+        def build():
+            from db_engine import HistoryWriter
+            return HistoryWriter(self.history_flush,
+                                 interval=self.config['HISTORY_FLUSH_INTERVAL'],
+                                 batch_size=self.config['HISTORY_BATCH_SIZE'],
+                                 max_pending=self.config['HISTORY_MAX_PENDING'])
+        return self._get('history_writer', build)
@@ -0,0 +1,138 @@
+"""Server-side sessions in a SQLite file shared by every gunicorn worker.
+
+The cookie only carries a random session id signed with SECRET_KEY; the
+session data lives in SESSION_DB_PATH, so any worker can read a session
+another worker wrote. Sessions expire PERMANENT_SESSION_LIFETIME seconds
+after their last refresh. An unchanged session is only rewritten once half
+of that has passed, so most requests cost one primary-key read. Expired
+rows are swept every SESSION_SWEEP_INTERVAL seconds.
+"""
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+
+logger = logging.getLogger(__name__)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.new = expires_at is None
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Move the data to a new session id, e.g. on login, so an id known before
+        authentication is worthless afterwards"""
+        if not self.new:
+            self.replaced_sid = self.sid
+        self.sid = new_sid()
+        self.new = True
+        self.modified = True
+
+
+def new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class SQLiteSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, path, sweep_interval=300):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self.swept_at = time.time()
+        self.ready = False
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=5)
+        if not self.ready:
+            # First use in this process; create_app() does no disk work
+            with self.lock:
+                if not self.ready:
+                    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                    with conn:
+                        conn.execute('PRAGMA journal_mode=WAL')
+                        conn.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                                     'sid TEXT PRIMARY KEY, data TEXT NOT NULL, expires_at REAL NOT NULL)')
+                        conn.execute('CREATE INDEX IF NOT EXISTS ix_sessions_expires_at ON sessions (expires_at)')
+                    self.ready = True
+        return conn
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='session-id')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                try:
+                    with closing(self._connect()) as conn:
+                        row = conn.execute('SELECT data, expires_at FROM sessions WHERE sid = ? AND expires_at > ?',
+                                           (sid, time.time())).fetchone()
+                except sqlite3.Error as e:
+                    logger.error(f"Session read failed: {str(e)}")
+                    row = None
+                if row is not None:
+                    return ServerSession(self.serializer.loads(row[0]), sid, row[1])
+        return ServerSession(sid=new_sid())
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        # Sliding expiry; an unchanged session is refreshed once half its lifetime has passed
+        refresh = session.expires_at is not None and session.expires_at - now < lifetime / 2
+        # An emptied session is deleted; one that never got stored has no row to delete
+        emptied = session.sid if not session and not session.new else None
+        stale_sids = [sid for sid in (session.replaced_sid, emptied) if sid]
+        if not (stale_sids or (session and (session.modified or refresh))):
+            return
+        try:
+            with closing(self._connect()) as conn, conn:
+                conn.executemany('DELETE FROM sessions WHERE sid = ?', [(sid,) for sid in stale_sids])
+                if session:
+                    conn.execute('INSERT OR REPLACE INTO sessions (sid, data, expires_at) VALUES (?, ?, ?)',
+                                 (session.sid, self.serializer.dumps(dict(session)), now + lifetime))
+                if now - self.swept_at > self.sweep_interval:
+                    self.swept_at = now
+                    swept = conn.execute('DELETE FROM sessions WHERE expires_at < ?', (now,)).rowcount
+                    if swept:
+                        logger.info(f"Swept {swept} expired sessions")
+        except sqlite3.Error as e:
+            logger.error(f"Session write failed: {str(e)}")
+            return
+
+        if not session:
+            if not session.new:
+                response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+        response.set_cookie(name, self._signer(app).sign(session.sid).decode(),
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
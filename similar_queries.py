@@ -0,0 +1,300 @@
+"""Near-duplicate lookup in front of the response cache.
+
+"what is a ceramic capacitor" and "ceramic capacitors explained" ask the
+same thing but get different exact cache keys. Every cached standalone
+question gets a 64-bit SimHash of its content words and their character
+trigrams; a new question reuses the cached answer of the closest one when
+at least `threshold` of the bits agree. No embedding service is involved.
+A few bits do not tell "esp8266 wifi" from "esp8266 wifi setup", or
+"gpio 2" from "gpio 4", so every entry also has an exact tag of its set
+of content words, and only entries with the same tag can match. What
+still varies between matching questions is phrasing: stop words, plurals,
+word order and repetition.
+
+Fingerprints live in NumPy arrays (8 bytes of hash, 32 bytes of cache key
+and a timestamp per entry), so a lookup over a few hundred thousand entries
+is one vectorized XOR and popcount. With the SQLite response cache the
+fingerprints are also appended to a table in the same file, and each worker
+pulls the rows it has not seen yet, so a question answered in one worker is
+found by the others.
+"""
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import numpy as np
+
+from metrics import SIMILAR_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+BITS = 64
+
+# Question phrasing that does not change what is being asked
+STOP_WORDS = frozenset("""
+    a about an and are be between can could define definition describe did difference do does
+    explain explained explanation for give how i in is it its me meaning my of on or our please
+    show tell that the this to versus vs was we were what whats when where which who why with you
+    work works
+""".split())
+
+WORD = re.compile(r'\w+')
+
+if hasattr(np, 'bitwise_count'):
+    popcount = np.bitwise_count
+else:  # NumPy < 2.0
+    _BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(values):
+        return _BYTE_POPCOUNT[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def content_words(query):
+    """The words of a query that are not stop words, plural s stripped"""
+    words = []
+    for word in WORD.findall(query.lower()):
+        if word in STOP_WORDS:
+            continue
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def features(query):
+    """Weighted features: content words and their character trigrams"""
+    weights = {}
+    for word in content_words(query):
+        weights['w:' + word] = weights.get('w:' + word, 0) + 3
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            gram = 'g:' + padded[i:i + 3]
+            weights[gram] = weights.get(gram, 0) + 1
+    return weights
+
+
+def tag(query):
+    """64-bit hash of the set of content words in a query, 0 when there are none"""
+    words = sorted(set(content_words(query)))
+    if not words:
+        return 0
+    return int.from_bytes(hashlib.blake2b(' '.join(words).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def simhash(query):
+    """64-bit SimHash of a query, or None when it has no content words"""
+    weights = features(query)
+    if not weights:
+        return None
+    hashes = np.array([int.from_bytes(hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest(), 'little')
+                       for name in weights], dtype=np.uint64)
+    bits = (hashes[:, None] >> np.arange(BITS, dtype=np.uint64)) & np.uint64(1)
+    w = np.fromiter(weights.values(), dtype=np.float64, count=len(weights))
+    votes = (np.where(bits.astype(bool), w[:, None], -w[:, None])).sum(axis=0)
+    return int(np.dot((votes > 0).astype(np.uint64), np.uint64(1) << np.arange(BITS, dtype=np.uint64)))
+
+
+def to_signed(value):
+    """uint64 SimHash as the signed 64-bit integer SQLite stores"""
+    return value - (1 << BITS) if value >= 1 << (BITS - 1) else value
+
+
+class SimilarityIndex:
+    """Growable arrays of (simhash, tag, cache key, added_at); not thread-safe on its own"""
+
+    def __init__(self, max_entries, capacity=1024):
+        self.max_entries = max_entries
+        self.hashes = np.zeros(capacity, dtype=np.uint64)
+        self.tags = np.zeros(capacity, dtype=np.uint64)
+        self.keys = np.zeros(capacity, dtype='S32')
+        self.added = np.zeros(capacity, dtype=np.float64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, key, value, tag_value, added_at):
+        if self.size == len(self.hashes):
+            self._make_room()
+        self.hashes[self.size] = value
+        self.tags[self.size] = tag_value
+        self.keys[self.size] = bytes.fromhex(key)
+        self.added[self.size] = added_at
+        self.size += 1
+
+    def _make_room(self):
+        """Drop discarded entries, then grow the arrays or evict the oldest half"""
+        live = self.added[:self.size] > 0
+        if self.size >= self.max_entries:
+            # Keep the newest max_entries // 2 so eviction is amortized
+            order = np.argsort(self.added[:self.size])
+            live[order[:self.size - self.max_entries // 2]] = False
+        keep = np.flatnonzero(live)
+        capacity = len(self.hashes)
+        if len(keep) > capacity // 2:
+            capacity = min(capacity * 2, max(self.max_entries, 1024))
+        for name in ('hashes', 'tags', 'keys', 'added'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(keep)] = old[keep]
+            setattr(self, name, new)
+        self.size = len(keep)
+
+    def nearest(self, value, tag_value, not_before):
+        """(cache key, similarity) of the closest live entry with the same tag added after not_before"""
+        if not self.size:
+            return None
+        distances = popcount(self.hashes[:self.size] ^ np.uint64(value))
+        distances[(self.added[:self.size] < not_before) | (self.tags[:self.size] != np.uint64(tag_value))] = BITS + 1
+        best = int(np.argmin(distances))
+        if distances[best] > BITS:
+            return None
+        return self.keys[best].hex(), 1 - int(distances[best]) / BITS
+
+    def discard(self, key):
+        """Mark entries for key dead; their slots are reclaimed on the next _make_room()"""
+        self.added[:self.size][self.keys[:self.size] == bytes.fromhex(key)] = 0
+
+
+class SQLiteSimilarityLog:
+    """Fingerprints appended to a table next to the SQLite response cache"""
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        with closing(self._connect()) as conn, conn:
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(similar_queries)')]
+            if columns and 'words_tag' not in columns:
+                # Fingerprints with no tag, or one of numbers only, could match questions
+                # about other things; they are only a lookup aid
+                conn.execute('DROP TABLE similar_queries')
+            conn.execute('CREATE TABLE IF NOT EXISTS similar_queries ('
+                         'id INTEGER PRIMARY KEY, key TEXT NOT NULL, simhash INTEGER NOT NULL, '
+                         'words_tag INTEGER NOT NULL, created_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_similar_queries_created_at '
+                         'ON similar_queries (created_at)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def append(self, key, value, tag_value, created_at):
+        with closing(self._connect()) as conn, conn:
+            conn.execute('INSERT INTO similar_queries (key, simhash, words_tag, created_at) VALUES (?, ?, ?, ?)',
+                         (key, to_signed(value), to_signed(tag_value), created_at))
+            conn.execute('DELETE FROM similar_queries WHERE created_at < ?', (created_at - self.ttl,))
+
+    def since(self, last_id, not_before):
+        """Rows after last_id that have not expired, oldest first"""
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT id, key, simhash, words_tag, created_at FROM similar_queries '
+                                'WHERE id > ? AND created_at >= ? ORDER BY id',
+                                (last_id, not_before)).fetchall()
+
+
+class SimilarQueries:
+    """Serve a cached answer for a near-duplicate of a question answered before"""
+
+    def __init__(self, cache, threshold, ttl, max_entries, log=None, sync_interval=1.0):
+        self.cache = cache
+        self.threshold = threshold
+        self.ttl = ttl
+        self.log = log
+        self.sync_interval = sync_interval
+        self.index = SimilarityIndex(max_entries)
+        self.lock = threading.Lock()
+        self.last_id = 0
+        self.synced_at = 0.0
+        self.hits = 0
+        self.misses = 0
+
+    def _sync(self, now):
+        """Pull fingerprints other workers appended since the last sync"""
+        if self.log is None or now - self.synced_at < self.sync_interval:
+            return
+        self.synced_at = now
+        try:
+            rows = self.log.since(self.last_id, now - self.ttl)
+        except sqlite3.Error as e:
+            logger.error(f"Similar query sync failed: {str(e)}")
+            return
+        for row_id, key, value, tag_value, created_at in rows:
+            self.index.add(key, value & ((1 << BITS) - 1), tag_value & ((1 << BITS) - 1), created_at)
+            self.last_id = row_id
+
+    def lookup(self, query):
+        """Cached value of the most similar earlier question, or None"""
+        value = simhash(query)
+        if value is None:
+            return None
+        now = time.time()
+        with self.lock:
+            self._sync(now)
+            match = self.index.nearest(value, tag(query), now - self.ttl)
+        if match is None or match[1] < self.threshold:
+            self._count('miss')
+            return None
+        key, similarity = match
+        cached = self.cache.get(key)
+        if cached is None:
+            # Evicted from the response cache since
+            with self.lock:
+                self.index.discard(key)
+            self._count('stale')
+            return None
+        self._count('hit')
+        return cached
+
+    def add(self, query, key):
+        value = simhash(query)
+        if value is None:
+            return
+        now = time.time()
+        tag_value = tag(query)
+        if self.log is not None:
+            try:
+                # Picked up by every worker, this one included, on its next sync
+                self.log.append(key, value, tag_value, now)
+                return
+            except sqlite3.Error as e:
+                logger.error(f"Similar query write failed: {str(e)}")
+        with self.lock:
+            self.index.add(key, value, tag_value, now)
+
+    def _count(self, result):
+        SIMILAR_LOOKUPS.labels(result).inc()
+        with self.lock:
+            if result == 'hit':
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self.lock:
+            return {'threshold': self.threshold, 'entries': len(self.index), 'hits': self.hits,
+                    'misses': self.misses}
+
+
+class NoSimilarQueries:
+    def lookup(self, query):
+        return None
+
+    def add(self, query, key):
+        pass
+
+    def stats(self):
+        return None
+
+
+def create_similar_queries(config, cache):
+    """Near-duplicate lookup over `cache`, sharing fingerprints the way the cache shares answers"""
+    if config['SIMILAR_QUERY_THRESHOLD'] <= 0 or cache.backend == 'none':
+        return NoSimilarQueries()
+    log = None
+    if cache.backend == 'sqlite':
+        log = SQLiteSimilarityLog(config['RESPONSE_CACHE_PATH'], config['RESPONSE_CACHE_TTL'])
+    return SimilarQueries(cache, config['SIMILAR_QUERY_THRESHOLD'], config['RESPONSE_CACHE_TTL'],
+                          config['RESPONSE_CACHE_MAX_ENTRIES'], log=log)
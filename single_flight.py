@@ -0,0 +1,364 @@
+"""Coalescing of identical completions that are in flight at the same time.
+
+When a class is told to look something up, dozens of students send the same
+query within seconds. Only the first of them (the leader) calls Azure
+OpenAI; the others wait for its answer. Within a worker the waiters share a
+Flight and, when streaming, receive the leader's pieces as they arrive.
+Across gunicorn workers a lease row in a SQLite file marks the key as
+taken, and the leader leaves the answer in that row for the other workers.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+from metrics import COMPLETION_FLIGHTS, stage
+
+logger = logging.getLogger(__name__)
+
+
+class FlightTimeout(Exception):
+    """The leader did not finish within the wait timeout"""
+
+
+class FlightAbandoned(Exception):
+    """The leader stopped before finishing and nobody was following it"""
+
+
+class Flight:
+    """One in-progress completion; followers read its pieces as the leader publishes them"""
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pieces = []
+        self.done = False
+        self.result = None
+        self.error = None
+        # Waiters reading this flight; changed under SingleFlight.lock
+        self.followers = 0
+
+    def publish(self, piece):
+        with self.cond:
+            self.pieces.append(piece)
+            self.cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        with self.cond:
+            self.result = result
+            self.error = error
+            self.done = True
+            self.cond.notify_all()
+
+    def follow(self, timeout):
+        """Yield the pieces as they arrive; the generator returns the leader's result.
+
+        A leader that did not stream (or answered from another worker)
+        publishes no pieces, so its whole result is yielded as one piece.
+        """
+        deadline = time.monotonic() + timeout
+        seen = 0
+        while True:
+            with self.cond:
+                while seen == len(self.pieces) and not self.done:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise FlightTimeout()
+                    self.cond.wait(remaining)
+                pieces = self.pieces[seen:]
+                done = self.done
+            seen += len(pieces)
+            yield from pieces
+            if done:
+                if self.error is not None:
+                    raise self.error
+                if seen == 0 and self.result:
+                    yield self.result
+                return self.result
+
+
+class SQLiteLease:
+    """Cross-worker claim on a key, with the leader's answer left behind for the waiters.
+
+    A claim expires after `ttl` seconds so a worker that died mid-call does
+    not block the key. Answers are kept for RESULT_GRACE seconds, long
+    enough for every polling waiter to pick them up.
+    """
+
+    RESULT_GRACE = 5
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS single_flight ('
+                         'key TEXT PRIMARY KEY, owner TEXT NOT NULL, '
+                         'expires_at REAL NOT NULL, result TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_single_flight_expires_at '
+                         'ON single_flight (expires_at)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=5)
+
+    def claim(self, key):
+        """(owner, None) if the caller now holds the key, (None, result) if another
+        worker already answered, (None, None) while another worker is still on it"""
+        now = time.time()
+        owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM single_flight WHERE expires_at < ?', (now,))
+            inserted = conn.execute('INSERT OR IGNORE INTO single_flight (key, owner, expires_at) '
+                                    'VALUES (?, ?, ?)', (key, owner, now + self.ttl)).rowcount
+            if inserted:
+                return owner, None
+            row = conn.execute('SELECT result FROM single_flight WHERE key = ?', (key,)).fetchone()
+        if row is None or row[0] is None:
+            return None, None
+        return None, json.loads(row[0])
+
+    def finish(self, key, owner, result):
+        with closing(self._connect()) as conn, conn:
+            conn.execute('UPDATE single_flight SET result = ?, expires_at = ? WHERE key = ? AND owner = ?',
+                         (json.dumps(result), time.time() + self.RESULT_GRACE, key, owner))
+
+    def release(self, key, owner):
+        """Drop a claim without an answer so the next waiter can take over"""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM single_flight WHERE key = ? AND owner = ?', (key, owner))
+
+
+class SingleFlight:
+    """Run one completion per key at a time; identical concurrent callers share it.
+
+    Waiters in the same worker share the leader's result, errors included.
+    Waiters in other workers only share a successful answer: when the
+    leader fails, the next waiter claims the key and calls upstream itself.
+    Anyone waiting longer than `timeout` seconds stops waiting and calls
+    upstream on their own (a streaming waiter that already received pieces
+    gets FlightTimeout instead).
+    """
+
+    def __init__(self, lease=None, timeout=150, poll_interval=0.1):
+        self.lease = lease
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.counts = {'leader': 0, 'local': 0, 'remote': 0}
+
+    @property
+    def backend(self):
+        return 'sqlite' if self.lease is not None else 'memory'
+
+    def _count(self, role):
+        COMPLETION_FLIGHTS.labels(role).inc()
+        with self.lock:
+            self.counts[role] += 1
+
+    def _join(self, key):
+        """(flight, True) for the leader of key, (flight, False) for a waiter"""
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+            flight = self.flights[key] = Flight()
+            return flight, True
+
+    def _abandon(self, key, flight):
+        """Drop the flight of a leader that stops early, unless waiters are reading it"""
+        with self.lock:
+            if flight.followers:
+                return False
+            self.flights.pop(key, None)
+            return True
+
+    def _land(self, key, flight, result=None, error=None):
+        with self.lock:
+            self.flights.pop(key, None)
+        flight.finish(result, error)
+
+    def _claim(self, key):
+        """(owner, result) from the cross-worker lease: owner is set when this worker
+        should call upstream, result when another worker answered. Both are None
+        without a lease, when it fails, or when waiting for the other worker timed out."""
+        if self.lease is None:
+            return None, None
+        try:
+            owner, result = self.lease.claim(key)
+            if owner is None and result is None:
+                with stage('coalesced'):
+                    deadline = time.monotonic() + self.timeout
+                    while owner is None and result is None and time.monotonic() < deadline:
+                        time.sleep(self.poll_interval)
+                        owner, result = self.lease.claim(key)
+                if owner is None and result is None:
+                    logger.warning("Timed out waiting for another worker's completion, calling upstream")
+        except sqlite3.Error as e:
+            logger.error(f"Single-flight lease failed: {str(e)}")
+            return None, None
+        return owner, result
+
+    def _settle(self, key, owner, result=None):
+        """Publish the answer to the other workers, or give up the claim"""
+        if owner is None:
+            return
+        try:
+            if result is None:
+                self.lease.release(key, owner)
+            else:
+                self.lease.finish(key, owner, result)
+        except sqlite3.Error as e:
+            logger.error(f"Single-flight lease failed: {str(e)}")
+
+    def _follow(self, flight):
+        """Generator over a local leader's pieces, timed as the `coalesced` stage"""
+        try:
+            with stage('coalesced'):
+                result = yield from flight.follow(self.timeout)
+        finally:
+            with self.lock:
+                flight.followers -= 1
+        self._count('local')
+        return result
+
+    def do(self, key, fn):
+        """fn() for the first caller of key; concurrent callers get the same result"""
+        flight, leader = self._join(key)
+        if not leader:
+            follower = self._follow(flight)
+            try:
+                while True:
+                    next(follower)
+            except StopIteration as stop:
+                return stop.value
+            except FlightTimeout:
+                logger.warning("Timed out waiting for an identical completion, calling upstream")
+                return fn()
+
+        owner, result = self._claim(key)
+        if result is not None:
+            self._count('remote')
+            self._land(key, flight, result)
+            return result
+        self._count('leader')
+        try:
+            result = fn()
+        except BaseException as e:
+            self._settle(key, owner)
+            self._land(key, flight, error=e)
+            raise
+        self._settle(key, owner, result)
+        self._land(key, flight, result)
+        return result
+
+    def stream(self, key, produce):
+        """Like do() for a generator of text pieces whose joined text is the result.
+
+        Waiters in this worker receive the pieces as they are produced;
+        waiters in other workers get the joined text once the leader is done.
+        If the leader is closed early (its client went away) while waiters in
+        this worker are reading, it still produces the whole answer for them;
+        otherwise it gives up the lease, so a waiter in another worker calls
+        upstream itself. Nobody ever gets a truncated answer as a result.
+        """
+        flight, leader = self._join(key)
+        if not leader:
+            received = False
+            follower = self._follow(flight)
+            try:
+                while True:
+                    yield next(follower)
+                    received = True
+            except StopIteration as stop:
+                return stop.value
+            except FlightTimeout:
+                if received:
+                    raise
+                logger.warning("Timed out waiting for an identical completion, calling upstream")
+                return (yield from produce())
+
+        owner, result = self._claim(key)
+        if result is not None:
+            self._count('remote')
+            self._land(key, flight, result)
+            yield result
+            return result
+        self._count('leader')
+        answer = produce()
+        pieces = []
+        try:
+            for piece in answer:
+                pieces.append(piece)
+                flight.publish(piece)
+                yield piece
+        except GeneratorExit:
+            if self._abandon(key, flight):
+                answer.close()
+                self._settle(key, owner)
+                flight.finish(error=FlightAbandoned())
+                raise
+            self._finish_abandoned(key, flight, owner, answer, pieces)
+            return None
+        except BaseException as e:
+            self._settle(key, owner)
+            self._land(key, flight, error=e)
+            raise
+        result = ''.join(pieces)
+        self._settle(key, owner, result)
+        self._land(key, flight, result)
+        return result
+
+    def _finish_abandoned(self, key, flight, owner, answer, pieces):
+        """Produce the rest of a closed leader's answer for the waiters reading it"""
+        try:
+            for piece in answer:
+                pieces.append(piece)
+                flight.publish(piece)
+        except Exception as e:
+            # Not raised: the leader is being closed and its caller has nobody to tell
+            logger.error(f"Finishing a coalesced completion failed: {str(e)}")
+            self._settle(key, owner)
+            self._land(key, flight, error=e)
+            return
+        result = ''.join(pieces)
+        self._settle(key, owner, result)
+        self._land(key, flight, result)
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, backend=self.backend, in_flight=len(self.flights))
+
+
+class NoFlight:
+    """Coalescing disabled: every caller runs its own completion"""
+
+    backend = 'none'
+
+    def do(self, key, fn):
+        return fn()
+
+    def stream(self, key, produce):
+        return (yield from produce())
+
+    def stats(self):
+        return {'backend': self.backend, 'leader': 0, 'local': 0, 'remote': 0, 'in_flight': 0}
+
+
+def create_single_flight(config):
+    """Build the coalescer selected by SINGLE_FLIGHT_BACKEND"""
+    backend = config['SINGLE_FLIGHT_BACKEND']
+    timeout = config['SINGLE_FLIGHT_TIMEOUT']
+    if backend == 'sqlite':
+        return SingleFlight(SQLiteLease(config['SINGLE_FLIGHT_PATH'], ttl=timeout), timeout,
+                            config['SINGLE_FLIGHT_POLL_INTERVAL'])
+    if backend == 'memory':
+        return SingleFlight(None, timeout, config['SINGLE_FLIGHT_POLL_INTERVAL'])
+    if backend == 'none':
+        return NoFlight()
+    raise ValueError(f"Unknown SINGLE_FLIGHT_BACKEND: {backend}")
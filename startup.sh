@@ -18,45 +18,29 @@ fi
 echo "Activating virtual environment"
 source /home/antenv/bin/activate
 
-# Upgrade pip and install dependencies
-echo "Upgrading pip"
-pip install --upgrade pip
-
-if [ -f "/home/site/wwwroot/requirements.txt" ]; then
-    echo "Installing dependencies"
-    pip install -r /home/site/wwwroot/requirements.txt || { echo "Dependency installation failed"; exit 1; }
+# Install dependencies only when requirements.txt changed since the last boot
+REQUIREMENTS=/home/site/wwwroot/requirements.txt
+STAMP=/home/antenv/.requirements.sha256
+if [ -f "$REQUIREMENTS" ]; then
+    if ! sha256sum --check --status "$STAMP" 2>/dev/null; then
+        echo "Installing dependencies"
+        pip install -r "$REQUIREMENTS" || { echo "Dependency installation failed"; exit 1; }
+        sha256sum "$REQUIREMENTS" > "$STAMP"
+    else
+        echo "Dependencies up to date"
+    fi
 else
     echo "requirements.txt not found!"
     exit 1
 fi
 
-# Initialize database
-echo "Initializing database..."
-python << EOF
-import os
-import sys
-sys.path.append('/home/site/wwwroot')
-from app import initialize_database
-if not initialize_database():
-    print("Database initialization failed")
-    sys.exit(1)
-EOF
-
-# Apply migrations if they exist
-if [ -d "/home/site/wwwroot/migrations" ]; then
-    echo "Applying database migrations"
-    cd /home/site/wwwroot
-    export FLASK_APP=app.py
-    flask db upgrade || { echo "Migration failed"; exit 1; }
-fi
-
-# Verify database permissions
-if [ -f "/home/data/instance/site.db" ]; then
-    echo "Setting database file permissions..."
-    chmod 666 /home/data/instance/site.db
-fi
+# One-time setup for this deploy: folders, tables, migrations, PDF index.
+# Workers only import the app, so they start without repeating any of it.
+echo "Bootstrapping..."
+cd /home/site/wwwroot
+export FLASK_APP=app.py
+flask bootstrap || { echo "Bootstrap failed"; exit 1; }
 
-# Start Gunicorn with proper path
+# Start Gunicorn; the app factory is set in gunicorn.conf.py
 echo "Starting Gunicorn..."
-cd /home/site/wwwroot
-gunicorn --bind=0.0.0.0 --timeout 600 --workers=4 app:app --log-level debug
+gunicorn --config gunicorn.conf.py
@@ -20,6 +20,51 @@ document.addEventListener("DOMContentLoaded", function () {
         chatBox.scrollTop = chatBox.scrollHeight; // Auto-scroll to the bottom
     }
 
+    // POST the query to /chat and dispatch each Server-Sent Event to its handler
+    function streamChat(query, handlers) {
+        return fetch("/chat", {
+            method: "POST",
+            headers: { "Accept": "text/event-stream" },
+            body: new URLSearchParams({ query: query })
+        }).then(response => {
+            // Check if the response is OK
+            if (!response.ok || !response.body) {
+                console.error("Server returned an error:", response.status);
+                throw new Error("Server returned an error.");
+            }
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = "";
+
+            function dispatch(raw) {
+                let event = "message";
+                let data = "";
+                raw.split("\n").forEach(line => {
+                    if (line.startsWith("event:")) event = line.slice(6).trim();
+                    else if (line.startsWith("data:")) data += line.slice(5).trim();
+                });
+                if (handlers[event] && data) handlers[event](JSON.parse(data));
+            }
+
+            function pump() {
+                return reader.read().then(({ done, value }) => {
+                    if (done) {
+                        if (buffer.trim()) dispatch(buffer);
+                        return;
+                    }
+                    buffer += decoder.decode(value, { stream: true });
+                    let boundary;
+                    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+                        dispatch(buffer.slice(0, boundary));
+                        buffer = buffer.slice(boundary + 2);
+                    }
+                    return pump();
+                });
+            }
+            return pump();
+        });
+    }
+
     // Handle form submission
     chatForm.addEventListener("submit", function (event) {
         event.preventDefault();
@@ -37,26 +82,34 @@ document.addEventListener("DOMContentLoaded", function () {
         appendMessage("user", query);
         queryInput.value = "";
 
-        // Send query to the server
-        fetch("/search", {
-            method: "POST",
-            body: new URLSearchParams({ query: query })
-        })
-            .then(response => {
-                // Check if the response is OK
-                if (!response.ok) {
-                    console.error("Server returned an error:", response.status);
-                    throw new Error("Server returned an error.");
-                }
-                return response.json();
-            })
-            .then(data => {
-                console.log("Response data received from server:", data); // Debug message for response data
+        // Bot message that is filled in as tokens stream in
+        const messageElement = document.createElement("div");
+        messageElement.classList.add("chat-message");
+        const botElement = document.createElement("div");
+        botElement.classList.add("bot-response");
+        botElement.innerHTML = "<strong>EGPT:</strong> ";
+        const botText = document.createElement("span");
+        botElement.appendChild(botText);
+        messageElement.appendChild(botElement);
+        chatBox.appendChild(messageElement);
 
-                // Display the AI response
-                if (data.ai_response) {
-                    appendMessage("bot", data.ai_response);
-                }
+        let attachments = {};
+
+        // Send query to the server and read the Server-Sent Events stream
+        streamChat(query, {
+            meta: data => { attachments = data; },
+            delta: data => {
+                botText.textContent += data.text;
+                chatBox.scrollTop = chatBox.scrollHeight;
+            },
+            done: data => {
+                console.log("Response data received from server:", data); // Debug message for response data
+                botText.textContent = data.ai_response || "";
+            },
+            error: data => { botText.textContent = data.ai_response; }
+        })
+            .then(() => {
+                const data = attachments;
 
                 // Display the embedded PDF (if any)
                 if (data.pdf_embed_url) {
@@ -91,7 +144,7 @@ document.addEventListener("DOMContentLoaded", function () {
             })
             .catch(error => {
                 console.error("Error during fetch:", error);
-                appendMessage("bot", "There was an error processing your request. Please try again later.");
+                botText.textContent = "There was an error processing your request. Please try again later.";
             });
     });
 });
@@ -0,0 +1,294 @@
+function toggleSidebar() {
+    const sidebar = document.getElementById('sidebar');
+    document.body.classList.toggle('sidebar-active');
+    sidebar.classList.toggle('active');
+    document.querySelector('.center-content').classList.toggle('full');
+}
+
+function tryAdvanced() {
+    alert('Advanced features coming soon!');
+}
+
+function shareCurrentPage() {
+    if (navigator.share) {
+        navigator.share({
+            title: document.title,
+            url: window.location.href
+        }).then(() => {
+            console.log('Thanks for sharing!');
+        }).catch(console.error);
+    } else {
+        const url = window.location.href;
+        navigator.clipboard.writeText(url).then(() => {
+            alert('URL copied to clipboard!');
+        }).catch(() => {
+            alert('URL: ' + url);
+        });
+    }
+}
+
+// Read the Server-Sent Events stream from POST /chat and dispatch each event
+function streamChat(query, handlers) {
+    const formData = new FormData();
+    formData.append('query', query);
+
+    return fetch('/chat', {
+        method: 'POST',
+        headers: { 'Accept': 'text/event-stream' },
+        body: formData
+    })
+    .then(response => {
+        if (response.status === 429) {
+            // Turned away by rate limiting or a full queue; the body says why
+            return response.json().then(data => handlers.error(data));
+        }
+        if (!response.ok || !response.body) {
+            throw new Error('Server returned an error: ' + response.status);
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        function dispatch(raw) {
+            let event = 'message';
+            let data = '';
+            raw.split('\n').forEach(line => {
+                if (line.startsWith('event:')) event = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (handlers[event] && data) handlers[event](JSON.parse(data));
+        }
+
+        function pump() {
+            return reader.read().then(({ done, value }) => {
+                if (done) {
+                    if (buffer.trim()) dispatch(buffer);
+                    return;
+                }
+                buffer += decoder.decode(value, { stream: true });
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    dispatch(buffer.slice(0, boundary));
+                    buffer = buffer.slice(boundary + 2);
+                }
+                return pump();
+            });
+        }
+        return pump();
+    });
+}
+
+function appendAttachments(botMessage, data) {
+    if (data.pdf_embed_url) {
+        botMessage.insertAdjacentHTML('beforeend', `
+            <div style="margin-top: 10px;">
+                <iframe src="${data.pdf_embed_url}" width="100%" height="300px"></iframe>
+            </div>`);
+    }
+
+    if (data.embedded_website) {
+        botMessage.insertAdjacentHTML('beforeend', `
+            <div style="margin-top: 10px;">
+                <iframe src="${data.embedded_website}" width="100%" height="300px"></iframe>
+            </div>`);
+    }
+}
+
+function submitQuery(event) {
+    event.preventDefault();
+    
+    const queryInput = document.getElementById('query-input');
+    const query = queryInput.value.trim();
+    
+    if (!query) return;
+
+    queryInput.disabled = true;
+    const submitButton = event.target.querySelector('button[type="submit"]');
+    submitButton.disabled = true;
+
+    const chatBox = document.getElementById('chat-box');
+    
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message';
+    
+    const userMessage = document.createElement('div');
+    userMessage.className = 'user-message';
+    userMessage.innerHTML = '<strong>You:</strong> ';
+    userMessage.appendChild(document.createTextNode(query));
+    messageDiv.appendChild(userMessage);
+    
+    const botMessage = document.createElement('div');
+    botMessage.className = 'bot-message';
+    botMessage.innerHTML = '<strong>EGPT:</strong> ';
+    const botText = document.createElement('span');
+    botMessage.appendChild(botText);
+    messageDiv.appendChild(botMessage);
+    chatBox.appendChild(messageDiv);
+
+    let attachments = {};
+
+    streamChat(query, {
+        meta: data => { attachments = data; },
+        delta: data => {
+            botText.textContent += data.text;
+            chatBox.scrollTop = chatBox.scrollHeight;
+        },
+        done: data => { botText.textContent = data.ai_response || ''; },
+        error: data => { botText.textContent = data.ai_response; }
+    })
+    .then(() => {
+        appendAttachments(botMessage, attachments);
+        
+        // Reset form
+        queryInput.value = '';
+        queryInput.disabled = false;
+        submitButton.disabled = false;
+        queryInput.focus();
+        
+        // Scroll to bottom
+        chatBox.scrollTop = chatBox.scrollHeight;
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('An error occurred. Please try again.');
+        queryInput.disabled = false;
+        submitButton.disabled = false;
+    });
+}
+
+// Handle New Chat Button
+document.querySelector('.new-chat-btn').addEventListener('click', function() {
+    // Clear chat history
+    const chatBox = document.getElementById('chat-box');
+    chatBox.innerHTML = '';
+    
+    // Clear input
+    const queryInput = document.getElementById('query-input');
+    queryInput.value = '';
+    queryInput.focus();
+});
+
+// Handle Menu Items
+const historyList = document.getElementById('history-list');
+historyList.addEventListener('click', function(event) {
+    if (event.target.classList.contains('menu-item')) {
+        console.log('Clicked:', event.target.textContent);
+    }
+});
+
+// Load older history pages as the sidebar is scrolled
+let historyLoading = false;
+function loadMoreHistory() {
+    const cursor = historyList.dataset.nextCursor;
+    if (!cursor || historyLoading) return;
+    historyLoading = true;
+
+    fetch('/chat/history?cursor=' + encodeURIComponent(cursor))
+    .then(response => response.json())
+    .then(data => {
+        data.items.forEach(chat => {
+            const item = document.createElement('div');
+            item.className = 'menu-item';
+            item.title = chat.query;
+            item.textContent = chat.query;
+            historyList.appendChild(item);
+        });
+        historyList.dataset.nextCursor = data.next_cursor || '';
+    })
+    .catch(error => console.error('Error loading history:', error))
+    .finally(() => { historyLoading = false; });
+}
+
+document.querySelector('.sidebar-content').addEventListener('scroll', function() {
+    if (this.scrollTop + this.clientHeight >= this.scrollHeight - 200) {
+        loadMoreHistory();
+    }
+});
+
+// Handle Bottom Buttons
+document.querySelectorAll('.sidebar-bottom-buttons button').forEach(button => {
+    button.addEventListener('click', function() {
+        console.log('Clicked:', this.textContent.trim());
+    });
+});
+function submitQuery(event) {
+event.preventDefault();
+
+const queryInput = document.getElementById('query-input');
+const query = queryInput.value.trim();
+const loadingSpinner = document.getElementById('loading-spinner');
+const chatBox = document.getElementById('chat-box');
+
+if (!query) return;
+
+// Disable input and button
+queryInput.disabled = true;
+const submitButton = event.target.querySelector('button[type="submit"]');
+submitButton.disabled = true;
+
+// Show loading spinner until the first token arrives
+loadingSpinner.style.display = 'block';
+
+// Append user message
+const messageDiv = document.createElement('div');
+messageDiv.className = 'message';
+
+const userMessage = document.createElement('div');
+userMessage.className = 'user-message';
+userMessage.innerHTML = '<strong>You:</strong> ';
+userMessage.appendChild(document.createTextNode(query));
+messageDiv.appendChild(userMessage);
+
+// Append bot reply, filled in as tokens arrive
+const botMessage = document.createElement('div');
+botMessage.className = 'bot-message';
+botMessage.innerHTML = '<strong>EGPT:</strong> ';
+const botText = document.createElement('span');
+botMessage.appendChild(botText);
+messageDiv.appendChild(botMessage);
+chatBox.appendChild(messageDiv);
+
+let attachments = {};
+
+streamChat(query, {
+meta: data => { attachments = data; },
+delta: data => {
+    loadingSpinner.style.display = 'none';
+    botText.textContent += data.text;
+    chatBox.scrollTop = chatBox.scrollHeight;
+},
+done: data => { botText.textContent = data.ai_response || ''; },
+error: data => { botText.textContent = data.ai_response; }
+})
+.then(() => {
+// Hide loading spinner
+loadingSpinner.style.display = 'none';
+
+appendAttachments(botMessage, attachments);
+
+// Newest query goes to the top of the Recents list
+const historyItem = document.createElement('div');
+historyItem.className = 'menu-item';
+historyItem.title = query;
+historyItem.textContent = query;
+historyList.prepend(historyItem);
+
+// Reset form
+queryInput.value = '';
+queryInput.disabled = false;
+submitButton.disabled = false;
+queryInput.focus();
+
+// Scroll to bottom
+chatBox.scrollTop = chatBox.scrollHeight;
+})
+.catch(error => {
+console.error('Error:', error);
+alert('An error occurred. Please try again.');
+
+// Hide loading spinner and re-enable input
+loadingSpinner.style.display = 'none';
+queryInput.disabled = false;
+submitButton.disabled = false;
+});
+}
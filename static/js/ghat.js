@@ -0,0 +1,84 @@
+document.addEventListener('DOMContentLoaded', function() {
+    const sidebar = document.getElementById('sidebar');
+    const hamburger = document.querySelector('.hamburger-btn');
+    const body = document.body;
+    const mainContent = document.querySelector('.center-content');
+    const header = document.querySelector('.header');
+
+    // Toggle sidebar visibility and header position
+    function toggleSidebar() {
+        sidebar.classList.toggle('active');
+        body.classList.toggle('sidebar-active');
+        
+        if (window.innerWidth > 768) {
+            if (sidebar.classList.contains('active')) {
+                header.style.left = '300px';
+                header.style.width = 'calc(100% - 300px)';
+                if (mainContent) {
+                    mainContent.style.marginLeft = '300px';
+                    mainContent.style.width = 'calc(100% - 300px)';
+                }
+            } else {
+                header.style.left = '0';
+                header.style.width = '100%';
+                if (mainContent) {
+                    mainContent.style.marginLeft = '0';
+                    mainContent.style.width = '100%';
+                }
+            }
+        }
+    }
+
+    hamburger.addEventListener('click', toggleSidebar);
+
+    // Submit query function
+    window.submitQuery = function(query) {
+        const inputField = document.getElementById("query-input");
+        if (inputField) {
+            inputField.value = query;
+            inputField.form.submit();
+        }
+    }
+
+    // Handle window resize
+    window.addEventListener('resize', function() {
+        if (window.innerWidth <= 768) {
+            header.style.left = '0';
+            header.style.width = '100%';
+            if (mainContent) {
+                mainContent.style.marginLeft = '0';
+                mainContent.style.width = '100%';
+            }
+            // Close sidebar on mobile
+            sidebar.classList.remove('active');
+            body.classList.remove('sidebar-active');
+        } else if (sidebar.classList.contains('active')) {
+            header.style.left = '300px';
+            header.style.width = 'calc(100% - 300px)';
+            if (mainContent) {
+                mainContent.style.marginLeft = '300px';
+                mainContent.style.width = 'calc(100% - 300px)';
+            }
+        }
+    });
+
+    // Try Advanced function
+    window.tryAdvanced = function() {
+        console.log("Try Advanced clicked");
+        // Implement your try advanced functionality here
+    }
+
+    // Share Current Page function
+    window.shareCurrentPage = function() {
+        console.log("Share clicked");
+        // Implement your share functionality here
+    }
+
+    // Assign query buttons functionality
+    const queryButtons = document.querySelectorAll('.prompt-btn');
+    queryButtons.forEach(button => {
+        button.addEventListener('click', function() {
+            submitQuery(this.textContent);
+        });
+    });
+});
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Config reads these when it is imported
+os.environ.setdefault('INSTANCE_PATH', tempfile.mkdtemp(prefix='egpt-tests-'))
+os.environ.setdefault('AZURE_OPENAI_ENDPOINT', 'http://127.0.0.1:9/')
+os.environ.setdefault('AZURE_OPENAI_API_KEY', 'test-key')
+os.environ.setdefault('DEPLOYMENT_NAME', 'test')
+os.environ.setdefault('RAG_ENABLED', 'false')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+
+@pytest.fixture(scope='session')
+def app():
+    """The app on a scratch instance directory, migrated like `flask bootstrap` does"""
+    from flask_migrate import Migrate, upgrade
+
+    import app as app_module
+
+    flask_app = app_module.create_app()
+    flask_app.config['TESTING'] = True
+    assert app_module.initialize_database(flask_app)
+    Migrate(flask_app, app_module.db, directory=os.path.join(ROOT, 'migrations'))
+    with flask_app.app_context():
+        upgrade()
+    return flask_app
+
+
+@pytest.fixture
+def make_user(app):
+    """Creates users with unique names; returns their ids"""
+    import app as app_module
+
+    counter = iter(range(1, 1000000))
+
+    def make(name='user'):
+        with app.app_context():
+            n = next(counter)
+            user = app_module.User(username=f"{name}-{os.urandom(4).hex()}-{n}",
+                                   email=f"{name}-{os.urandom(4).hex()}-{n}@example.com", password='x')
+            app_module.db.session.add(user)
+            app_module.db.session.commit()
+            return user.id
+
+    return make
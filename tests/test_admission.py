@@ -0,0 +1,59 @@
+import os
+
+import pytest
+from werkzeug.test import EnvironBuilder
+
+import app as app_module
+from admission import Admission, FairQueue, MemoryBuckets, Rejected, SQLiteBuckets
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    return MemoryBuckets() if request.param == 'memory' else SQLiteBuckets(os.path.join(tmp_path, 'admission.db'))
+
+
+def one_place(store, burst):
+    """One place, no waiting; `burst` queries per user with next to no refill"""
+    queue = FairQueue(max_active=1, max_waiting=0, max_waiting_per_user=0, timeout=1)
+    return Admission(store, queue, user_rate=0.0001, user_burst=burst, global_rate=0, global_burst=0,
+                     user_tokens_per_hour=0)
+
+
+def test_a_query_the_queue_turns_away_is_not_charged(store):
+    admission = one_place(store, burst=2)
+    ticket = admission.admit(1)
+    with pytest.raises(Rejected) as rejected:
+        admission.admit(1)
+    assert rejected.value.reason == 'queue_full'
+    ticket.release()
+    # The rejected query's token is back, so the second of the burst is still there
+    admission.admit(1).release()
+    with pytest.raises(Rejected) as rejected:
+        admission.admit(1)
+    assert rejected.value.reason == 'rate_limited'
+
+
+def test_a_refund_never_overfills_the_bucket(store):
+    admission = one_place(store, burst=1)
+    admission.refund(1)
+    admission.admit(1).release()
+    with pytest.raises(Rejected):
+        admission.admit(1)
+
+
+def test_a_stream_closed_before_its_body_ran_frees_its_place(app, make_user):
+    user_id = make_user()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    cookie = client.get_cookie(app.config['SESSION_COOKIE_NAME'])
+    environ = EnvironBuilder(path='/chat', method='POST', data={'query': 'what is a resistor'},
+                             headers={'Accept': 'text/event-stream',
+                                      'Cookie': f"{cookie.key}={cookie.value}"}).get_environ()
+    with app.app_context():
+        admission = app_module.services.admission
+    # The server drops the response without reading a single chunk of it
+    body = app.wsgi_app(environ, lambda status, headers, exc_info=None: None)
+    assert admission.stats()['active'] == 1
+    body.close()
+    assert admission.stats()['active'] == 0
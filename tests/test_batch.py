@@ -0,0 +1,55 @@
+import json
+import threading
+
+import app as app_module
+from admission import NoTicket, Rejected
+from app import Chat, db
+
+
+class OnePlace:
+    """Admission with a single place that is never given back within the batch"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.placed = 0
+        self.refunds = 0
+
+    def check(self, user_id, cost=1):
+        pass
+
+    def place(self, user_id):
+        with self.lock:
+            self.placed += 1
+            if self.placed > 1:
+                raise Rejected('queue_full', 7)
+        return NoTicket()
+
+    def refund(self, user_id, cost=1):
+        self.refunds += 1
+
+    def record_usage(self, user_id, usage):
+        pass
+
+
+def test_queries_turned_away_are_marked_busy_and_not_saved(app, make_user, monkeypatch):
+    admission = OnePlace()
+    monkeypatch.setattr(app_module, 'admission', admission)
+    monkeypatch.setattr(app_module, 'answer_text', lambda query: f"answer to {query}")
+    user_id = make_user()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    queries = ['what is a diode', 'what is a resistor', 'what is a diode', 'what is a capacitor']
+    response = client.post('/chat/batch', json={'queries': queries}, headers={'Accept': 'application/x-ndjson'})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(line['index'] for line in lines) == [0, 1, 2, 3]
+
+    answered = [line for line in lines if not line.get('busy')]
+    busy = [line for line in lines if line.get('busy')]
+    assert len({line['query'] for line in answered}) == 1
+    assert len({line['query'] for line in busy}) == 2
+    assert all(line['retry_after'] == 7 for line in busy)
+    assert admission.refunds == 2
+    with app.app_context():
+        saved = [row.query for row in db.session.query(Chat.query).filter(Chat.user_id == user_id)]
+    assert saved == [answered[0]['query']]
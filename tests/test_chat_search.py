@@ -0,0 +1,60 @@
+from flask_migrate import downgrade, upgrade
+
+import chat_search
+from app import Chat, db
+
+
+def logged_in(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    return client
+
+
+def add_chats(app, user_id, chats):
+    with app.app_context():
+        db.session.add_all([Chat(user_id=user_id, query=query, response=response) for query, response in chats])
+        db.session.commit()
+
+
+def test_search_finds_the_users_chats(app, make_user):
+    user_id, other = make_user(), make_user()
+    add_chats(app, user_id, [("what does a thermistor do", "It changes resistance with temperature."),
+                             ("what is a diode", "It lets current through one way.")])
+    add_chats(app, other, [("thermistor wiring", "Use a divider.")])
+    response = logged_in(app, user_id).get('/chat/search?q=thermistor')
+    assert response.status_code == 200
+    items = response.get_json()['items']
+    assert [item['query_html'] for item in items] == ["what does a <mark>thermistor</mark> do"]
+
+
+def test_search_without_the_index_is_a_503(app, make_user):
+    user_id = make_user()
+    add_chats(app, user_id, [("what does a thermistor do", "It changes resistance with temperature.")])
+    with app.app_context():
+        downgrade(revision='8c41d2e6a9f3')
+    try:
+        response = logged_in(app, user_id).get('/chat/search?q=thermistor')
+        assert response.status_code == 503
+        assert response.get_json()['error']
+    finally:
+        with app.app_context():
+            upgrade()
+            chat_search.backfill(db.engine)
+
+
+def test_like_fallback_matches_every_word_newest_first(app, make_user):
+    user_id = make_user()
+    add_chats(app, user_id, [("set up gpio_2 as input", "Call pinMode first."),
+                             ("gpio2 pull up", "Enable the internal pull-up resistor."),
+                             ("pull up resistor value", "Use 10k for gpio2 in most cases."),
+                             ("read gpioa2", "It is an analog pin.")])
+    with app.app_context():
+        rows = chat_search.like_search(db.session, user_id, ['gpio2', 'pull'], 10, 0)
+        assert len(rows) == 2
+        assert [chat_search.markup(row.query_html) for row in rows] == [
+            "<mark>pull</mark> up resistor value", "<mark>gpio2</mark> <mark>pull</mark> up"]
+        assert '<mark>gpio2</mark>' in chat_search.markup(rows[0].snippet_html)
+        # `_` is matched literally, not as a LIKE wildcard
+        assert [row.query_html for row in chat_search.like_search(db.session, user_id, ['gpio_2'], 10, 0)] == [
+            f"set up {chat_search.START}gpio_2{chat_search.STOP} as input"]
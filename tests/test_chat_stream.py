@@ -0,0 +1,55 @@
+import json
+import uuid
+
+import app as app_module
+from app import Chat, db
+
+
+def fake_stream_answer(query, key, conversation=app_module.NO_CONVERSATION):
+    pieces = ['A capacitor ', 'stores charge ', 'between two plates.']
+    yield from pieces
+    app_module.cache_answer(query, key, conversation, ''.join(pieces))
+
+
+def logged_in(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    return client
+
+
+def saved_answers(app, user_id):
+    with app.app_context():
+        return [row.response for row in db.session.query(Chat.response).filter(Chat.user_id == user_id)]
+
+
+def events(body):
+    for block in body.split('\n\n'):
+        if block.startswith('event:'):
+            name, data = block.split('\n', 1)
+            yield name[len('event: '):], json.loads(data[len('data: '):])
+
+
+def test_streamed_answer_is_saved_whole(app, make_user, monkeypatch):
+    monkeypatch.setattr(app_module, 'stream_answer', fake_stream_answer)
+    user_id = make_user()
+    response = logged_in(app, user_id).post('/chat', data={'query': f"capacitor {uuid.uuid4().hex}"},
+                                            headers={'Accept': 'text/event-stream'})
+    done = dict(events(response.get_data(as_text=True)))['done']
+    assert done['ai_response'] == 'A capacitor stores charge between two plates.'
+    assert saved_answers(app, user_id) == [done['ai_response']]
+
+
+def test_disconnected_stream_saves_no_partial_answer(app, make_user, monkeypatch):
+    monkeypatch.setattr(app_module, 'stream_answer', fake_stream_answer)
+    user_id = make_user()
+    response = logged_in(app, user_id).post('/chat', data={'query': f"capacitor {uuid.uuid4().hex}"},
+                                            headers={'Accept': 'text/event-stream'}, buffered=False)
+    body = iter(response.response)
+    received = ''
+    while 'delta' not in received:
+        chunk = next(body)
+        received += chunk.decode() if isinstance(chunk, bytes) else chunk
+    response.close()
+    assert 'A capacitor' in received
+    assert saved_answers(app, user_id) == []
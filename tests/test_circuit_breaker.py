@@ -0,0 +1,52 @@
+import pytest
+
+import azure_client
+from azure_client import CircuitBreaker, CircuitOpen
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(azure_client.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def opened(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=30)
+    for _ in range(3):
+        breaker.before_call()
+        breaker.record(False)
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+    clock[0] += 31
+    return breaker
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = opened(clock)
+    assert breaker.before_call() is True
+    for _ in range(10):
+        with pytest.raises(CircuitOpen):
+            breaker.before_call()
+    breaker.record(True, probe=True)
+    assert breaker.before_call() is False
+
+
+def test_a_failed_probe_opens_the_circuit_again(clock):
+    breaker = opened(clock)
+    assert breaker.before_call()
+    breaker.record(False, probe=True)
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+    clock[0] += 31
+    assert breaker.before_call() is True
+
+
+def test_a_probe_that_never_reports_is_replaced(clock):
+    breaker = opened(clock)
+    assert breaker.before_call()
+    clock[0] += 10
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+    clock[0] += 21
+    assert breaker.before_call() is True
@@ -0,0 +1,90 @@
+from types import SimpleNamespace
+
+import pytest
+
+import app as app_module
+from app import Chat, db
+from conversation import is_follow_up
+
+
+@pytest.mark.parametrize('query', [
+    "what is a ceramic capacitor", "why do capacitors explode", "explain ohms law",
+    "what is more efficient, a buck or a linear regulator", "capacitor",
+])
+def test_standalone_questions(query):
+    assert not is_follow_up(query)
+
+
+@pytest.mark.parametrize('query', [
+    "how does it work?", "Why?", "and for a 9V battery?", "what about LEDs", "is that safe",
+    "tell me more about the second one", "an example?",
+])
+def test_follow_ups(query):
+    assert is_follow_up(query)
+
+
+def test_standalone_question_keeps_the_shared_cache_key(app, make_user):
+    """A recent turn must not take the user's next standalone question out of the
+    response cache and single-flight key everyone else uses"""
+    user_id = make_user()
+    with app.test_request_context():
+        db.session.add(Chat(user_id=user_id, query="what is a resistor", response="It limits current."))
+        db.session.commit()
+        query = "what is a ceramic capacitor"
+        conversation = app_module.conversation_context(user_id, query)
+        assert conversation == app_module.NO_CONVERSATION
+        assert app_module.completion_cache_key(query, conversation) == app_module.completion_cache_key(query)
+
+        follow_up = "and how much current does it let through?"
+        summary, turns = app_module.conversation_context(user_id, follow_up)
+        assert [turn.query for turn in turns] == ["what is a resistor"]
+        assert (app_module.completion_cache_key(follow_up, (summary, turns))
+                != app_module.completion_cache_key(follow_up))
+
+
+class FakeSummaries:
+    """Azure client answering summary calls; fails the calls listed in `failing` (1-based)"""
+
+    def __init__(self, failing=()):
+        self.prompts = []
+        self.failing = failing
+
+    def complete(self, json_body):
+        self.prompts.append(json_body['messages'][-1]['content'])
+        status = 500 if len(self.prompts) in self.failing else 200
+        return SimpleNamespace(status_code=status, json=lambda: {
+            'choices': [{'message': {'content': f"summary {len(self.prompts)}"}}]})
+
+
+def long_turns(count):
+    """Newest-first turns of about 60 tokens each"""
+    return [SimpleNamespace(id=n, query=f"question {n} " + 'word ' * 20, response='answer ' * 30)
+            for n in range(count, 0, -1)]
+
+
+def test_every_turn_reaches_the_summary(app, make_user, monkeypatch):
+    user_id = make_user()
+    fake = FakeSummaries()
+    monkeypatch.setattr(app_module, 'azure_client', fake)
+    monkeypatch.setitem(app.config, 'CONTEXT_TOKEN_BUDGET', 150)
+    with app.test_request_context():
+        assert app_module.refresh_summary(user_id, None, long_turns(7)) == f"summary {len(fake.prompts)}"
+        assert len(fake.prompts) > 1
+        for n in range(1, 8):
+            assert sum(f"question {n} " in prompt for prompt in fake.prompts) == 1
+        # Oldest first: each prompt carries on from the summary before it
+        assert "summary 1" in fake.prompts[1]
+        assert db.session.get(app_module.ChatSummary, user_id).last_chat_id == 7
+
+
+def test_a_failed_summary_call_leaves_the_rest_unsummarized(app, make_user, monkeypatch):
+    user_id = make_user()
+    fake = FakeSummaries(failing=(2,))
+    monkeypatch.setattr(app_module, 'azure_client', fake)
+    monkeypatch.setitem(app.config, 'CONTEXT_TOKEN_BUDGET', 150)
+    with app.test_request_context():
+        assert app_module.refresh_summary(user_id, None, long_turns(7)) == "summary 1"
+        stored = db.session.get(app_module.ChatSummary, user_id)
+        # Only the turns of the first prompt are marked as summarized
+        assert all(f"question {n} " in fake.prompts[0] for n in range(1, stored.last_chat_id + 1))
+        assert f"question {stored.last_chat_id + 1} " not in fake.prompts[0]
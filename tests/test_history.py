@@ -0,0 +1,59 @@
+from flask_migrate import downgrade, upgrade
+from sqlalchemy import text
+
+import app as app_module
+from app import Chat, chat_history_page, db
+
+
+def insert_legacy_rows(user_id, timestamps):
+    """Rows as the CURRENT_TIMESTAMP default stored them: no fractional seconds"""
+    for n, timestamp in enumerate(timestamps):
+        db.session.execute(text(
+            "INSERT INTO chats (user_id, query, response, pdf_preview, timestamp) "
+            "VALUES (:user_id, :query, 'answer', 0, :timestamp)"),
+            {'user_id': user_id, 'query': f"question {n}", 'timestamp': timestamp})
+    db.session.commit()
+
+
+def all_pages(user_id, limit):
+    seen, cursor = [], None
+    for _ in range(100):
+        rows, cursor = chat_history_page(user_id, cursor, limit)
+        seen.extend(row.id for row in rows)
+        if cursor is None:
+            return seen
+    raise AssertionError(f"pagination did not end: {seen}")
+
+
+def test_pages_over_legacy_timestamps_visit_every_row_once(app, make_user):
+    user_id = make_user()
+    # Several rows per second, the case where the cursor used to repeat a page
+    timestamps = [f"2025-03-01 10:00:{second:02d}" for second in (1, 1, 1, 2, 2, 3, 3, 3, 3, 4)]
+    with app.app_context():
+        downgrade(revision='5d7e1b9c4a26')
+        insert_legacy_rows(user_id, timestamps)
+        upgrade()
+    with app.test_request_context():
+        ids = [row.id for row in db.session.query(Chat.id).filter(Chat.user_id == user_id)
+               .order_by(Chat.timestamp.desc(), Chat.id.desc())]
+        for limit in (1, 2, 3, 4):
+            assert all_pages(user_id, limit) == ids
+        stored = db.session.execute(text("SELECT timestamp FROM chats WHERE user_id = :u"), {'u': user_id})
+        assert {len(timestamp) for timestamp, in stored} == {26}
+
+
+def test_rows_saved_without_a_timestamp_page_with_the_rest(app, make_user):
+    user_id = make_user()
+    with app.test_request_context():
+        db.session.add_all([Chat(user_id=user_id, query=f"q{n}", response='a') for n in range(7)])
+        db.session.commit()
+        assert len(set(all_pages(user_id, 2))) == 7
+
+
+def test_malformed_cursor_is_rejected(app):
+    for cursor in ('not base64!', 'Zm9v'):
+        try:
+            app_module.decode_cursor(cursor)
+        except ValueError:
+            continue
+        raise AssertionError(f"{cursor!r} was accepted")
@@ -0,0 +1,39 @@
+from db_engine import HistoryWriter
+
+
+def queued_writer(flush_rows, rows, **options):
+    """A writer with rows queued but no background thread; flush() writes them"""
+    writer = HistoryWriter(flush_rows, interval=0.001, **options)
+    for row in rows:
+        writer.queue.put_nowait(row)
+    return writer
+
+
+def test_a_failed_batch_is_retried():
+    written, failures = [], [RuntimeError('database is locked')] * 2
+
+    def flush_rows(batch):
+        if failures:
+            raise failures.pop()
+        written.extend(batch)
+
+    rows = [{'user_id': 1, 'query': f"q{n}"} for n in range(5)]
+    writer = queued_writer(flush_rows, rows)
+    writer.flush()
+    assert written == rows
+    assert writer.stats() == {'pending': 0, 'written': 5, 'failed': 0}
+
+
+def test_only_the_rows_the_database_rejects_are_lost():
+    written = []
+
+    def flush_rows(batch):
+        if any(row['query'] is None for row in batch):
+            raise ValueError('NOT NULL constraint failed: chats.query')
+        written.extend(batch)
+
+    rows = [{'user_id': 1, 'query': 'a'}, {'user_id': 1, 'query': None}, {'user_id': 2, 'query': 'b'}]
+    writer = queued_writer(flush_rows, rows, retries=1)
+    writer.flush()
+    assert [row['query'] for row in written] == ['a', 'b']
+    assert writer.stats() == {'pending': 0, 'written': 2, 'failed': 1}
@@ -0,0 +1,23 @@
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, exc, text
+
+from metrics import instrument_engine
+
+
+def selects_timed():
+    return REGISTRY.get_sample_value('egpt_db_query_duration_seconds_count', {'operation': 'SELECT'}) or 0
+
+
+def test_failed_statements_leave_no_timer_behind():
+    engine = create_engine('sqlite://')
+    instrument_engine(engine)
+    before = selects_timed()
+    with engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(exc.OperationalError):
+                conn.execute(text('SELECT * FROM missing'))
+        assert conn.execute(text('SELECT 1')).scalar() == 1
+        assert not conn.info.get('query_started')
+    # Only the statement that ran is timed
+    assert selects_timed() == before + 1
@@ -0,0 +1,68 @@
+import os
+
+from pdf_store import PdfStore
+
+
+def write_pdf(path, body):
+    with open(path, 'wb') as f:
+        f.write(b'%PDF-1.4\n' + body)
+    return path
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_upload_with_taken_name_keeps_the_original(tmp_path):
+    store = PdfStore(str(tmp_path / 'pdfs'))
+    os.makedirs(store.folder)
+    original = write_pdf(tmp_path / 'original.pdf', b'original')
+    assert store.add('ESP8266.pdf', str(original)) == 'ESP8266.pdf'
+    original_path, original_sha = store.resolve('ESP8266.pdf')
+
+    upload = write_pdf(tmp_path / 'upload.pdf', b'someone else')
+    stored = store.add('ESP8266.pdf', str(upload))
+
+    assert stored != 'ESP8266.pdf'
+    assert stored.startswith('ESP8266-') and stored.endswith('.pdf')
+    assert store.resolve('ESP8266.pdf') == (original_path, original_sha)
+    assert read(store.resolve(stored)[0]).endswith(b'someone else')
+    store.collect_garbage()
+    assert read(original_path).endswith(b'original')
+
+
+def test_upload_does_not_shadow_a_loose_file(tmp_path):
+    store = PdfStore(str(tmp_path / 'pdfs'))
+    os.makedirs(store.folder)
+    loose = write_pdf(tmp_path / 'pdfs' / 'Relay.pdf', b'loose')
+    upload = write_pdf(tmp_path / 'upload.pdf', b'uploaded')
+
+    stored = store.add('Relay.pdf', str(upload))
+
+    assert stored != 'Relay.pdf'
+    assert store.resolve('Relay.pdf')[0] == str(loose)
+
+
+def test_same_content_under_the_same_name_is_kept_once(tmp_path):
+    store = PdfStore(str(tmp_path / 'pdfs'))
+    os.makedirs(store.folder)
+    first = write_pdf(tmp_path / 'a.pdf', b'same')
+    second = write_pdf(tmp_path / 'b.pdf', b'same')
+
+    assert store.add('Diode.pdf', str(first)) == 'Diode.pdf'
+    assert store.add('Diode.pdf', str(second)) == 'Diode.pdf'
+    assert store.aliases() == {'Diode.pdf': store.resolve('Diode.pdf')[1]}
+    assert len(os.listdir(store.blob_dir)) == 1
+
+
+def test_dedupe_folds_loose_files_under_their_own_names(tmp_path):
+    store = PdfStore(str(tmp_path / 'pdfs'))
+    os.makedirs(store.folder)
+    write_pdf(tmp_path / 'pdfs' / 'LED.pdf', b'led')
+    write_pdf(tmp_path / 'pdfs' / 'LED copy.pdf', b'led')
+
+    summary = store.dedupe()
+
+    assert sorted(store.aliases()) == ['LED copy.pdf', 'LED.pdf']
+    assert summary['blobs'] == 1
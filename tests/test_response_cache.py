@@ -0,0 +1,64 @@
+import sqlite3
+import time
+from contextlib import closing
+
+import pytest
+
+from response_cache import SQLiteCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SQLiteCache(str(tmp_path / 'response_cache.db'), ttl=1000, max_entries=100)
+
+
+@pytest.fixture
+def statements(cache, monkeypatch):
+    """SQL the cache runs from now on"""
+    seen = []
+    connect = cache._connect
+
+    def tracing_connect():
+        conn = connect()
+        conn.set_trace_callback(seen.append)
+        return conn
+
+    monkeypatch.setattr(cache, '_connect', tracing_connect)
+    return seen
+
+
+def writes(statements):
+    return [sql for sql in statements if sql.split(None, 1)[0].upper() in ('INSERT', 'UPDATE', 'DELETE', 'BEGIN')]
+
+
+def last_used(cache, key):
+    with closing(sqlite3.connect(cache.path)) as conn:
+        return conn.execute('SELECT last_used FROM response_cache WHERE key = ?', (key,)).fetchone()[0]
+
+
+def test_lookups_only_read(cache, statements):
+    cache.set('k', {'ai_response': 'cached'})
+    del statements[:]
+    for _ in range(5):
+        assert cache.get('k') == {'ai_response': 'cached'}
+        assert cache.get('missing') is None
+    assert writes(statements) == []
+    assert cache.stats() == {'backend': 'sqlite', 'hits': 5, 'misses': 5, 'entries': 1}
+
+
+def test_last_used_is_refreshed_once_it_is_old(cache):
+    cache.set('k', {'ai_response': 'cached'})
+    old = time.time() - cache.ttl * cache.LAST_USED_RESOLUTION - 1
+    with closing(sqlite3.connect(cache.path)) as conn, conn:
+        conn.execute('UPDATE response_cache SET last_used = ?', (old,))
+    assert cache.get('k') is not None
+    assert last_used(cache, 'k') > old + 1
+
+
+def test_expired_entries_are_misses(cache):
+    cache.set('k', {'ai_response': 'cached'})
+    with closing(sqlite3.connect(cache.path)) as conn, conn:
+        conn.execute('UPDATE response_cache SET created_at = ?', (time.time() - cache.ttl - 1,))
+    assert cache.get('k') is None
+    cache.set('other', {'ai_response': 'new'})
+    assert cache.stats()['entries'] == 1
@@ -0,0 +1,104 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+import app as app_module
+from config import Config, instance_secret_key
+
+
+@pytest.fixture
+def connections(app, monkeypatch):
+    """Counts the session store's database connections"""
+    interface = app.session_interface
+    opened = []
+    connect = interface._connect
+
+    def counting_connect():
+        opened.append(1)
+        return connect()
+
+    monkeypatch.setattr(interface, '_connect', counting_connect)
+    return opened
+
+
+def session_rows(app, sid=None):
+    with sqlite3.connect(app.config['SESSION_DB_PATH']) as conn:
+        if sid is None:
+            return conn.execute('SELECT count(*) FROM sessions').fetchone()[0]
+        return conn.execute('SELECT count(*) FROM sessions WHERE sid = ?', (sid,)).fetchone()[0]
+
+
+@pytest.mark.parametrize('path', ['/login', '/static/css/chat.css', '/metrics', '/pdfs/missing.pdf'])
+def test_cookieless_request_does_not_touch_the_session_store(app, connections, path):
+    response = app.test_client().get(path)
+    assert 'Set-Cookie' not in response.headers
+    assert connections == []
+
+
+def test_logout_deletes_the_stored_session(app, make_user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = make_user()
+        sid = session.sid
+    assert session_rows(app, sid) == 1
+    client.get('/logout')
+    assert session_rows(app, sid) == 0
+
+
+def test_regenerated_session_removes_the_old_id(app, make_user):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = make_user()
+        old_sid = session.sid
+    with client.session_transaction() as session:
+        session.regenerate()
+        new_sid = session.sid
+    assert session_rows(app, old_sid) == 0
+    assert session_rows(app, new_sid) == 1
+
+
+def test_secret_key_is_created_by_create_app_not_by_config(tmp_path):
+    class TestConfig(Config):
+        INSTANCE_PATH = str(tmp_path / 'instance')
+        SECRET_KEY = None
+
+    assert not os.path.exists(tmp_path / 'instance' / 'secret_key')
+    first = app_module.create_app(TestConfig)
+    second = app_module.create_app(TestConfig)
+    with open(tmp_path / 'instance' / 'secret_key') as f:
+        assert first.secret_key == second.secret_key == f.read().strip()
+
+
+def test_secret_key_from_the_environment_wins(tmp_path):
+    class TestConfig(Config):
+        INSTANCE_PATH = str(tmp_path / 'instance')
+        SECRET_KEY = 'from-the-environment'
+
+    assert app_module.create_app(TestConfig).secret_key == 'from-the-environment'
+    assert not os.path.exists(tmp_path / 'instance' / 'secret_key')
+
+
+def test_instance_secret_key_is_stable(tmp_path):
+    assert instance_secret_key(str(tmp_path)) == instance_secret_key(str(tmp_path))
+    assert os.listdir(tmp_path) == ['secret_key']
+
+
+def test_processes_starting_together_share_one_key(tmp_path):
+    """Workers racing to create the key all end up with the same, non-empty one"""
+    for attempt in range(20):
+        instance_path = str(tmp_path / str(attempt))
+        barrier = threading.Barrier(8)
+        keys = []
+
+        def start():
+            barrier.wait()
+            keys.append(instance_secret_key(instance_path))
+
+        threads = [threading.Thread(target=start) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(keys)) == 1 and keys[0]
@@ -0,0 +1,72 @@
+import pytest
+
+from response_cache import MemoryCache
+from similar_queries import SimilarQueries, SQLiteSimilarityLog, simhash, tag
+
+THRESHOLD = 0.9
+DIFFERENT_QUESTIONS = [
+    ("gpio 2", "gpio 4"),
+    ("type a", "type c"),
+    ("class a", "class b"),
+    ("4 band", "5 band"),
+    ("what is usb type a", "what is usb type c"),
+    ("esp8266 pinout", "esp32 pinout"),
+    # An extra content word asks something else, however few SimHash bits it moves
+    ("esp8266 wifi", "esp8266 wifi setup"),
+    ("esp8266 wifi setup", "esp8266 wifi"),
+    ("what is a voltage divider", "voltage divider calculator"),
+]
+
+
+def similar_queries(log=None):
+    cache = MemoryCache(ttl=3600, max_entries=100)
+    return cache, SimilarQueries(cache, THRESHOLD, ttl=3600, max_entries=100, log=log, sync_interval=0)
+
+
+def answer(cache, similar, query):
+    key = simhash(query).to_bytes(8, 'little').hex() * 4
+    cache.set(key, f"answer to {query}")
+    similar.add(query, key)
+
+
+@pytest.mark.parametrize('first, second', DIFFERENT_QUESTIONS)
+def test_questions_that_differ_in_a_word_number_or_letter_do_not_match(first, second):
+    cache, similar = similar_queries()
+    answer(cache, similar, first)
+    assert similar.lookup(second) is None
+
+
+@pytest.mark.parametrize('first, second', DIFFERENT_QUESTIONS)
+def test_shared_log_keeps_them_apart_too(tmp_path, first, second):
+    cache, similar = similar_queries(SQLiteSimilarityLog(str(tmp_path / 'cache.db'), ttl=3600))
+    answer(cache, similar, first)
+    assert similar.lookup(first) == f"answer to {first}"
+    assert similar.lookup(second) is None
+
+
+@pytest.mark.parametrize('rephrased', [
+    "ceramic capacitors explained", "how does a ceramic capacitor work", "capacitor, ceramic?",
+])
+def test_rephrased_question_still_matches(rephrased):
+    cache, similar = similar_queries()
+    answer(cache, similar, "what is a ceramic capacitor")
+    assert similar.lookup(rephrased) == "answer to what is a ceramic capacitor"
+
+
+def test_tags_are_the_set_of_content_words():
+    assert simhash("gpio 2") != simhash("gpio 4")
+    assert tag("what is type c") == tag("type c") != tag("type")
+    assert tag("GPIO 2 and 4") == tag("4 gpio 2") == tag("gpios 2 4 2")
+    assert tag("what is it") == 0
+
+
+@pytest.mark.parametrize('tag_column', ['', 'tag INTEGER NOT NULL, '])
+def test_log_from_before_word_tags_is_replaced(tmp_path, tag_column):
+    import sqlite3
+    path = str(tmp_path / 'cache.db')
+    with sqlite3.connect(path) as conn:
+        conn.execute('CREATE TABLE similar_queries (id INTEGER PRIMARY KEY, key TEXT NOT NULL, '
+                     f'simhash INTEGER NOT NULL, {tag_column}created_at REAL NOT NULL)')
+    log = SQLiteSimilarityLog(path, ttl=3600)
+    log.append('ab' * 32, 1, 2, 100.0)
+    assert [row[1:4] for row in log.since(0, 0)] == [('ab' * 32, 1, 2)]
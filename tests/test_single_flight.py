@@ -0,0 +1,142 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import FlightAbandoned, SingleFlight, SQLiteLease
+
+PIECES = ['The ', 'capacitor ', 'stores ', 'charge.']
+
+
+class Upstream:
+    """A streamed completion that only moves on when the test says so"""
+
+    def __init__(self):
+        self.calls = 0
+        self.step = threading.Semaphore(0)
+        self.closed = False
+
+    def produce(self):
+        self.calls += 1
+        try:
+            for piece in PIECES:
+                assert self.step.acquire(timeout=5)
+                yield piece
+        finally:
+            self.closed = True
+
+
+def follow_in_thread(flight, key, produce):
+    received = {'pieces': [], 'error': None}
+
+    def run():
+        try:
+            for piece in flight.stream(key, produce):
+                received['pieces'].append(piece)
+        except Exception as e:
+            received['error'] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, received
+
+
+def wait_for_follower(flight, key):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with flight.lock:
+            if flight.flights[key].followers:
+                return
+        time.sleep(0.01)
+    raise AssertionError("follower did not join")
+
+
+@pytest.mark.parametrize('lease', [False, True])
+def test_leader_closed_early_finishes_the_answer_for_its_followers(tmp_path, lease):
+    flight = SingleFlight(SQLiteLease(str(tmp_path / 'flight.db'), ttl=30) if lease else None, timeout=5)
+    upstream = Upstream()
+    leader = flight.stream('k', upstream.produce)
+    upstream.step.release()
+    assert next(leader) == 'The '
+
+    thread, received = follow_in_thread(flight, 'k', upstream.produce)
+    wait_for_follower(flight, 'k')
+    for _ in PIECES[1:]:
+        upstream.step.release()
+    leader.close()
+    thread.join(5)
+
+    assert received == {'pieces': PIECES, 'error': None}
+    assert upstream.calls == 1
+    assert flight.flights == {}
+    if lease:
+        # Other workers get the whole answer too
+        assert flight.lease.claim('k') == (None, ''.join(PIECES))
+
+
+def test_leader_closed_without_followers_stops_and_releases_the_lease(tmp_path):
+    lease = SQLiteLease(str(tmp_path / 'flight.db'), ttl=30)
+    flight = SingleFlight(lease, timeout=5)
+    upstream = Upstream()
+    leader = flight.stream('k', upstream.produce)
+    upstream.step.release()
+    next(leader)
+    leader.close()
+
+    assert upstream.closed
+    assert flight.flights == {}
+    # The next caller anywhere becomes the leader instead of waiting for a partial answer
+    owner, result = lease.claim('k')
+    assert owner is not None and result is None
+
+
+def test_follower_that_leaves_does_not_keep_the_leader_running():
+    flight = SingleFlight(None, timeout=5)
+    upstream = Upstream()
+    leader = flight.stream('k', upstream.produce)
+    upstream.step.release()
+    next(leader)
+
+    follower = flight.stream('k', upstream.produce)
+    upstream.step.release()
+    assert next(follower) == 'The '
+    follower.close()
+    leader.close()
+
+    assert upstream.closed
+    assert flight.flights == {}
+
+
+def test_abandoned_flight_error_is_only_for_flights_nobody_follows():
+    flight = SingleFlight(None, timeout=5)
+    upstream = Upstream()
+    leader = flight.stream('k', upstream.produce)
+    upstream.step.release()
+    next(leader)
+    state = flight.flights['k']
+    leader.close()
+    assert isinstance(state.error, FlightAbandoned) and state.followers == 0
+
+
+def test_do_shares_one_call():
+    flight = SingleFlight(None, timeout=5)
+    calls = []
+    started, release = threading.Event(), threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        assert release.wait(5)
+        return 'answer'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', slow)))
+    leader.start()
+    assert started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(flight.do('k', slow)))
+    follower.start()
+    wait_for_follower(flight, 'k')
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert results == ['answer', 'answer'] and calls == [1]